@@ -0,0 +1,1277 @@
+# Benchmarks for Kconfiglib. Generates synthetic Kconfig trees with a structure
+# loosely modeled on the Linux kernel (a top-level Kconfig that sources many
+# smaller files with menus, ifs, choices, selects, ranges, etc.) and times
+# various operations on them. Run it with
+#
+#  $ python benchmark.py [<benchmark> ...]
+#
+# from the Kconfiglib directory. With no arguments, all benchmarks are run.
+# The size of the generated trees can be tweaked with the constants below.
+
+from __future__ import print_function
+
+import gc
+import kconfiglib
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# Number of 'source'd files in the large synthetic tree, and number of
+# symbols in each
+N_FILES = 300
+SYMS_PER_FILE = 50
+
+# Length of the dependency chains used by the allconfig benchmark
+CHAIN_LEN = 300
+
+# Number of symbols that select the same symbol in the selects benchmark
+N_SELECTORS = 5000
+
+# Number of choices, and number of symbols in each, in the choices benchmark
+N_CHOICES = 100
+SYMS_PER_CHOICE = 50
+
+# Number of blocks of nested ifs, their depth, and the number of symbols in
+# each, in the shared_exprs benchmark
+N_NESTED = 100
+NESTING_DEPTH = 8
+SYMS_PER_NESTED = 20
+
+# Nesting depth of the deeply nested expressions in the exprs benchmark
+EXPR_NESTING_DEPTH = 10000
+
+def generate_tree(dirname, n_files=N_FILES, syms_per_file=SYMS_PER_FILE,
+                  seed=0):
+    """Generates a synthetic Kconfig tree in 'dirname' and returns the path to
+    its top-level Kconfig file."""
+    rand = random.Random(seed)
+
+    def sym_name(file_i, sym_i):
+        return "F{}_S{}".format(file_i, sym_i)
+
+    # Symbols with index 0 and 1 modulo 7 are the targets of selects and
+    # implies. They are never depended on and do not select or imply anything
+    # themselves, and other symbols only depend on symbols defined before
+    # them. That keeps the tree free of dependency loops, like real trees.
+    def is_target(sym_i):
+        return sym_i % 7 < 2
+
+    def dep_name(file_i, limit):
+        sym_i = rand.randrange(limit)
+        while is_target(sym_i):
+            sym_i = rand.randrange(limit)
+        return sym_name(file_i, sym_i)
+
+    with open(os.path.join(dirname, "Kconfig"), "w") as f:
+        f.write('mainmenu "Synthetic tree"\n\n'
+                "config MODULES\n"
+                '\tbool "Enable loadable module support"\n'
+                "\tdefault y\n\n"
+                "config CORE\n"
+                '\ttristate "Core"\n'
+                "\tdefault y\n\n")
+        for file_i in range(n_files):
+            f.write('source "K{}"\n'.format(file_i))
+
+    for file_i in range(n_files):
+        lines = ['menu "Menu {}"\n'.format(file_i),
+                 "\tdepends on CORE\n\n"]
+
+        for sym_i in range(syms_per_file):
+            name = sym_name(file_i, sym_i)
+
+            # Every tenth symbol starts an 'if' block containing the next few
+            # symbols
+            if sym_i % 10 == 5:
+                lines.append("if {}\n\n".format(dep_name(file_i, sym_i)))
+
+            if sym_i % 25 == 12:
+                # A choice with a few members
+                lines.append('choice\n\tprompt "Choice {}"\n'
+                             "\tdefault {}_C2\n\n".format(name, name))
+                for choice_i in range(4):
+                    lines.append('config {}_C{}\n\tbool "{} choice {}"\n\n'
+                                 .format(name, choice_i, name, choice_i))
+                lines.append("endchoice\n\n")
+
+            kind = sym_i % 7
+            if kind == 6:
+                lines.append('config {}\n\tint "{}"\n\trange 0 {}\n'
+                             "\tdefault {}\n\n"
+                             .format(name, name, 10*sym_i + 10, sym_i))
+            elif kind == 5:
+                lines.append('config {}\n\tstring "{}"\n\tdefault "{}"\n\n'
+                             .format(name, name, name.lower()))
+            else:
+                lines.append("config {}\n\t{} \"{}\"\n"
+                             .format(name,
+                                     "tristate" if kind % 2 else "bool",
+                                     name))
+                # Dependencies on earlier symbols in this file and in earlier
+                # files
+                if sym_i > 2:
+                    lines.append("\tdepends on {}\n"
+                                 .format(dep_name(file_i, sym_i)))
+                if file_i > 0 and rand.random() < 0.3:
+                    lines.append("\tdepends on {} || {}\n".format(
+                      dep_name(rand.randrange(file_i), syms_per_file),
+                      dep_name(rand.randrange(file_i), syms_per_file)))
+                if rand.random() < 0.5:
+                    lines.append("\tdefault {}\n".format(
+                      rand.choice(("y", "m", "CORE"))))
+                if not is_target(sym_i) and rand.random() < 0.2:
+                    lines.append("\tselect {}\n".format(
+                      sym_name(rand.randrange(n_files),
+                               rand.randrange(0, syms_per_file, 7))))
+                if not is_target(sym_i) and rand.random() < 0.1:
+                    lines.append("\timply {}\n".format(
+                      sym_name(rand.randrange(n_files),
+                               rand.randrange(1, syms_per_file, 7))))
+                lines.append("\thelp\n\t  Help text for {}.\n\n".format(name))
+
+            if sym_i % 10 == 9:
+                lines.append("endif\n\n")
+
+        lines.append("endmenu\n")
+
+        with open(os.path.join(dirname, "K{}".format(file_i)), "w") as f:
+            f.writelines(lines)
+
+    return os.path.join(dirname, "Kconfig")
+
+def timed(fn, *args):
+    """Calls 'fn' with 'args' and returns (<time in seconds>, <result>)."""
+    # Do not charge the cleanup of earlier benchmarks to this one
+    gc.collect()
+    start = time.time()
+    res = fn(*args)
+    return (time.time() - start, res)
+
+def best_of(n, fn, *args):
+    """Calls 'fn' with 'args' 'n' times and returns the shortest time in
+    seconds. Less sensitive to noise than a single run."""
+    return min([timed(fn, *args)[0] for _ in range(n)])
+
+def allocated(fn, *args):
+    """Returns the number of bytes allocated by calling 'fn' with 'args' that
+    are still in use while its result is alive, or None if tracemalloc isn't
+    available (Python 2)."""
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        # Keep the result alive until the memory in use has been read
+        res = fn(*args)
+        n_bytes = tracemalloc.get_traced_memory()[0]
+        del res
+        return n_bytes
+    finally:
+        tracemalloc.stop()
+
+def report(what, seconds):
+    print("  {:<50} {:8.3f} s".format(what, seconds))
+
+#
+# Benchmarks
+#
+
+def bench_parse_cache(dirname, kconfig):
+    """Parsing with and without the parse cache."""
+    cache_file = os.path.join(dirname, "Kconfig.cache")
+
+    parse_t, _ = timed(kconfiglib.Config, kconfig, dirname)
+    report("Parse (no cache)", parse_t)
+    t, _ = timed(kconfiglib.Config, kconfig, dirname, True, False, cache_file)
+    report("Parse and write cache (cold, {:.1f}x parse)".format(t/parse_t), t)
+    t = best_of(3, kconfiglib.Config, kconfig, dirname, True, False,
+                cache_file)
+    report("Load from cache (warm, {:.1f}x faster)".format(parse_t/t), t)
+
+def bench_reparse(dirname, kconfig):
+    """Reparsing after a change to a single file."""
+    config = kconfiglib.Config(kconfig, dirname)
+    changed = os.path.join(dirname, "K{}".format(N_FILES//2))
+    with open(changed, "a") as f:
+        f.write('config ADDED\n\tbool "added"\n\tselect F0_S0\n')
+
+    t, _ = timed(config.reparse, [changed])
+    report("Incremental reparse", t)
+    t, _ = timed(kconfiglib.Config, kconfig, dirname)
+    report("Full parse", t)
+
+def bench_eval(dirname, kconfig):
+    """Evaluation of expressions and symbol values."""
+    config = kconfiglib.Config(kconfig, dirname)
+    syms = config.get_symbols(False)
+
+    # All conditions, selects, and implies in the tree
+    exprs = []
+    for sym in syms:
+        exprs.extend([cond for _, cond in sym.prompts])
+        exprs.extend([cond for _, cond in sym.def_exprs])
+        exprs.append(sym.rev_dep)
+        exprs.append(sym.weak_rev_dep)
+    fns = [kconfiglib._compile_expr(expr, config) for expr in exprs]
+
+    # Evaluate once first so that all symbol values are cached. This measures
+    # the overhead of the evaluators themselves.
+    for sym in syms:
+        sym.get_value()
+
+    def eval_tree_walking():
+        for expr in exprs:
+            config._eval_tri(expr)
+
+    def eval_compiled():
+        for fn in fns:
+            fn()
+
+    for what, fn in (("Tree-walking evaluation", eval_tree_walking),
+                     ("Compiled evaluation", eval_compiled)):
+        t = best_of(5, fn)
+        report("{} ({} expressions/s)".format(what, int(len(exprs)/t)), t)
+
+    def recalc():
+        config._invalidate_all()
+        for sym in syms:
+            sym.get_value()
+
+    t = best_of(5, recalc)
+    report("Recalculating all values ({} symbols/s)"
+           .format(int(len(syms)/t)), t)
+
+def bench_toggle(dirname, kconfig):
+    """Toggling symbols with all values cached, as in an interactive
+    front-end."""
+    config = kconfiglib.Config(kconfig, dirname)
+    syms = config.get_symbols(False)
+    rand = random.Random(0)
+    toggled = rand.sample([sym for sym in syms
+                           if sym.get_type() == kconfiglib.BOOL], 200)
+    # The dependent symbols of each toggled symbol, found up front so that
+    # the graph traversal isn't included in the timings
+    dependent = dict([(sym, sym._get_dependent()) for sym in toggled])
+
+    def read_dependent(sym):
+        # Reads the values a front-end would need to refresh
+        sym.get_value()
+        for s in dependent[sym]:
+            s.get_value()
+
+    def toggle_invalidate():
+        # What Symbol.set_user_value() used to do: invalidate all symbols that
+        # might depend on the symbol
+        for sym in toggled:
+            sym._set_user_value_no_invalidate(
+              "n" if sym.get_value() == "y" else "y", False)
+            sym._invalidate()
+            for s in dependent[sym]:
+                s._invalidate()
+            read_dependent(sym)
+
+    def toggle_propagate():
+        for sym in toggled:
+            sym.set_user_value("n" if sym.get_value() == "y" else "y")
+            read_dependent(sym)
+
+    for sym in syms:
+        sym.get_value()
+    for what, fn in (("Toggle with invalidation", toggle_invalidate),
+                     ("Toggle with change propagation", toggle_propagate)):
+        t = best_of(3, fn)
+        report("{} ({:.2f} ms/toggle)".format(what, 1000*t/len(toggled)), t)
+
+    modules = config["MODULES"]
+
+    def toggle_modules_invalidate():
+        for val in "ny":
+            modules._set_user_value_no_invalidate(val, False)
+            config._invalidate_all()
+            for sym in syms:
+                sym.get_value()
+
+    def toggle_modules_propagate():
+        for val in "ny":
+            modules.set_user_value(val)
+            for sym in syms:
+                sym.get_value()
+
+    for what, fn in (("Toggle MODULES with invalidation",
+                      toggle_modules_invalidate),
+                     ("Toggle MODULES with change propagation",
+                      toggle_modules_propagate)):
+        report(what, best_of(3, fn)/2)
+    print("  Symbols that might depend on MODULES: {} of {}"
+          .format(len(config._get_modules_dep()), len(config.syms)))
+
+    # Count the symbols recalculated per toggle (the rest are unchanged)
+    n_invalidated = [0]
+    invalidate = kconfiglib.Symbol._invalidate
+    def counting_invalidate(sym):
+        n_invalidated[0] += 1
+        invalidate(sym)
+    kconfiglib.Symbol._invalidate = counting_invalidate
+    try:
+        for sym in toggled:
+            sym.set_user_value("n" if sym.get_value() == "y" else "y")
+    finally:
+        kconfiglib.Symbol._invalidate = invalidate
+    n_deps = sum([len(deps) for deps in dependent.values()])
+    print("  Symbols invalidated per toggle: {:.1f} with propagation, {:.1f} "
+          "with invalidation".format(n_invalidated[0]/float(len(toggled)),
+                                     n_deps/float(len(toggled))))
+
+def bench_dep_graph(dirname, kconfig):
+    """Memory use and speed of the dependency graph, compared to caching the
+    set of dependent symbols for each symbol."""
+    config = kconfiglib.Config(kconfig, dirname)
+    syms = list(config.syms_iter())
+    invalidated = random.Random(0).sample(syms, 200)
+
+    def closure_sets():
+        # What Symbol._get_dependent() used to do: calculate the sets lazily
+        # and cache them for each symbol
+        cache = {}
+        def get_dependent(sym):
+            if sym in cache:
+                return cache[sym]
+            res = set(sym.dep)
+            for s in sym.dep:
+                res |= get_dependent(s)
+            if sym.is_choice_sym:
+                for sibling in sym.parent.actual_symbols:
+                    if sibling is not sym:
+                        res.add(sibling)
+                        res |= sibling.dep
+                        for s in sibling.dep:
+                            res |= get_dependent(s)
+            cache[sym] = res
+            return res
+        return get_dependent
+
+    def dep_graph():
+        graph = kconfiglib._DepGraph(syms)
+        def get_dependent(sym):
+            return graph.reachable((sym,))
+        return get_dependent
+
+    def invalidate(get_dependent):
+        for sym in invalidated:
+            for s in get_dependent(sym):
+                s._invalidate()
+
+    def invalidate_cold(make_get_dependent):
+        invalidate(make_get_dependent())
+
+    def invalidate_all(make_get_dependent):
+        get_dependent = make_get_dependent()
+        for sym in syms:
+            get_dependent(sym)
+        return get_dependent
+
+    for what, make_get_dependent in (("Closure sets", closure_sets),
+                                     ("Dependency graph", dep_graph)):
+        print("  {}:".format(what))
+        report("  First invalidation (includes building)",
+               best_of(3, invalidate_cold, make_get_dependent))
+        report("  Later invalidations",
+               best_of(3, invalidate, make_get_dependent()))
+        mem = allocated(invalidate_all, make_get_dependent)
+        if mem is not None:
+            print("    Memory after use for all symbols: {:.1f} MB"
+                  .format(mem/1e6))
+
+def bench_load_config(dirname, kconfig):
+    """Loading a sequence of similar .config files into the same Config, and
+    reading all values after each load."""
+    config = kconfiglib.Config(kconfig, dirname)
+    syms = config.get_symbols(False)
+    bools = [sym for sym in syms if sym.get_type() == kconfiglib.BOOL]
+    rand = random.Random(0)
+
+    # Configurations that differ from the previous one in a few symbols
+    filenames = []
+    for i in range(20):
+        for sym in rand.sample(bools, 5):
+            sym.set_user_value(rand.choice(("n", "y")))
+        filename = os.path.join(dirname, "config_{}".format(i))
+        config.write_config(filename)
+        filenames.append(filename)
+
+    def read_all():
+        for sym in syms:
+            sym.get_value()
+
+    def load_invalidate():
+        # What load_config() used to do: invalidate all symbols
+        for filename in filenames:
+            config.unset_user_values()
+            config.load_config(filename)
+            read_all()
+
+    def load_differential():
+        for filename in filenames:
+            config.load_config(filename)
+            read_all()
+
+    config.load_config(filenames[-1])
+    read_all()
+    config._get_dep_graph()
+    for what, fn in (("Load with invalidation", load_invalidate),
+                     ("Differential load", load_differential)):
+        t = best_of(3, fn)
+        report("{} ({:.1f} ms/load)".format(what, 1000*t/len(filenames)), t)
+
+def bench_set_user_values(dirname, kconfig):
+    """Setting many user values with individual Symbol.set_user_value() calls
+    and with a single Config.set_user_values() call."""
+    config = kconfiglib.Config(kconfig, dirname)
+    syms = config.get_symbols(False)
+    bools = [sym for sym in syms if sym.get_type() == kconfiglib.BOOL]
+    rand = random.Random(0)
+
+    def read_all():
+        for sym in syms:
+            sym.get_value()
+
+    for n in (10, 100, 1000):
+        # Symbols early in the tree, which have many dependent symbols in
+        # common
+        changed = bools[:n]
+        # Alternate between two sets of values, so that every call changes
+        # something
+        values = [dict([(sym.name, rand.choice(("n", "y")))
+                        for sym in changed]) for _ in range(2)]
+
+        def set_individually(vals):
+            for name, val in vals.items():
+                config[name].set_user_value(val)
+
+        def set_batched(vals):
+            config.set_user_values(vals)
+
+        def time_sets(set_fn):
+            # Only the setting is timed. The values are read in between, as
+            # propagation stops at symbols without cached values.
+            t = 0
+            for vals in values:
+                read_all()
+                t += timed(set_fn, vals)[0]
+            return t
+
+        read_all()
+        config._get_dep_graph()
+        print("  {} symbols:".format(n))
+        for what, set_fn in (("  Individual set_user_value() calls",
+                              set_individually),
+                             ("  One set_user_values() call", set_batched)):
+            t = min([time_sets(set_fn) for _ in range(3)])
+            report(what, t/len(values))
+
+def bench_allconfig(dirname, kconfig):
+    """allyesconfig and allnoconfig with the fixed-point loops from
+    examples/allyesconfig.py and examples/allnoconfig.py, and with
+    Config.allyes() and Config.allno()."""
+    def loop_allyes(config):
+        non_choice_syms = [sym for sym in config.get_symbols()
+                           if not sym.is_choice_symbol()]
+        done = False
+        while not done:
+            done = True
+            for sym in non_choice_syms:
+                upper_bound = sym.get_upper_bound()
+                if upper_bound is not None and \
+                   kconfiglib.tri_less(sym.get_value(), upper_bound):
+                    sym.set_user_value(upper_bound)
+                    done = False
+            for choice in config.get_choices():
+                if choice.get_visibility() == "y":
+                    selection = choice.get_selection_from_defaults()
+                    if selection is not None and \
+                       selection is not choice.get_user_selection():
+                        selection.set_user_value("y")
+                        done = False
+                elif choice.get_visibility() == "m":
+                    for sym in choice.get_symbols():
+                        if sym.get_value() != "m" and \
+                           sym.get_upper_bound() != "n":
+                            sym.set_user_value("m")
+                            done = False
+
+    def loop_allno(config):
+        for sym in config:
+            if sym.get_type() in (kconfiglib.BOOL, kconfiglib.TRISTATE) and \
+               sym.is_allnoconfig_y():
+                sym.set_user_value("y")
+        done = False
+        while not done:
+            done = True
+            for sym in config:
+                if not sym.is_choice_symbol() and not sym.is_allnoconfig_y():
+                    lower_bound = sym.get_lower_bound()
+                    if lower_bound is not None and \
+                       kconfiglib.tri_less(lower_bound, sym.get_value()):
+                        sym.set_user_value(lower_bound)
+                        done = False
+
+    # Chains of symbols where each symbol depends on or is selected by the
+    # symbol defined after it, so that each pass of the loops only gets one
+    # symbol further. The kernel has many shorter chains like these.
+    chain_kconfig = os.path.join(dirname, "Kchain")
+    with open(chain_kconfig, "w") as f:
+        for i in range(CHAIN_LEN):
+            f.write('config DEP_{}\n\tbool "dep {}"\n'.format(i, i))
+            if i < CHAIN_LEN - 1:
+                f.write("\tdepends on DEP_{}\n".format(i + 1))
+            f.write('\nconfig SEL_{}\n\tbool "sel {}"\n\tdefault y\n'
+                    .format(i, i))
+            if i > 0:
+                f.write("\tselect SEL_{}\n".format(i - 1))
+            f.write("\n")
+
+    def run(filename, fn):
+        # Start out with all values cached and the dependency graph built,
+        # like after loading a .config, so only the fixed-point search is
+        # timed
+        config = kconfiglib.Config(filename, dirname)
+        for sym in config.syms_iter():
+            sym.get_value()
+        config._get_dep_graph()
+        return timed(fn, config)[0]
+
+    for tree, filename in (("synthetic tree", kconfig),
+                           ("chain of {}".format(CHAIN_LEN), chain_kconfig)):
+        print("  {}:".format(tree))
+        for what, fn in (("  Example allyesconfig loop", loop_allyes),
+                         ("  Config.allyes()", kconfiglib.Config.allyes),
+                         ("  Example allnoconfig loop", loop_allno),
+                         ("  Config.allno()", kconfiglib.Config.allno)):
+            report(what, min([run(filename, fn) for _ in range(3)]))
+
+def bench_randconfig(dirname, kconfig):
+    """Generating random configurations by setting random values with
+    Symbol.set_user_value(), and with Config.randconfig()."""
+    config = kconfiglib.Config(kconfig, dirname)
+    rand = random.Random(0)
+    n_configs = 10
+
+    def set_random():
+        # A single pass in definition order. This doesn't even give the
+        # symbols that a later symbol's value turns on a chance.
+        for _ in range(n_configs):
+            config.unset_user_values()
+            for sym in config:
+                if sym.get_type() in (kconfiglib.BOOL, kconfiglib.TRISTATE) \
+                   and not sym.is_choice_symbol():
+                    assignable = sym.get_assignable_values()
+                    if assignable:
+                        sym.set_user_value(rand.choice(assignable))
+            for choice in config.get_choices():
+                visible = [sym for sym in choice.get_symbols()
+                           if sym.get_visibility() != "n"]
+                if visible:
+                    rand.choice(visible).set_user_value("y")
+
+    def randconfigs():
+        for _ in config.randconfigs(n_configs, seed=0):
+            pass
+
+    def randconfigs_write():
+        for _ in config.randconfigs(n_configs, seed=0):
+            config.write_config(os.path.join(dirname, ".config"))
+
+    config._get_dep_graph()
+    for what, fn in (("set_user_value() with random values", set_random),
+                     ("Config.randconfigs()", randconfigs),
+                     ("Config.randconfigs() and write_config()",
+                      randconfigs_write)):
+        t = best_of(3, fn)
+        report("{} ({:.0f} ms/config)".format(what, 1000*t/n_configs), t)
+
+def bench_load_configs(dirname, kconfig):
+    """Loading many defconfig files and writing out the full configuration
+    for each, in the current process and spread over worker processes with
+    Config.load_configs()."""
+    config = kconfiglib.Config(kconfig, dirname)
+    bools = [sym.get_name() for sym in config
+             if sym.get_type() == kconfiglib.BOOL and
+                not sym.is_choice_symbol()]
+    rand = random.Random(0)
+
+    # Defconfig-like files, with a few assignments each
+    defconfigs_dir = os.path.join(dirname, "defconfigs")
+    out_dir = os.path.join(dirname, "out")
+    os.mkdir(defconfigs_dir)
+    os.mkdir(out_dir)
+    filenames = []
+    for i in range(100):
+        filename = os.path.join(defconfigs_dir, "board{}_defconfig".format(i))
+        with open(filename, "w") as f:
+            f.write("CONFIG_CORE=y\n")
+            for name in rand.sample(bools, 20):
+                f.write("CONFIG_{}={}\n".format(name, rand.choice("ny")))
+        filenames.append(filename)
+
+    def write(config, filename):
+        config.write_config(os.path.join(out_dir,
+                                         os.path.basename(filename)))
+
+    cpus = multiprocessing.cpu_count()
+    for processes in sorted(set((1, 2, cpus))):
+        def run():
+            return [seconds for _, _, seconds in
+                    config.load_configs(filenames, write, processes)]
+        t, times = timed(run)
+        report("{} process(es) ({:.1f} ms/defconfig in the workers)"
+               .format(processes, 1000*sum(times)/len(times)), t)
+    print("  CPUs: {}".format(cpus))
+
+def bench_states(dirname, kconfig):
+    """Keeping several configurations around as separate Config instances
+    and as ValueStates of a single Config, and switching between them."""
+    config = kconfiglib.Config(kconfig, dirname)
+    n_configs = 5
+
+    def read_all(config):
+        for sym in config.syms_iter():
+            sym.get_value()
+
+    def make_configs():
+        configs = []
+        for seed in range(n_configs):
+            c = kconfiglib.Config(kconfig, dirname)
+            c.randconfig(seed)
+            read_all(c)
+            configs.append(c)
+        return configs
+
+    def make_states():
+        states = []
+        for seed in range(n_configs):
+            config.randconfig(seed)
+            read_all(config)
+            states.append(config.get_state())
+        return states
+
+    for what, fn in (("Config instances", make_configs),
+                     ("ValueStates", make_states)):
+        t, _ = timed(fn)
+        report("Creating {} {}".format(n_configs, what), t)
+        mem = allocated(fn)
+        if mem is not None:
+            print("    Memory: {:.1f} MB".format(mem/1e6))
+
+    states = make_states()
+
+    def switch():
+        for state in states:
+            config.set_state(state)
+            read_all(config)
+
+    def load():
+        for seed in range(n_configs):
+            config.randconfig(seed)
+            read_all(config)
+
+    for what, fn in (("Switching with set_state()", switch),
+                     ("Regenerating the values", load)):
+        t = best_of(3, fn)
+        report("{} ({:.1f} ms/config)".format(what, 1000*t/n_configs), t)
+
+def bench_snapshot(dirname, kconfig):
+    """Trying out a change to a symbol and undoing it ("what if"), with all
+    values cached."""
+    config = kconfiglib.Config(kconfig, dirname)
+    syms = config.get_symbols(False)
+    rand = random.Random(0)
+    toggled = rand.sample([sym for sym in syms
+                           if sym.get_type() == kconfiglib.BOOL], 200)
+    dependent = dict([(sym, sym._get_dependent()) for sym in toggled])
+
+    def try_change(sym):
+        sym.set_user_value("n" if sym.get_value() == "y" else "y")
+        for s in dependent[sym]:
+            s.get_value()
+
+    def undo_unset():
+        for sym in toggled:
+            try_change(sym)
+            sym.unset_user_value()
+            for s in dependent[sym]:
+                s.get_value()
+
+    def undo_set_state():
+        state = config.get_state()
+        for sym in toggled:
+            try_change(sym)
+            config.set_state(state)
+
+    def undo_restore():
+        snapshot = config.snapshot()
+        for sym in toggled:
+            try_change(sym)
+            config.restore(snapshot)
+        config.discard_snapshot(snapshot)
+
+    for sym in syms:
+        sym.get_value()
+    for what, fn in (("Undo with unset_user_value()", undo_unset),
+                     ("Undo with set_state()", undo_set_state),
+                     ("Undo with restore()", undo_restore)):
+        t = best_of(3, fn)
+        report("{} ({:.3f} ms/change)".format(what, 1000*t/len(toggled)), t)
+
+def bench_what_if(dirname, kconfig):
+    """Finding the symbols affected by changing a symbol, without changing
+    the configuration."""
+    config = kconfiglib.Config(kconfig, dirname)
+    syms = config.get_symbols(False)
+    rand = random.Random(0)
+    toggled = rand.sample([sym for sym in syms
+                           if sym.get_type() == kconfiglib.BOOL], 200)
+
+    def states():
+        return [(sym.get_value(), sym.get_visibility(), sym.write_to_conf)
+                for sym in syms]
+
+    def compare_all():
+        # Comparing every symbol before and after the change
+        for sym in toggled:
+            old_states = states()
+            sym.set_user_value("n" if sym.get_value() == "y" else "y")
+            [s for s, old, new in zip(syms, old_states, states())
+             if old != new]
+            sym.unset_user_value()
+
+    n_changed = [0]
+
+    def what_if():
+        for sym in toggled:
+            n_changed[0] += len(config.what_if(
+              {sym.get_name(): "n" if sym.get_value() == "y" else "y"}))
+
+    for sym in syms:
+        sym.get_value()
+    for what, fn in (("Comparing all symbols", compare_all),
+                     ("what_if()", what_if)):
+        t = best_of(3, fn)
+        report("{} ({:.3f} ms/change)".format(what, 1000*t/len(toggled)), t)
+    print("  Symbols affected per change: {:.1f}"
+          .format(n_changed[0]/(3.0*len(toggled))))
+
+def generate_select_tree(dirname):
+    """Generates a Kconfig file in 'dirname' where one symbol is selected (and
+    another implied) by N_SELECTORS symbols, and returns its path."""
+    select_kconfig = os.path.join(dirname, "Kselect")
+    with open(select_kconfig, "w") as f:
+        f.write('config SELECTED\n\ttristate "selected"\n\n'
+                'config IMPLIED\n\ttristate "implied"\n\n')
+        for i in range(N_SELECTORS):
+            f.write('config SELECTOR_{}\n\tbool "selector {}"\n'
+                    '\tselect SELECTED\n\timply IMPLIED if SELECTOR_{}\n\n'
+                    .format(i, i, (i + 1) % N_SELECTORS))
+    return select_kconfig
+
+def bench_selects(dirname, kconfig):
+    """Parsing a tree where one symbol is selected (and another implied) by
+    many symbols, with the select and imply terms added to the rev_dep and
+    weak_rev_dep expressions one by one, and in one go after parsing."""
+    select_kconfig = generate_select_tree(dirname)
+
+    def one_by_one(e, terms):
+        for term in terms:
+            e = kconfiglib._make_or(e, term)
+        return e
+
+    make_or_terms = kconfiglib._make_or_terms
+    for what, fn in (("One by one", one_by_one),
+                     ("In one go", make_or_terms)):
+        kconfiglib._make_or_terms = fn
+        try:
+            t = best_of(3, kconfiglib.Config, select_kconfig, dirname)
+        finally:
+            kconfiglib._make_or_terms = make_or_terms
+        report("{} ({} selectors)".format(what, N_SELECTORS), t)
+
+def bench_selectors(dirname, kconfig):
+    """Toggling one of many symbols that select (and imply) the same symbols
+    and reading the values and bounds of the selected symbols, with the
+    rev_dep and weak_rev_dep terms evaluated one by one, and counted."""
+    select_kconfig = generate_select_tree(dirname)
+
+    def toggle(config):
+        syms = [config["SELECTED"], config["IMPLIED"]]
+        selectors = [config["SELECTOR_{}".format(i)]
+                     for i in range(0, N_SELECTORS, N_SELECTORS//100)]
+        for sym in syms:
+            sym.get_value()
+
+        def run():
+            for selector in selectors:
+                selector.set_user_value("y")
+                for sym in syms:
+                    sym.get_value()
+                    sym.get_upper_bound()
+                    sym.get_lower_bound()
+                    sym.get_assignable_values()
+                selector.set_user_value("n")
+                for sym in syms:
+                    sym.get_value()
+
+        return best_of(3, run), 2*len(selectors)
+
+    min_counted_terms = kconfiglib._MIN_COUNTED_TERMS
+    for what, min_terms in (("Evaluating all terms", N_SELECTORS + 1),
+                            ("Counting terms", min_counted_terms)):
+        kconfiglib._MIN_COUNTED_TERMS = min_terms
+        try:
+            t, n = toggle(kconfiglib.Config(select_kconfig, dirname))
+        finally:
+            kconfiglib._MIN_COUNTED_TERMS = min_counted_terms
+        report("{} ({:.3f} ms/toggle)".format(what, 1000*t/n), t)
+
+def bench_bounds(dirname, kconfig):
+    """Redrawing all symbols, as in a menuconfig-style interface, after
+    toggling a symbol, with the bounds of the symbols calculated on each call
+    and cached."""
+    config = kconfiglib.Config(kconfig, dirname)
+    syms = config.get_symbols(False)
+    rand = random.Random(0)
+    toggled = rand.sample([sym for sym in syms
+                           if sym.get_type() == kconfiglib.BOOL], 20)
+
+    def redraw(uncached):
+        for sym in syms:
+            sym.get_value()
+            for method in (sym.get_lower_bound, sym.get_upper_bound,
+                           sym.get_assignable_values, sym.is_modifiable):
+                if uncached:
+                    sym.cached_bounds = None
+                method()
+
+    def toggle_and_redraw(uncached):
+        for sym in toggled:
+            sym.set_user_value("n" if sym.get_value() == "y" else "y")
+            redraw(uncached)
+
+    redraw(False)
+    for what, uncached in (("Calculating the bounds on each call", True),
+                           ("Caching the bounds", False)):
+        t = best_of(3, toggle_and_redraw, uncached)
+        report("{} ({:.1f} ms/redraw)".format(what, 1000*t/len(toggled)), t)
+
+    _, misses_before = config.get_bounds_cache_stats()
+    toggle_and_redraw(False)
+    _, misses = config.get_bounds_cache_stats()
+    print("  Bounds calculated per redraw: {:.1f} of {} symbols"
+          .format((misses - misses_before)/float(len(toggled)), len(syms)))
+
+def bench_menus(dirname, kconfig):
+    """Rendering the menu tree, as in a menuconfig-style interface, after
+    toggling a symbol. An item is shown if the menus that contain it are
+    visible, so menu visibilities are looked up for each item."""
+    config = kconfiglib.Config(kconfig, dirname)
+    items = config.get_top_level_items()
+    rand = random.Random(0)
+    toggled = rand.sample([sym for sym in config.get_symbols(False)
+                           if sym.get_type() == kconfiglib.BOOL], 20)
+
+    def is_shown(item, uncached):
+        while item is not None:
+            if isinstance(item, (kconfiglib.Menu, kconfiglib.Comment)):
+                if uncached:
+                    item.cached_visibility = None
+                    item.cached_visible_if_visibility = None
+                if item.get_visibility() == "n" or \
+                   (isinstance(item, kconfiglib.Menu) and
+                    item.get_visible_if_visibility() == "n"):
+                    return False
+            item = item.get_parent()
+        return True
+
+    def render(block, uncached):
+        for item in block:
+            is_shown(item, uncached)
+            if isinstance(item, (kconfiglib.Menu, kconfiglib.Choice)):
+                render(item.get_items(), uncached)
+
+    def toggle_and_render(uncached):
+        for sym in toggled:
+            sym.set_user_value("n" if sym.get_value() == "y" else "y")
+            render(items, uncached)
+
+    render(items, False)
+    for what, uncached in (("Evaluating menu visibilities on each call",
+                            True),
+                           ("Caching menu visibilities", False)):
+        t = best_of(3, toggle_and_render, uncached)
+        report("{} ({:.1f} ms/render)".format(what, 1000*t/len(toggled)), t)
+
+def generate_nested_tree(dirname, redundant=False):
+    """Generates a Kconfig file in 'dirname' with N_NESTED blocks of
+    NESTING_DEPTH nested ifs, with SYMS_PER_NESTED symbols in the innermost
+    if of each, and returns its path. If 'redundant' is True, the symbols
+    also repeat conditions that are implied by the enclosing ifs, as is
+    common in real Kconfig files."""
+    nested_kconfig = os.path.join(dirname, "Knested_redundant" if redundant
+                                           else "Knested")
+    with open(nested_kconfig, "w") as f:
+        f.write('config MODULES\n\tbool "modules"\n\toption modules\n'
+                '\tdefault y\n\n')
+        for block_i in range(N_NESTED):
+            for depth_i in range(NESTING_DEPTH):
+                f.write('config N{}_D{}\n\ttristate "dep {}"\n'
+                        '\tdefault y\n\n'
+                        'if N{}_D{}\n\n'
+                        .format(block_i, depth_i, depth_i, block_i, depth_i))
+            for sym_i in range(SYMS_PER_NESTED):
+                f.write('config N{}_S{}\n\ttristate "sym {}"\n'
+                        .format(block_i, sym_i, sym_i))
+                if redundant:
+                    f.write('\tdepends on N{}_D{}\n'
+                            '\tdefault y if N{}_D0 || N{}_S0\n'
+                            .format(block_i, NESTING_DEPTH - 1,
+                                    block_i, block_i))
+                f.write('\tdefault y\n\n')
+            f.write("endif\n\n"*NESTING_DEPTH)
+    return nested_kconfig
+
+def generate_choice_tree(dirname):
+    """Generates a Kconfig file in 'dirname' with N_CHOICES tristate choices
+    of SYMS_PER_CHOICE symbols each, and returns its path."""
+    choice_kconfig = os.path.join(dirname, "Kchoice")
+    with open(choice_kconfig, "w") as f:
+        f.write('config MODULES\n\tbool "modules"\n\toption modules\n'
+                '\tdefault y\n\n')
+        for choice_i in range(N_CHOICES):
+            f.write('config CHOICE_DEP_{}\n\ttristate "dep {}"\n'
+                    '\tdefault y\n\n'
+                    'choice\n\ttristate "choice {}"\n'
+                    '\tdepends on CHOICE_DEP_{}\n\n'
+                    .format(choice_i, choice_i, choice_i, choice_i))
+            for sym_i in range(SYMS_PER_CHOICE):
+                f.write('config C{}_S{}\n\ttristate "sym {}"\n\n'
+                        .format(choice_i, sym_i, sym_i))
+            f.write("endchoice\n\n")
+    return choice_kconfig
+
+def bench_choices(dirname, kconfig):
+    """Calculating the values and visibilities of the symbols in many large
+    choices from scratch, with the mode of each choice calculated on each
+    lookup, and cached."""
+    config = kconfiglib.Config(generate_choice_tree(dirname), dirname)
+    choices = config.get_choices()
+    syms = [sym for choice in choices for sym in choice.get_symbols()]
+
+    # Put every other choice in "y" mode
+    for choice in choices[::2]:
+        choice.get_symbols()[-1].set_user_value("y")
+
+    # Count the mode lookups, and how many of them calculate the mode. The
+    # cached mode is dropped before each lookup when measuring without the
+    # cache.
+    calls = [0, 0]
+    uncached = [False]
+    get_tri_mode = kconfiglib.Choice._get_tri_mode
+
+    def counting_get_tri_mode(choice):
+        if uncached[0]:
+            choice.cached_mode = None
+        calls[0] += 1
+        if choice.cached_mode is None:
+            calls[1] += 1
+        return get_tri_mode(choice)
+
+    def evaluate():
+        config._invalidate_all()
+        for sym in syms:
+            sym.get_value()
+            sym.get_visibility()
+
+    kconfiglib.Choice._get_tri_mode = counting_get_tri_mode
+    try:
+        for what, uncached[0] in (("Calculating the mode on each lookup",
+                                   True),
+                                  ("Caching the mode", False)):
+            calls[:] = [0, 0]
+            t = best_of(3, evaluate)
+            report("{} ({} modes calculated)".format(what, calls[1]//3), t)
+        print("  Mode lookups: {} for {} choices with {} symbols"
+              .format(calls[0]//3, len(choices), len(syms)))
+    finally:
+        kconfiglib.Choice._get_tri_mode = get_tri_mode
+
+def bench_memory(dirname, kconfig):
+    """Memory used by the parsed configuration. Items have no per-instance
+    __dict__, and symbols share empty lists and sets until something is
+    added to them."""
+    config = kconfiglib.Config(kconfig, dirname)
+    syms = list(config.syms_iter())
+
+    mem = allocated(kconfiglib.Config, kconfig, dirname)
+    if mem is not None:
+        print("  Total: {:.1f} MB ({:.0f} bytes/symbol)"
+              .format(mem/1e6, float(mem)/len(syms)))
+
+    container_attrs = ("prompts", "def_exprs", "ranges", "orig_prompts",
+                       "orig_def_exprs", "orig_selects", "orig_implies",
+                       "referenced_syms", "selected_syms", "implied_syms",
+                       "all_referenced_syms", "def_locations",
+                       "ref_locations", "dep")
+    containers = {}
+    n_shared = 0
+    for sym in syms:
+        for attr in container_attrs:
+            container = getattr(sym, attr)
+            if not container:
+                n_shared += container is kconfiglib._NO_ENTRIES or \
+                            container is kconfiglib._NO_SYMS
+            containers[id(container)] = container
+
+    print("  Symbol objects: {:.0f} bytes/symbol"
+          .format(sum([sys.getsizeof(sym) for sym in syms])/
+                  float(len(syms))))
+    print("  Symbol lists and sets (not their contents): {:.0f} "
+          "bytes/symbol, {} of {} shared and empty"
+          .format(sum([sys.getsizeof(container)
+                       for container in containers.values()])/
+                  float(len(syms)),
+                  n_shared, len(syms)*len(container_attrs)))
+
+def bench_locations(dirname, kconfig):
+    """Memory and parsing time for symbol locations. Locations are stored as
+    packed (filename index, line number) pairs, and recording of reference
+    locations can be turned off."""
+    config = kconfiglib.Config(kconfig, dirname)
+    syms = list(config.syms_iter())
+    n_refs = sum([len(sym.get_ref_locations()) for sym in syms])
+    n_defs = sum([len(sym.get_def_locations()) for sym in syms])
+
+    packed = sum([sys.getsizeof(sym.def_locations) +
+                  sys.getsizeof(sym.ref_locations) for sym in syms])
+    # What the same locations take as lists of (filename, linenr) tuples. The
+    # filename strings are shared in both cases.
+    tuples = sum([sys.getsizeof(sym.get_def_locations()) +
+                  sys.getsizeof(sym.get_ref_locations()) +
+                  sum([sys.getsizeof(loc)
+                       for loc in sym.get_def_locations() +
+                                  sym.get_ref_locations()])
+                  for sym in syms])
+    print("  {} definition and {} reference locations: {:.1f} MB as tuples, "
+          "{:.1f} MB packed".format(n_defs, n_refs, tuples/1e6, packed/1e6))
+
+    for what, record in (("Recording reference locations", True),
+                         ("Not recording reference locations", False)):
+        mem = allocated(kconfiglib.Config, kconfig, dirname, True, False,
+                        None, record)
+        if mem is not None:
+            print("  {}: {:.1f} MB".format(what, mem/1e6))
+        report("Parse ({})".format(what[0].lower() + what[1:]),
+               best_of(3, kconfiglib.Config, kconfig, dirname, True, False,
+                       None, record))
+
+def bench_shared_exprs(dirname, kconfig):
+    """Sharing of structurally identical expressions, in the large synthetic
+    tree and in a tree with deeply nested ifs. Shared expressions are stored
+    once, and evaluated at most once between invalidations."""
+    intern_expr = kconfiglib.Config._intern_expr
+    simplify_expr = kconfiglib.Config._simplify_expr
+    memoize = kconfiglib._memoize
+
+    def set_sharing(sharing):
+        if sharing:
+            kconfiglib.Config._intern_expr = intern_expr
+            kconfiglib.Config._simplify_expr = simplify_expr
+            kconfiglib._memoize = memoize
+        else:
+            # Simplification interns the expressions too
+            kconfiglib.Config._intern_expr = lambda self, expr: expr
+            kconfiglib.Config._simplify_expr = lambda self, expr: expr
+            kconfiglib._memoize = lambda fn, config: fn
+
+    def n_refs_and_exprs(config):
+        # Counts the references to compound expressions from the conditions
+        # of symbols and from other compound expressions, and the number of
+        # distinct compound expressions
+        refs = []
+        def add_refs(expr):
+            if isinstance(expr, tuple):
+                refs.append(expr)
+                if expr[0] in (kconfiglib.AND, kconfiglib.OR):
+                    for arg in expr[1]:
+                        add_refs(arg)
+                elif expr[0] == kconfiglib.NOT:
+                    add_refs(expr[1])
+        for sym in config.get_symbols(False):
+            for _, cond in sym.prompts:
+                add_refs(cond)
+            for val, cond in sym.def_exprs:
+                add_refs(val)
+                add_refs(cond)
+        return (len(refs), len(set([id(expr) for expr in refs])))
+
+    try:
+        for tree, tree_kconfig in (("Synthetic tree", kconfig),
+                                   ("Nested ifs",
+                                    generate_nested_tree(dirname))):
+            print("  {}:".format(tree))
+            for what, sharing in (("without sharing", False),
+                                  ("with sharing", True)):
+                set_sharing(sharing)
+
+                config = kconfiglib.Config(tree_kconfig, dirname)
+                syms = config.get_symbols(False)
+                mem = allocated(kconfiglib.Config, tree_kconfig, dirname)
+                print("    {}: {} references to {} distinct compound "
+                      "expressions{}"
+                      .format(what[0].upper() + what[1:],
+                              *n_refs_and_exprs(config) +
+                              ("" if mem is None else
+                               ", {:.1f} MB".format(mem/1e6),)))
+
+                def recalc():
+                    config._invalidate_all()
+                    for sym in syms:
+                        sym.get_value()
+                        sym.get_visibility()
+
+                # Compile the expressions first
+                recalc()
+                report("  Recalculating all values ({})".format(what),
+                       best_of(5, recalc))
+    finally:
+        set_sharing(True)
+
+def bench_simplify(dirname, kconfig):
+    """Simplification of expressions after parsing, in the large synthetic
+    tree and in a tree with deeply nested ifs and redundant conditions."""
+    simplify_expr = kconfiglib.Config._simplify_expr
+    try:
+        for tree, tree_kconfig in (("Synthetic tree", kconfig),
+                                   ("Nested ifs",
+                                    generate_nested_tree(dirname, True))):
+            print("  {}:".format(tree))
+            for what, simplify in (("without simplification", False),
+                                   ("with simplification", True)):
+                kconfiglib.Config._simplify_expr = simplify_expr \
+                    if simplify else kconfiglib.Config._intern_expr
+
+                t, config = timed(kconfiglib.Config, tree_kconfig, dirname)
+                report("  Parse ({})".format(what), t)
+
+                syms = config.get_symbols(False)
+
+                def recalc():
+                    config._invalidate_all()
+                    for sym in syms:
+                        sym.get_value()
+                        sym.get_visibility()
+
+                # Compile the expressions first
+                recalc()
+                report("  Recalculating all values ({})".format(what),
+                       best_of(5, recalc))
+
+            parsed, simplified = config.get_expr_simplification_stats()
+            print("    Expression nodes: {} parsed, {} after simplification "
+                  "({:.1f}% eliminated)"
+                  .format(parsed, simplified,
+                          100*float(parsed - simplified)/parsed))
+    finally:
+        kconfiglib.Config._simplify_expr = simplify_expr
+
+def bench_exprs(dirname, kconfig):
+    """Parsing and evaluating expressions, for the conditions in the
+    synthetic tree and for deeply nested expressions. Neither the parser nor
+    the evaluator recurses."""
+    config = kconfiglib.Config(kconfig, dirname)
+
+    # The conditions in the tree, as written
+    exprs = []
+    for sym in config.get_symbols(False):
+        for entries in sym.orig_prompts, sym.orig_def_exprs:
+            for _, cond in entries:
+                if cond is not None:
+                    exprs.append(kconfiglib._expr_to_str(cond))
+    tokens = [config._tokenize(expr, True).items for expr in exprs]
+
+    def parse():
+        for expr, expr_tokens in zip(exprs, tokens):
+            config._parse_expr(kconfiglib._Feed(expr_tokens), None, expr)
+
+    def tokenize_and_parse():
+        for expr in exprs:
+            config._parse_expr(config._tokenize(expr, True), None, expr)
+
+    def evaluate():
+        for expr in exprs:
+            config.eval(expr)
+
+    for what, fn in (("Parsing tokens", parse),
+                     ("Tokenizing and parsing", tokenize_and_parse),
+                     ("Config.eval()", evaluate)):
+        t = best_of(5, fn)
+        report("{} ({} expressions/s)".format(what, int(len(exprs)/t)), t)
+
+    # Deeply nested expressions on symbols from the tree
+    a, b, c = [sym.name for sym in config.get_symbols(False)[:3]]
+    half = EXPR_NESTING_DEPTH//2
+    for what, expr in (("Nested && and ||",
+                        "({} && ({} || ".format(a, b)*half + c + "))"*half),
+                       ("Nested !", "!("*EXPR_NESTING_DEPTH + a +
+                                    ")"*EXPR_NESTING_DEPTH)):
+        report("{}, depth {} (Config.eval())"
+               .format(what, EXPR_NESTING_DEPTH),
+               best_of(5, config.eval, expr))
+
+BENCHMARKS = [("parse_cache", bench_parse_cache),
+              ("reparse", bench_reparse),
+              ("eval", bench_eval),
+              ("toggle", bench_toggle),
+              ("dep_graph", bench_dep_graph),
+              ("load_config", bench_load_config),
+              ("set_user_values", bench_set_user_values),
+              ("allconfig", bench_allconfig),
+              ("randconfig", bench_randconfig),
+              ("load_configs", bench_load_configs),
+              ("states", bench_states),
+              ("snapshot", bench_snapshot),
+              ("what_if", bench_what_if),
+              ("selects", bench_selects),
+              ("selectors", bench_selectors),
+              ("bounds", bench_bounds),
+              ("menus", bench_menus),
+              ("choices", bench_choices),
+              ("memory", bench_memory),
+              ("locations", bench_locations),
+              ("shared_exprs", bench_shared_exprs),
+              ("simplify", bench_simplify),
+              ("exprs", bench_exprs)]
+
+def run_benchmarks():
+    names = sys.argv[1:]
+    for name in names:
+        if name not in dict(BENCHMARKS):
+            print("Unrecognized benchmark '{}'. Available: {}"
+                  .format(name, ", ".join([n for n, _ in BENCHMARKS])))
+            return
+
+    dirname = tempfile.mkdtemp()
+    try:
+        kconfig = generate_tree(dirname)
+        for name, fn in BENCHMARKS:
+            if not names or name in names:
+                print("{}: {}".format(name, fn.__doc__))
+                fn(dirname, kconfig)
+    finally:
+        shutil.rmtree(dirname)
+
+if __name__ == "__main__":
+    run_benchmarks()
@@ -0,0 +1,52 @@
+# Loads every *defconfig file in a directory (e.g. configs/ in U-Boot or
+# arch/$ARCH/configs/ in Linux) and writes out the full configuration for each
+# of them, like running 'make <board>_defconfig' for each board. The Kconfig
+# files are only parsed once, and the defconfig files are spread over worker
+# processes.
+#
+# Usage:
+#
+#  $ make scriptconfig SCRIPT=Kconfiglib/examples/batch_defconfigs.py \
+#      SCRIPT_ARG=<defconfig directory>
+#
+# or, to pick the output directory and the number of worker processes,
+#
+#  $ python batch_defconfigs.py <Kconfig> <defconfig directory> \
+#      [<output directory> [<processes>]]
+#
+# The configurations are written to <output directory>/<defconfig>.config
+# (default output directory: batch_configs). The time taken for each defconfig
+# is printed as it finishes.
+
+import kconfiglib
+import os
+import sys
+import time
+
+defconfig_dir = sys.argv[2]
+out_dir = sys.argv[3] if len(sys.argv) > 3 else "batch_configs"
+processes = int(sys.argv[4]) if len(sys.argv) > 4 else None
+
+start = time.time()
+conf = kconfiglib.Config(sys.argv[1])
+print("Parsed {} in {:.2f} s".format(sys.argv[1], time.time() - start))
+
+defconfigs = sorted([os.path.join(defconfig_dir, name)
+                     for name in os.listdir(defconfig_dir)
+                     if name.endswith("defconfig")])
+
+if not os.path.isdir(out_dir):
+    os.makedirs(out_dir)
+
+def write(conf, filename):
+    conf.write_config(os.path.join(out_dir,
+                                   os.path.basename(filename) + ".config"))
+
+start = time.time()
+for filename, _, seconds in conf.load_configs(defconfigs, write, processes):
+    print("{:<50} {:.3f} s".format(os.path.basename(filename), seconds))
+
+total = time.time() - start
+print("Wrote {} configurations to {} in {:.2f} s ({:.1f} per second)"
+      .format(len(defconfigs), out_dir, total,
+              len(defconfigs)/total if total else 0))
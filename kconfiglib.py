@@ -66,10 +66,19 @@ Send bug reports, suggestions and other feedback to ulfalizer a.t Google's
 email service. Don't wrestle with internal APIs. Tell me what you need and I
 might add it in a safe way as a client API instead."""
 
+import array
+import contextlib
+import gc
+import hashlib
+import heapq
+import multiprocessing
 import os
+import pickle
 import platform
+import random
 import re
 import sys
+import time
 
 # File layout:
 #
@@ -97,7 +106,8 @@ class Config(object):
     #
 
     def __init__(self, filename="Kconfig", base_dir=None, print_warnings=True,
-                 print_undef_assign=False):
+                 print_undef_assign=False, cache_file=None,
+                 record_ref_locations=True):
         """Creates a new Config object, representing a Kconfig configuration.
         Raises Kconfig_Syntax_Error on syntax errors.
 
@@ -127,7 +137,24 @@ class Config(object):
         print_undef_assign (default: False): Set to True if informational
            messages related to assignments to undefined symbols should be
            printed to stderr for this configuration. Can be changed later with
-           Config.set_print_undef_assign()."""
+           Config.set_print_undef_assign().
+
+        cache_file (default: None): If not None, the parsed configuration is
+           cached in this file. If the file holds a cache created from the same
+           Kconfig files (compared by modification time and size, and by
+           content hash if those differ) and the same environment (ARCH,
+           SRCARCH, srctree, base_dir, and any 'option env' variables), the
+           configuration is loaded from it instead of being parsed, which is
+           several times faster. Otherwise the Kconfig files are parsed as
+           usual and the cache file is (re)written. A warning is printed if
+           the cache file can't be written. Note that warnings generated
+           during parsing are not repeated when loading from the cache.
+
+        record_ref_locations (default: True): Set to False to not record the
+           locations where symbols are referenced, for scripts that only work
+           with values. This saves memory and parsing time on large
+           configurations. Symbol.get_ref_locations() then returns an empty
+           list, and reparse() always reparses all files."""
 
         # The set of all symbols, indexed by name (a string)
         self.syms = {}
@@ -202,6 +229,48 @@ class Config(object):
         self.print_warnings = print_warnings
         self.print_undef_assign = print_undef_assign
 
+        # The filenames appearing in symbol locations, and a dictionary that
+        # maps them to their indices in the list. Symbols store their
+        # locations as (filename index, line number) pairs packed into
+        # arrays. See Symbol.get_def_locations().
+        self._record_ref_locations = record_ref_locations
+        self._filenames = []
+        self._filename_ids = {}
+
+        # Expressions stored on items while parsing are interned, so that
+        # structurally identical expressions (e.g. the dependencies propagated
+        # from the same menus and ifs to the prompts and defaults of symbols)
+        # are shared. Maps the key from _expr_key() for each shared compound
+        # expression to the expression. Only kept while parsing, as it takes
+        # more memory than the sharing saves. See _intern_expr().
+        #
+        # _simplified memoizes _simplify_expr_rec() while parsing, mapping the
+        # IDs of compound expressions to (expression, simplified expression,
+        # node count) tuples.
+        #
+        # _prompt_conds maps symbols to the conditions of their prompts before
+        # simplification, for determining the choice symbols (see
+        # Symbol._has_auto_menu_dep_on()). Also only kept while parsing, which
+        # is when choice symbols are determined.
+        self._exprs = None
+        self._simplified = None
+        self._prompt_conds = None
+
+        # The number of nodes in the expressions stored on items before and
+        # after simplification. See get_expr_simplification_stats().
+        self._n_parsed_expr_nodes = 0
+        self._n_simplified_expr_nodes = 0
+
+        # Maps the IDs of compound expressions to (expression, function,
+        # may_be_m, depth) tuples, so that shared expressions are compiled
+        # once (see _compile_expr_rec()). _shared_exprs holds the IDs of the
+        # compound expressions that are referenced more than once, which are
+        # evaluated at most once per _eval_epoch. The epoch changes whenever
+        # cached values are invalidated or replaced.
+        self._expr_fns = {}
+        self._shared_exprs = None
+        self._eval_epoch = 0
+
         # When parsing properties, we stop on the first (non-empty)
         # non-property line. These variables hold that line and its tokens so
         # that we don't have to re-tokenize the line later. This isn't just an
@@ -213,19 +282,90 @@ class Config(object):
         self.end_line = None
         self.end_line_tokens = None
 
-        # See the comment in _parse_expr().
-        self._cur_item = None
-        self._line = None
-        self._filename = None
-        self._linenr = None
-        self._transform_m = None
-
-        # Parse the Kconfig files
-        self.top_block = []
-        self._parse_file(filename, None, None, None, self.top_block)
-
-        # Build Symbol.dep for all symbols
-        self._build_dep()
+        # A compact version of the 'dep' graph (see _DepGraph), and the set of
+        # symbols whose values might depend on MODULES implicitly. Calculated
+        # as needed, and reset whenever the 'dep' sets change.
+        self._dep_graph = None
+        self._modules_dep = None
+
+        # The symbols in the order used by ValueState, built as needed. A new
+        # list is created when symbols might have been added or removed.
+        self._state_syms = None
+
+        # Active snapshots (see snapshot()), innermost last, and the journal of
+        # the innermost one, or None when there are no active snapshots. The
+        # journal maps items to their value state from before they were first
+        # changed.
+        self._snapshots = []
+        self._journal = None
+
+        # List of symbols whose user values have changed inside a
+        # batch_user_values() block, or None when not in such a block
+        self._batch = None
+
+        # Function called with the items whose values or visibilities changed
+        # after a change to user values (see set_change_callback()), and the
+        # states of the items that might be affected by the current change
+        # (see _note_old_states()), or None when there's nothing to report
+        self._change_callback = None
+        self._old_states = None
+
+        # Maps symbols to the menus and comments whose visibility depends on
+        # them. Calculated as needed, and reset whenever the 'dep' sets
+        # change.
+        self._menu_deps = None
+
+        # Maps symbols to (_TermCounter, term index) tuples for the counted
+        # rev_dep and weak_rev_dep terms that reference them, so that the
+        # terms can be marked for reevaluation when the symbols are
+        # invalidated. Counters register themselves when they count all
+        # their terms. Incrementing _counter_gen makes all counters start
+        # over, for when values change without symbols being invalidated.
+        self._counter_index = {}
+        self._counter_gen = 0
+
+        # Number of times the bounds of a symbol were looked up and found in
+        # the cache, and calculated. See get_bounds_cache_stats().
+        self._bounds_cache_hits = 0
+        self._bounds_cache_misses = 0
+
+        # Records for the parsed Kconfig files, forming a tree that mirrors
+        # the 'source' statements. _top_file is the record for the top-level
+        # Kconfig file and _cur_file the record for the file currently being
+        # parsed. See _FileRecord. Used by reparse() and the parse cache.
+        self._top_file = None
+        self._cur_file = None
+
+        # The environment variables looked up via 'option env', mapped to
+        # their values (None for unset variables). Used to validate the parse
+        # cache.
+        self._env_vars = {}
+
+        # Maps symbols to the select and imply terms found for them while
+        # parsing, in parse order. The terms are added to the rev_dep and
+        # weak_rev_dep expressions in one go after parsing, by
+        # _add_rev_dep_terms(), as adding them one by one would take
+        # quadratic time for symbols with many selects.
+        self._rev_dep_terms = {}
+        self._weak_rev_dep_terms = {}
+
+        if cache_file is None or not self._load_cache(cache_file):
+            # Parse the Kconfig files
+            self.top_block = []
+            self._exprs = {}
+            self._simplified = {}
+            self._prompt_conds = {}
+            self._parse_file(filename, None, None, None, self.top_block)
+            self._exprs = None
+            self._simplified = None
+            self._prompt_conds = None
+            self._add_rev_dep_terms()
+
+            # Build Symbol.dep for all symbols
+            self._build_dep()
+
+            if cache_file is not None:
+                self._save_cache(cache_file)
 
     def get_arch(self):
         """Returns the value the environment variable ARCH had at the time the
@@ -384,6 +524,70 @@ class Config(object):
         same order as within the configuration."""
         return self.top_block
 
+    def reparse(self, changed_files):
+        """Updates the configuration after the Kconfig files in
+        'changed_files' (a list of filenames) have been modified. This is much
+        faster than creating a new Config: only the changed files (and any
+        files they source) are reparsed, their items are spliced into the
+        existing configuration, and only values that might be affected by the
+        changes are invalidated.
+
+        User values are kept, except for values that are no longer valid
+        (which generates a warning, like for load_config()). Items from files
+        that did not change, including Symbol instances for symbols defined
+        elsewhere, remain the same objects. Items from the changed files are
+        replaced, except Symbol instances, which are updated in place.
+
+        Some changes can't be handled incrementally. In that case, all Kconfig
+        files are reparsed, and all items are replaced. This happens if the
+        top-level Kconfig file changed, if a changed file is sourced more than
+        once or from within a choice, if a symbol is defined both in a changed
+        file and in some other file, or if the configuration has named
+        choices.
+
+        Filenames that were not parsed as part of the configuration are
+        ignored. If a changed file can't be parsed, Kconfig_Syntax_Error or
+        IOError is raised, and the Config should no longer be used.
+
+        Any active snapshots (see snapshot()) are discarded."""
+
+        del self._snapshots[:]
+        self._journal = None
+
+        # Remember the user values in case we need to reparse everything
+        user_vals = [(sym.name, sym.user_val) for sym in self.syms_iter()
+                     if sym.user_val is not None]
+
+        changed_paths = set([os.path.abspath(filename)
+                             for filename in changed_files])
+
+        records = self._top_file.records()
+        paths = [os.path.abspath(record.filename) for record in records]
+
+        # Only the outermost changed files are reparsed directly. Files they
+        # source get reparsed along with them.
+        changed_records = []
+        changed_ids = set()
+        for record, path in zip(records, paths):
+            if path in changed_paths:
+                changed_ids.add(id(record))
+                if id(record.parent_record) not in changed_ids:
+                    changed_records.append(record)
+            elif id(record.parent_record) in changed_ids:
+                changed_ids.add(id(record))
+
+        if not changed_records:
+            return
+
+        if self.named_choices or len(set(paths)) != len(paths):
+            self._reparse_all(user_vals)
+            return
+
+        for record in changed_records:
+            if not self._reparse_file(record):
+                self._reparse_all(user_vals)
+                return
+
     def load_config(self, filename, replace=True):
         """Loads symbol values from a file in the familiar .config format.
         Equivalent to calling Symbol.set_user_value() to set each of the
@@ -401,8 +605,6 @@ class Config(object):
         replace (default: True): True if the configuration should replace the
            old configuration; False if it should add to it."""
 
-        # Regular expressions for parsing .config files
-        _set_re_match = re.compile(r"{}(\w+)=(.*)".format(self.config_prefix)).match
         _unset_re_match = re.compile(r"# {}(\w+) is not set".format(self.config_prefix)).match
 
         # Put this first so that a missing file doesn't screw up our state
@@ -411,6 +613,9 @@ class Config(object):
 
         self.config_filename = filename
 
+        if self._change_callback is not None:
+            self._note_old_states(None)
+
         #
         # Read header
         #
@@ -434,23 +639,66 @@ class Config(object):
         # Read assignments. Hotspot for some workloads.
         #
 
+        # Only the symbols whose user values change (and the symbols affected
+        # by them) are invalidated, after loading. That makes loading a
+        # configuration that is similar to the current one cheap, e.g. when
+        # loading many configurations in sequence. Remember the old user
+        # values so that we can tell what changed.
+        old_user_vals = {}
+        for sym in self.syms_iter():
+            if sym.user_val is not None:
+                old_user_vals[sym] = sym.user_val
+        old_choice_vals = [(choice, choice.user_val, choice.user_mode)
+                           for choice in self.choices]
+
+        if replace:
+            # Symbols not mentioned in the .config lose their user values
+            if self._journal is not None:
+                for item in old_user_vals:
+                    self._record(item)
+                for choice in self.choices:
+                    self._record(choice)
+            for sym in old_user_vals:
+                sym.user_val = None
+            for choice in self.choices:
+                choice.user_val = None
+                choice.user_mode = None
+
+        # Symbols assigned in the .config
+        assigned = []
+
+        try:
+            self._load_assignments(line_feeder, assigned)
+        finally:
+            changed = [sym for sym in assigned
+                       if sym.user_val != old_user_vals.get(sym)]
+            changed.extend([sym for sym, val in old_user_vals.items()
+                            if sym.user_val != val])
+            for choice, user_val, user_mode in old_choice_vals:
+                if (choice.user_val is not user_val or
+                    choice.user_mode != user_mode) and \
+                   choice.actual_symbols:
+                    changed.append(choice.actual_symbols[0])
+
+            self._propagate_change(changed)
+            self._report_changes()
+
+    def _load_assignments(self, line_feeder, assigned):
+        """load_config() helper. Reads the assignments from the .config file
+        'line_feeder' and sets the user values of the symbols without
+        invalidating anything. Appends the symbols that get assigned to
+        'assigned'."""
+
+        # Regular expressions for parsing .config files
+        _set_re_match = re.compile(r"{}(\w+)=(.*)".format(self.config_prefix)).match
+        _unset_re_match = re.compile(r"# {}(\w+) is not set".format(self.config_prefix)).match
+
         def warn_override(filename, linenr, name, old_user_val, new_user_val):
             self._warn('overriding the value of {}. '
                        'Old value: "{}", new value: "{}".'
                        .format(name, old_user_val, new_user_val),
                        filename, linenr)
 
-        # Invalidate everything to keep things simple. It might be possible to
-        # improve performance for the case where multiple configurations are
-        # loaded by only invalidating a symbol (and its dependent symbols) if
-        # the new user value differs from the old. One complication would be
-        # that symbols not mentioned in the .config must lose their user value
-        # when replace = True, which is the usual case.
-        if replace:
-            self.unset_user_values()
-        else:
-            self._invalidate_all()
-
         while 1:
             line = line_feeder.get_next()
             if line is None:
@@ -487,6 +735,7 @@ class Config(object):
                                        line_feeder.linenr)
 
                     sym._set_user_value_no_invalidate(val, True)
+                    assigned.append(sym)
                 else:
                     if self.print_undef_assign:
                         _stderr_msg('note: attempt to assign the value "{}" '
@@ -505,6 +754,7 @@ class Config(object):
                                           name, sym.user_val, "n")
 
                         sym._set_user_value_no_invalidate("n", True)
+                        assigned.append(sym)
 
     def write_config(self, filename, header=None):
         """Writes out symbol values in the familiar .config format.
@@ -557,9 +807,524 @@ class Config(object):
     def unset_user_values(self):
         """Resets the values of all symbols, as if Config.load_config() or
         Symbol.set_user_value() had never been called."""
+        if self._change_callback is not None:
+            self._note_old_states(None)
+        self._unset_user_values()
+        self._report_changes()
+
+    def _unset_user_values(self):
+        """unset_user_values() helper. Resets the user values without
+        reporting the changes."""
         for sym in self.syms_iter():
             sym._unset_user_value_no_recursive_invalidate()
 
+    def get_state(self):
+        """Returns a ValueState with the current value state of the
+        configuration: the user values of all symbols and choices, and the
+        values calculated from them so far. The parsed configuration (the
+        symbols, choices, menus, and comments, and their expressions) is not
+        included, so this is cheap compared to creating another Config.
+
+        Any number of states can be kept around and made active with
+        set_state(), e.g. to go back and forth between several
+        configurations without parsing the Kconfig files more than once:
+
+          config.load_config("defconfig_1")
+          state_1 = config.get_state()
+          config.load_config("defconfig_2")
+          state_2 = config.get_state()
+
+          config.set_state(state_1)
+          ...
+
+        The ValueState is not affected by later changes to the
+        configuration."""
+        return ValueState(self)
+
+    def set_state(self, state):
+        """Makes the value state 'state', returned by get_state(), the
+        current value state of the configuration. Values calculated before
+        get_state() was called do not need to be calculated again.
+
+        If the Kconfig files have been reparsed with reparse() since the
+        state was created, only the user values of symbols that still exist
+        are restored, by name."""
+        if self._batch is not None:
+            # The state includes the values of dependent symbols
+            del self._batch[:]
+
+        self.config_filename = state.config_filename
+        self.config_header = state.config_header
+
+        if self._journal is not None:
+            for item in self._get_state_syms():
+                self._record(item)
+            for choice in self.choices:
+                self._record(choice)
+
+        if state.syms is self._get_state_syms() and \
+           state.choices == tuple(self.choices):
+            for sym, user_val, cached_val, cached_tri, cached_visibility, \
+                write_to_conf in zip(state.syms, state.user_vals,
+                                     state.cached_vals, state.cached_tris,
+                                     state.cached_visibilities,
+                                     state.write_to_confs):
+                sym.user_val = user_val
+                sym.cached_val = cached_val
+                sym.cached_tri = cached_tri
+                sym.cached_visibility = cached_visibility
+                sym.cached_bounds = None
+                sym.write_to_conf = write_to_conf
+            # The values were changed without invalidating the symbols
+            self._eval_epoch += 1
+            self._reset_term_counters()
+            for item in self.menus + self.comments:
+                item._invalidate()
+
+            for choice, user_val, user_mode in zip(state.choices,
+                                                    state.choice_user_vals,
+                                                    state.choice_user_modes):
+                choice.user_val = user_val
+                choice.user_mode = user_mode
+                choice._invalidate()
+            return
+
+        # The state is from before a reparse
+        self._unset_user_values()
+        for sym, user_val in zip(state.syms, state.user_vals):
+            if user_val is not None and self.syms.get(sym.name) is not None:
+                self.syms[sym.name]._set_user_value_no_invalidate(user_val,
+                                                                  True)
+        # Redo the selections in choices, which depend on the order of the
+        # assignments above
+        for user_val in state.choice_user_vals:
+            if user_val is not None and self.syms.get(user_val.name) \
+                                        is not None:
+                self.syms[user_val.name]._set_user_value_no_invalidate("y",
+                                                                       True)
+        self._invalidate_all()
+
+    def snapshot(self):
+        """Takes a snapshot of the value state of the configuration, which
+        can later be returned to with restore(). Intended for "what if"
+        evaluations, e.g. to see the effects of setting a symbol to some
+        value:
+
+          snapshot = config.snapshot()
+          config.get_symbol("FOO").set_user_value("y")
+          ...
+          config.restore(snapshot)
+
+        Taking a snapshot is O(1). While a snapshot is active, the old value
+        state of each symbol and choice is recorded the first time it
+        changes (including when values are calculated and cached), and
+        restore() copies these back. Nothing needs to be recalculated after
+        a restore, and the cost of taking a snapshot and restoring it is
+        proportional to the number of symbols and choices affected, rather
+        than to the size of the configuration. To switch between complete
+        configurations, get_state() and set_state() are a better fit.
+
+        Snapshots can be nested. A snapshot stays active until it is
+        discarded with discard_snapshot(), until a snapshot taken before it
+        is restored or discarded, or until reparse() is called. It remains
+        active after restore(), so that several changes can be tried out
+        from the same starting point."""
+        snapshot = _Snapshot(self)
+        self._snapshots.append(snapshot)
+        self._journal = snapshot.journal
+        return snapshot
+
+    def restore(self, snapshot):
+        """Returns the configuration to the value state it was in when
+        'snapshot' was taken with snapshot(). Any snapshots taken after
+        'snapshot' are discarded. See snapshot()."""
+        if snapshot not in self._snapshots:
+            self._warn("attempt to restore a snapshot that is no longer "
+                       "active. Restore ignored.")
+            return
+
+        # Undo the changes from the innermost snapshot outwards. A value state
+        # recorded by an inner snapshot is the value state at the time it was
+        # taken, which the outer snapshots undo further if needed.
+        while True:
+            top = self._snapshots[-1]
+            for item, saved in top.journal.items():
+                item._restore_values(saved)
+            if top is snapshot:
+                break
+            self._snapshots.pop()
+
+        snapshot.journal.clear()
+        self._journal = snapshot.journal
+        # Cached values were put back without invalidation
+        self._eval_epoch += 1
+
+        self.config_filename = snapshot.config_filename
+        self.config_header = snapshot.config_header
+
+    def discard_snapshot(self, snapshot):
+        """Stops recording changes for 'snapshot' and any snapshots taken
+        after it, keeping the current value state. Snapshots taken before
+        'snapshot' can still be restored. See snapshot()."""
+        if snapshot not in self._snapshots:
+            self._warn("attempt to discard a snapshot that is no longer "
+                       "active. Discard ignored.")
+            return
+
+        while True:
+            top = self._snapshots.pop()
+            if self._snapshots:
+                # Keep the changes restorable from the enclosing snapshot,
+                # which has the older value state for items in both journals
+                journal = self._snapshots[-1].journal
+                for item, saved in top.journal.items():
+                    if item not in journal:
+                        journal[item] = saved
+            if top is snapshot:
+                break
+
+        self._journal = self._snapshots[-1].journal if self._snapshots else \
+                        None
+
+    def what_if(self, values):
+        """Returns the set of symbols whose value, visibility, or
+        write_to_conf status (whether they would be written to a .config)
+        would change if the user values in 'values' were set, without
+        changing the configuration:
+
+          for sym in config.what_if({"FOO": "y"}):
+              print(sym.get_name())
+
+        Only the symbols that might depend on the assigned symbols are looked
+        at. After the call, the configuration is in the same state as before,
+        including its cached values (see snapshot()).
+
+        values: Assignments in the same format as for set_user_values()."""
+        if isinstance(values, dict):
+            values = list(values.items())
+        else:
+            values = list(values)
+
+        assigned = [self.syms[name] for name, _ in values
+                    if name in self.syms]
+        if not assigned:
+            return set()
+
+        # Changes postponed by batch_user_values() need to be in place for
+        # the values before the assignments to be right
+        batch = self._batch
+        self._batch = None
+        if batch:
+            self._propagate_change(batch)
+            del batch[:]
+
+        cone = self._get_affected_syms(assigned)
+
+        def state(sym):
+            return (sym.get_value(), sym.get_visibility(), sym.write_to_conf)
+
+        # The changes aren't real, so don't report them
+        change_callback = self._change_callback
+        self._change_callback = None
+
+        snapshot = self.snapshot()
+        try:
+            # Calculating all the old values first also makes sure that
+            # _propagate_change() updates every symbol that changes
+            old_states = [(sym, state(sym)) for sym in cone]
+            self.set_user_values(values)
+            return set([sym for sym, old_state in old_states
+                        if state(sym) != old_state])
+        finally:
+            self.restore(snapshot)
+            self.discard_snapshot(snapshot)
+            self._batch = batch
+            self._change_callback = change_callback
+
+    def set_user_values(self, values):
+        """Sets the user values of many symbols at once. Equivalent to calling
+        Symbol.set_user_value() for each of them, but the cached values of
+        dependent symbols are only updated once, at the end, which is much
+        faster when many values are set.
+
+        values: A dictionary that maps symbol names to user values, or a list
+          of (name, value) tuples if the order of the assignments matters
+          (e.g. for the symbols in a choice). Assignments to undefined symbols
+          are ignored, with a message if set_print_undef_assign() is
+          enabled."""
+        if isinstance(values, dict):
+            values = values.items()
+
+        with self.batch_user_values():
+            for name, val in values:
+                if name in self.syms:
+                    self.syms[name].set_user_value(val)
+                elif self.print_undef_assign:
+                    _stderr_msg('note: attempt to assign the value "{}" to '
+                                "the undefined symbol {}.".format(val, name),
+                                None, None)
+
+    @contextlib.contextmanager
+    def batch_user_values(self):
+        """Returns a context manager that postpones updating the cached values
+        of dependent symbols after calls to Symbol.set_user_value() and
+        Symbol.unset_user_value() until the end of the block. The updating
+        is then done in a single pass for all the changed symbols:
+
+          with config.batch_user_values():
+              for sym in syms:
+                  sym.set_user_value("y")
+
+        The values of symbols that depend on the changed symbols are not
+        updated within the block, so only use it when no values need to be
+        looked at between the assignments. Blocks can be nested, in which
+        case the updating is done at the end of the outermost block."""
+        if self._batch is not None:
+            yield
+            return
+
+        self._batch = []
+        try:
+            yield
+        finally:
+            changed = self._batch
+            self._batch = None
+            self._propagate_change(changed)
+            self._report_changes()
+
+    def allyes(self):
+        """Sets user values so that as many symbols as possible get the value
+        "y", like 'make allyesconfig'. Gives the same result as
+        examples/allyesconfig.py: bool and tristate symbols are raised to
+        their upper bounds, choices that can be in "y" mode get their default
+        selection, and all symbols in choices that can only be in "m" mode
+        get the value "m".
+
+        Only the symbols that depend on a symbol whose value changes are
+        looked at again. This is much faster than repeatedly looping over all
+        symbols until nothing changes when there are long dependency chains,
+        which need one pass per link with that approach."""
+        def sym_step(sym):
+            upper_bound = sym.get_upper_bound()
+            if upper_bound is not None and \
+               tri_less(sym.get_value(), upper_bound):
+                sym.set_user_value(upper_bound)
+
+        self._set_all(sym_step, _set_choice_allyes)
+
+    def allno(self):
+        """Sets user values so that as many symbols as possible get the value
+        "n", like 'make allnoconfig'. Gives the same result as
+        examples/allnoconfig.py: symbols with 'option allnoconfig_y' get the
+        value "y", and other bool and tristate symbols are lowered to their
+        lower bounds. Choices are left alone.
+
+        See allyes() for how this is done efficiently."""
+        def sym_step(sym):
+            if sym.allnoconfig_y:
+                return
+            lower_bound = sym.get_lower_bound()
+            if lower_bound is not None and \
+               tri_less(lower_bound, sym.get_value()):
+                sym.set_user_value(lower_bound)
+
+        with self.batch_user_values():
+            for sym in self.syms_iter():
+                if sym.allnoconfig_y and \
+                   (sym.type == BOOL or sym.type == TRISTATE):
+                    sym.set_user_value("y")
+
+        self._set_all(sym_step, None)
+
+    def allmod(self):
+        """Sets user values so that as many symbols as possible get the value
+        "m", like 'make allmodconfig': tristate symbols that can be "m" get
+        the value "m", and other bool and tristate symbols are raised to their
+        upper bounds. Tristate choices that can be in "m" mode get it, with
+        all their symbols set to "m", and other choices are handled like in
+        allyes().
+
+        See allyes() for how this is done efficiently."""
+        def sym_step(sym):
+            assignable = sym.get_assignable_values()
+            if not assignable:
+                return
+            val = "m" if sym.type == TRISTATE and "m" in assignable else \
+                  assignable[-1]
+            if sym.get_value() != val:
+                sym.set_user_value(val)
+
+        def choice_step(choice):
+            modules_sym = self.syms.get("MODULES")
+            if choice.type == TRISTATE and choice.get_visibility() != "n" and \
+               modules_sym is not None and modules_sym.get_value() == "y":
+                _set_choice_mod(choice)
+            else:
+                _set_choice_allyes(choice)
+
+        self._set_all(sym_step, choice_step)
+
+    def randconfig(self, seed=None, probability=0.5):
+        """Gives the configuration random user values, like 'make
+        randconfig'. Existing user values are discarded first.
+
+        Each bool and tristate symbol that can be changed gets its lowest
+        assignable value, or with probability 'probability', one of the
+        higher assignable values picked at random. This respects visibility
+        and select, and imply works as usual for the symbols that are not
+        visible. Choices get a random mode among those their visibility
+        allows ("n" for optional choices only with probability
+        1 - 'probability'). In "y" mode, a random visible symbol is selected,
+        and in "m" mode, each symbol gets the value "m" with probability
+        'probability'. Symbols of other types keep their default values.
+
+        The values are generated in a single pass over the symbols in
+        dependency order, so this is much faster than setting random values
+        with Symbol.set_user_value().
+
+        seed (default: None): Seed for the random number generator. The same
+          seed always gives the same configuration for a given set of Kconfig
+          files. If None, the system time or some other source of randomness
+          is used.
+
+        probability (default: 0.5): See above. Should be between 0 and 1."""
+        self._randconfig(random.Random(seed), probability)
+
+    def randconfigs(self, n, seed=None, probability=0.5):
+        """Generates 'n' random configurations, one after another. Returns an
+        iterator that yields a seed for each configuration after giving the
+        configuration its values with randconfig(), so that the values can be
+        looked at or written out before moving on:
+
+          for seed in config.randconfigs(1000, seed=0):
+              config.write_config("configs/{}.config".format(seed))
+
+        Passing the seed to randconfig() gives the same configuration again,
+        which is handy for reproducing a problem found with a single
+        configuration.
+
+        Only the user values and cached values are reset between
+        configurations, so this is much cheaper than creating a new Config
+        for each one.
+
+        n: The number of configurations to generate.
+
+        seed (default: None): Seed for generating the seeds of the
+          configurations. The same seed gives the same sequence of
+          configurations.
+
+        probability (default: 0.5): See randconfig()."""
+        seed_rand = random.Random(seed)
+        for _ in range(n):
+            config_seed = seed_rand.getrandbits(32)
+            self._randconfig(random.Random(config_seed), probability)
+            yield config_seed
+
+    def load_configs(self, filenames, fn, processes=None, chunksize=1):
+        """Loads each of the .config files (e.g. defconfig files) in
+        'filenames' with load_config() and calls fn(config, filename) after
+        each load, with 'config' being the Config with the file loaded.
+        Returns an iterator over (filename, result, seconds) tuples, where
+        'result' is the return value of 'fn' and 'seconds' the time taken by
+        the load and the call. Useful for going through all the defconfig
+        files of a tree:
+
+          def arch(config, filename):
+              return config["SYS_ARCH"].get_value()
+
+          for filename, arch, seconds in \
+              config.load_configs(defconfigs, arch):
+              ...
+
+        The files are split between worker processes forked from the current
+        process, so the configuration is only parsed once and is shared
+        copy-on-write between the workers. All symbols are evaluated before
+        forking, so that the workers don't each redo that work either.
+        Results are returned as soon as they are ready, in the order the
+        files finish. The return values of 'fn' are sent back from the
+        workers, so they need to be picklable. 'fn' can write out files with
+        write_config() though, and return nothing.
+
+        If 'processes' is 1 or the system lacks fork(), everything happens
+        in the current process instead, in order. This Config is then left
+        with the last file loaded. It is never affected by the workers.
+
+        filenames: The .config files to load.
+
+        fn: Function called with the Config and the filename after each file
+          is loaded.
+
+        processes (default: None): Number of worker processes. If None, the
+          number of CPUs is used.
+
+        chunksize (default: 1): Number of files handed to a worker at a time.
+          Larger values mean less overhead with many small files, but can
+          leave workers idle at the end."""
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        if processes == 1 or not hasattr(os, "fork"):
+            for filename in filenames:
+                yield _load_config_timed(self, fn, filename)
+            return
+
+        # Do the evaluation that the workers would otherwise all repeat:
+        # compiling expressions, calculating values, and building the
+        # dependency graph used by load_config()
+        for sym in self.syms_iter():
+            sym.get_value()
+        self._get_modules_dep()
+
+        # Python 3.14 stopped forking by default
+        ctx = multiprocessing.get_context("fork") \
+              if hasattr(multiprocessing, "get_context") else multiprocessing
+
+        # Keep the garbage collector from touching (and so copying) the pages
+        # of the shared objects in the workers
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+        try:
+            pool = ctx.Pool(processes, _init_load_configs_worker, (self, fn))
+        finally:
+            if hasattr(gc, "unfreeze"):
+                gc.unfreeze()
+
+        try:
+            for res in pool.imap_unordered(_load_configs_worker, filenames,
+                                           chunksize):
+                yield res
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def get_bounds_cache_stats(self):
+        """Returns a (hits, misses) tuple with the number of times the
+        information that Symbol.get_lower_bound(), get_upper_bound(),
+        get_assignable_values(), and is_modifiable() are calculated from was
+        found in the cache of the symbol, and had to be calculated, since the
+        Config was created. The cache is updated along with the cached values
+        of the symbols, so there is one miss per symbol and change that
+        affects it."""
+        return (self._bounds_cache_hits, self._bounds_cache_misses)
+
+    def get_expr_simplification_stats(self):
+        """Returns a (parsed, simplified) tuple with the total number of nodes
+        (operators and operands) in the expressions that conditions and
+        defaults were simplified from after parsing, and in the simplified
+        expressions. Expressions shared between several items are counted
+        once for each of them. Select and imply conditions aren't simplified,
+        as str() shows the reverse dependencies built from them.
+
+        Simplification folds constants and relations between constants,
+        removes double negations, flattens nested && and || expressions,
+        removes duplicate operands (e.g. from 'depends on FOO' within
+        'if FOO'), and removes operands implied by other operands (FOO &&
+        (FOO || BAR) becomes FOO). The simplified expressions always have the
+        same value as the original ones. Str() and get_referenced_symbols()
+        use the expressions as written in the Kconfig files."""
+        return (self._n_parsed_expr_nodes, self._n_simplified_expr_nodes)
+
     def set_print_warnings(self, print_warnings):
         """Determines whether warnings related to this configuration (for
         things like attempting to assign illegal values to symbols with
@@ -575,6 +1340,40 @@ class Config(object):
         print_undef_assign: If True, such messages will be printed."""
         self.print_undef_assign = print_undef_assign
 
+    def set_change_callback(self, callback):
+        """Registers a function to be called with the items whose values or
+        visibilities change when user values are changed, e.g. so that a
+        menuconfig-style interface only needs to redraw those items:
+
+          def changed(items):
+              for item in items:
+                  redraw(item)
+
+          config.set_change_callback(changed)
+
+        The function is called with a list of the symbols, choices, menus,
+        and comments that changed (in no particular order) after each change
+        made with Symbol.set_user_value(), Symbol.unset_user_value(),
+        unset_user_values(), or load_config() (including calls made by other
+        methods, like allyes()), and once at the end of each set_user_values() call and
+        batch_user_values() block. It is not called if nothing changed.
+        Other changes to the value state, like with set_state(), restore(),
+        or randconfig(), are not reported.
+
+        For symbols, changes to the value (get_value()) and visibility
+        (get_visibility()) are reported. For choices, changes to the
+        selection, mode, and visibility are reported, and for menus and
+        comments, changes to the visibility (and the 'visible if'
+        visibility, for menus).
+
+        Reporting changes requires the old values of the items that might be
+        affected to be calculated before each change, so it makes changes a
+        bit slower.
+
+        callback: The function to call, or None to stop reporting changes."""
+        self._change_callback = callback
+        self._old_states = None
+
     def __str__(self):
         """Returns a string containing various information about the Config."""
         return _lines("Configuration",
@@ -611,8 +1410,21 @@ class Config(object):
         """Parses the Kconfig file 'filename'. Appends the Items in the file
         (and any file it sources) to the list passed in the 'block' parameter.
         See _parse_block() for the meaning of the parameters."""
-        self._parse_block(_FileFeed(filename), None, parent, deps,
-                          visible_if_deps, block)
+        line_feeder = _FileFeed(filename)
+
+        record = _FileRecord(filename, self._cur_file, parent, deps,
+                             visible_if_deps, block)
+        if self._cur_file is None:
+            self._top_file = record
+        else:
+            self._cur_file.children.append(record)
+
+        self._cur_file = record
+        self._parse_block(line_feeder, None, parent, deps, visible_if_deps,
+                          block)
+        self._cur_file = record.parent_record
+
+        record.end = len(block)
 
     def _parse_block(self, line_feeder, end_marker, parent, deps,
                      visible_if_deps, block):
@@ -739,8 +1551,12 @@ class Config(object):
                 # This needs to go before _parse_block() so that we get the
                 # proper menu ordering in the case of nested menus
                 self.menus.append(menu)
-                # Parse contents and put Items in menu.block
-                self._parse_block(line_feeder, T_ENDMENU, menu, menu.dep_expr,
+                # Parse contents and put Items in menu.block. The
+                # dependencies are propagated as written, rather than the
+                # simplified 'dep_expr', as they're also shown by str() and
+                # get_referenced_symbols().
+                self._parse_block(line_feeder, T_ENDMENU, menu,
+                                  _make_and(menu.orig_deps, deps),
                                   _make_and(visible_if_deps,
                                             menu.visible_if_expr),
                                   menu.block)
@@ -893,7 +1709,11 @@ class Config(object):
             elif t0 == T_SELECT:
                 target = tokens.get_next()
 
+                if not stmt.referenced_syms:
+                    stmt.referenced_syms = set()
                 stmt.referenced_syms.add(target)
+                if not stmt.selected_syms:
+                    stmt.selected_syms = set()
                 stmt.selected_syms.add(target)
 
                 new_selects.append(
@@ -904,7 +1724,11 @@ class Config(object):
             elif t0 == T_IMPLY:
                 target = tokens.get_next()
 
+                if not stmt.referenced_syms:
+                    stmt.referenced_syms = set()
                 stmt.referenced_syms.add(target)
+                if not stmt.implied_syms:
+                    stmt.implied_syms = set()
                 stmt.implied_syms.add(target)
 
                 new_implies.append(
@@ -938,9 +1762,13 @@ class Config(object):
             elif t0 == T_RANGE:
                 low = tokens.get_next()
                 high = tokens.get_next()
+                if not stmt.referenced_syms:
+                    stmt.referenced_syms = set()
                 stmt.referenced_syms.add(low)
                 stmt.referenced_syms.add(high)
 
+                if not stmt.ranges:
+                    stmt.ranges = []
                 stmt.ranges.append(
                     (low, high,
                      self._parse_expr(tokens, stmt, line, filename, linenr)
@@ -953,6 +1781,8 @@ class Config(object):
                     stmt.is_special_ = True
                     stmt.is_from_env = True
 
+                    self._env_vars[env_var] = os.environ.get(env_var)
+
                     if env_var not in os.environ:
                         self._warn("The symbol {} references the non-existent "
                                    "environment variable {} and will get the "
@@ -1040,13 +1870,24 @@ class Config(object):
         # Save original dependencies from enclosing menus and ifs
         stmt.deps_from_containing = deps
 
+        # The expressions stored on items that get evaluated are simplified
+        # (and interned). The original expressions (orig_*) are kept as
+        # written, as are the expressions only used to determine choice
+        # symbols and the select and imply terms, which str() shows as
+        # reverse dependencies.
+        simplify = self._simplify_expr
+        intern = self._intern_expr
+
         if isinstance(stmt, (Menu, Comment)):
-            stmt.dep_expr = _make_and(stmt.orig_deps, deps)
+            stmt.dep_expr = simplify(_make_and(stmt.orig_deps, deps))
+            if isinstance(stmt, Menu):
+                # Shown by str()
+                stmt.visible_if_expr = intern(stmt.visible_if_expr)
         else:
             # Symbol or Choice
 
             # See comment for 'menu_dep'
-            stmt.menu_dep = _make_and(deps, depends_on_expr)
+            stmt.menu_dep = intern(_make_and(deps, depends_on_expr))
 
             # Propagate dependencies to prompts
 
@@ -1057,20 +1898,28 @@ class Config(object):
                 cond_expr = _make_and(_make_and(cond_expr, visible_if_deps),
                                       depends_on_expr)
                 # Save original
-                stmt.orig_prompts.append((prompt, cond_expr))
+                stmt.orig_prompts = list(stmt.orig_prompts) + \
+                                    [(prompt, cond_expr)]
                 # Finalize with dependencies from enclosing menus and ifs
-                stmt.prompts.append((prompt, _make_and(cond_expr, deps)))
+                cond_expr = _make_and(cond_expr, deps)
+                stmt.prompts = list(stmt.prompts) + \
+                               [(prompt, simplify(cond_expr))]
+                self._prompt_conds.setdefault(stmt, []).append(cond_expr)
 
             # Propagate dependencies to defaults
 
             # Propagate 'depends on' dependencies
             new_def_exprs = [(val_expr, _make_and(cond_expr, depends_on_expr))
                              for val_expr, cond_expr in new_def_exprs]
-            # Save original
-            stmt.orig_def_exprs.extend(new_def_exprs)
-            # Finalize with dependencies from enclosing menus and ifs
-            stmt.def_exprs.extend([(val_expr, _make_and(cond_expr, deps))
-                                   for val_expr, cond_expr in new_def_exprs])
+            if new_def_exprs:
+                # Save original
+                stmt.orig_def_exprs = list(stmt.orig_def_exprs) + \
+                                      new_def_exprs
+                # Finalize with dependencies from enclosing menus and ifs
+                stmt.def_exprs = list(stmt.def_exprs) + \
+                                 [(simplify(val_expr),
+                                   simplify(_make_and(cond_expr, deps)))
+                                  for val_expr, cond_expr in new_def_exprs]
 
             # Propagate dependencies to selects and implies
 
@@ -1082,23 +1931,30 @@ class Config(object):
                 new_implies = [(target, _make_and(cond_expr, depends_on_expr))
                                for target, cond_expr in new_implies]
                 # Save original
-                stmt.orig_selects.extend(new_selects)
-                stmt.orig_implies.extend(new_implies)
-                # Finalize with dependencies from enclosing menus and ifs
+                if new_selects:
+                    stmt.orig_selects = list(stmt.orig_selects) + new_selects
+                if new_implies:
+                    stmt.orig_implies = list(stmt.orig_implies) + new_implies
+                # Finalize with dependencies from enclosing menus and ifs.
+                # The terms are recorded for reparse(), along with the
+                # definition they come from.
+                def_nr = len(stmt.def_locations)//2 - 1
                 for target, cond in new_selects:
-                    target.rev_dep = \
-                        _make_or(target.rev_dep,
-                                 _make_and(stmt, _make_and(cond, deps)))
+                    term = intern(_make_and(stmt, _make_and(cond, deps)))
+                    self._rev_dep_terms.setdefault(target, []).append(term)
+                    self._cur_file.selects.append((target, term, stmt,
+                                                   def_nr))
                 for target, cond in new_implies:
-                    target.weak_rev_dep = \
-                        _make_or(target.weak_rev_dep,
-                                 _make_and(stmt, _make_and(cond, deps)))
+                    term = intern(_make_and(stmt, _make_and(cond, deps)))
+                    self._weak_rev_dep_terms.setdefault(target, []) \
+                                            .append(term)
+                    self._cur_file.implies.append((target, term, stmt,
+                                                   def_nr))
 
     def _parse_expr(self, feed, cur_item, line, filename=None, linenr=None,
                     transform_m=True):
-        """Parses an expression from the tokens in 'feed' using a simple
-        top-down approach. The result has the form
-        '(<operator>, [<parsed operands>])', where <operator> is e.g.
+        """Parses an expression from the tokens in 'feed'. The result has the
+        form '(<operator>, [<parsed operands>])', where <operator> is e.g.
         kconfiglib.AND. If there is only one operand (i.e., no && or ||), then
         the operand is returned directly. This also goes for subexpressions.
 
@@ -1125,76 +1981,107 @@ class Config(object):
                   '(' <expr> ')'
                   '!' <expr>
                   <expr> '&&' <expr>
-                  <expr> '||' <expr>"""
-
-        # Use instance variables to avoid having to pass these as arguments
-        # through the top-down parser in _parse_expr_rec(), which is tedious
-        # and obfuscates the code. A profiler run shows no noticeable
-        # performance difference.
-        self._cur_item = cur_item
-        self._transform_m = transform_m
-        self._line = line
-        self._filename = filename
-        self._linenr = linenr
-
-        return self._parse_expr_rec(feed)
-
-    def _parse_expr_rec(self, feed):
-        or_term = self._parse_or_term(feed)
-        if not feed.check(T_OR):
-            # Common case -- no need for an OR node since it's just a single
-            # operand
-            return or_term
-        or_terms = [or_term, self._parse_or_term(feed)]
-        while feed.check(T_OR):
-            or_terms.append(self._parse_or_term(feed))
-        return (OR, or_terms)
-
-    def _parse_or_term(self, feed):
-        and_term = self._parse_factor(feed)
-        if not feed.check(T_AND):
-            # Common case -- no need for an AND node since it's just a single
-            # operand
-            return and_term
-        and_terms = [and_term, self._parse_factor(feed)]
-        while feed.check(T_AND):
-            and_terms.append(self._parse_factor(feed))
-        return (AND, and_terms)
-
-    def _parse_factor(self, feed):
-        token = feed.get_next()
-
-        if isinstance(token, (Symbol, str)):
-            if self._cur_item is not None and isinstance(token, Symbol):
-                self._cur_item.referenced_syms.add(token)
-
-            next_token = feed.peek_next()
-            # For conditional expressions ('depends on <expr>',
-            # '... if <expr>', # etc.), "m" and m are rewritten to
-            # "m" && MODULES.
-            if next_token not in TOKEN_TO_RELATION:
-                if self._transform_m and (token is self.m or token == "m"):
-                    return (AND, ["m", self._sym_lookup("MODULES")])
-                return token
-
-            relation = TOKEN_TO_RELATION[feed.get_next()]
-            token_2 = feed.get_next()
-            if self._cur_item is not None and isinstance(token_2, Symbol):
-                self._cur_item.referenced_syms.add(token_2)
-            return (relation, token, token_2)
-
-        if token == T_NOT:
-            return (NOT, self._parse_factor(feed))
-
-        if token == T_OPEN_PAREN:
-            expr_parse = self._parse_expr_rec(feed)
-            if not feed.check(T_CLOSE_PAREN):
-                _parse_error(self._line, "missing end parenthesis",
-                             self._filename, self._linenr)
-            return expr_parse
-
-        _parse_error(self._line, "malformed expression", self._filename,
-                     self._linenr)
+                  <expr> '||' <expr>
+
+        The parser is an iterative operator-precedence parser. Instead of
+        recursing for each precedence level and parenthesis, it keeps the
+        state of the enclosing parenthesized expressions on an explicit stack,
+        so arbitrarily deep nesting works, and ordinary expressions avoid the
+        function call overhead."""
+
+        # The operands of the || expression and of the && expression being
+        # parsed, or None before the first || and &&, and the number of !
+        # operators that apply to the next operand. Saved on 'stack' for each
+        # open parenthesis.
+        or_terms = and_terms = None
+        n_nots = 0
+        stack = []
+
+        while True:
+            token = feed.get_next()
+
+            if isinstance(token, (Symbol, str)):
+                if cur_item is not None and isinstance(token, Symbol):
+                    if not cur_item.referenced_syms:
+                        cur_item.referenced_syms = set()
+                    cur_item.referenced_syms.add(token)
+
+                next_token = feed.peek_next()
+                if next_token in TOKEN_TO_RELATION:
+                    relation = TOKEN_TO_RELATION[feed.get_next()]
+                    token_2 = feed.get_next()
+                    if cur_item is not None and isinstance(token_2, Symbol):
+                        if not cur_item.referenced_syms:
+                            cur_item.referenced_syms = set()
+                        cur_item.referenced_syms.add(token_2)
+                    operand = (relation, token, token_2)
+
+                # For conditional expressions ('depends on <expr>',
+                # '... if <expr>', # etc.), "m" and m are rewritten to
+                # "m" && MODULES.
+                elif transform_m and (token is self.m or token == "m"):
+                    operand = (AND, ["m", self._sym_lookup("MODULES")])
+
+                else:
+                    operand = token
+
+            elif token == T_NOT:
+                n_nots += 1
+                continue
+
+            elif token == T_OPEN_PAREN:
+                stack.append((or_terms, and_terms, n_nots))
+                or_terms = and_terms = None
+                n_nots = 0
+                continue
+
+            else:
+                _parse_error(line, "malformed expression", filename, linenr)
+
+            # We have an operand. Add it to the enclosing expressions,
+            # finishing them as far as the following tokens allow.
+            while True:
+                while n_nots:
+                    operand = (NOT, operand)
+                    n_nots -= 1
+
+                if feed.check(T_AND):
+                    if and_terms is None:
+                        and_terms = [operand]
+                    else:
+                        and_terms.append(operand)
+                    break
+
+                # Common case -- no need for an AND node since it's just a
+                # single operand
+                if and_terms is not None:
+                    and_terms.append(operand)
+                    operand = (AND, and_terms)
+                    and_terms = None
+
+                if feed.check(T_OR):
+                    if or_terms is None:
+                        or_terms = [operand]
+                    else:
+                        or_terms.append(operand)
+                    break
+
+                # Likewise for OR
+                if or_terms is not None:
+                    or_terms.append(operand)
+                    operand = (OR, or_terms)
+                    or_terms = None
+
+                if not stack:
+                    return operand
+
+                if not feed.check(T_CLOSE_PAREN):
+                    _parse_error(line, "missing end parenthesis", filename,
+                                 linenr)
+
+                # The parenthesized expression is an operand of the enclosing
+                # expression
+                or_terms, and_terms, n_nots = stack.pop()
 
     def _tokenize(self, s, for_eval, filename=None, linenr=None):
         """Returns a _Feed instance containing tokens derived from the string
@@ -1249,6 +2136,13 @@ class Config(object):
         strlen = len(s)
         append = tokens.append
 
+        # Locations are not recorded for expressions passed to eval()
+        if not for_eval:
+            file_id = self._filename_ids.get(filename)
+            if file_id is None:
+                file_id = self._filename_ids[filename] = len(self._filenames)
+                self._filenames.append(filename)
+
         # Main tokenization loop. (Handles tokens past the first one.)
         while i < strlen:
             # Test for an identifier/keyword preceded by whitespace first; this
@@ -1275,15 +2169,21 @@ class Config(object):
                     # we see it.
                     sym = self._sym_lookup(name, for_eval)
 
-                    if previous == T_CONFIG or previous == T_MENUCONFIG:
+                    if for_eval:
+                        pass
+                    elif previous == T_CONFIG or previous == T_MENUCONFIG:
                         # If the previous token is T_(MENU)CONFIG
                         # ("(menu)config"), we're tokenizing the first line of
                         # a symbol definition, and should remember this as a
                         # location where the symbol is defined
-                        sym.def_locations.append((filename, linenr))
-                    else:
+                        if not sym.def_locations:
+                            sym.def_locations = array.array("I")
+                        sym.def_locations.extend((file_id, linenr))
+                    elif self._record_ref_locations:
                         # Otherwise, it's a reference to the symbol
-                        sym.ref_locations.append((filename, linenr))
+                        if not sym.ref_locations:
+                            sym.ref_locations = array.array("I")
+                        sym.ref_locations.extend((file_id, linenr))
 
                     append(sym)
 
@@ -1399,128 +2299,347 @@ class Config(object):
             self.syms[name] = new_sym
         return new_sym
 
+    def _intern_expr(self, expr):
+        """Returns the shared instance of the expression 'expr', with all its
+        subexpressions shared as well. 'expr' itself becomes the shared
+        instance if there is none yet. Shared expressions must not be
+        modified."""
+        if expr is None or isinstance(expr, (Symbol, str)):
+            return expr
+
+        # Maps the IDs of the compound subexpressions of 'expr' to their
+        # shared instances
+        interned = {}
+        for subexpr in _compound_subexprs(expr, interned):
+            if subexpr[0] == AND or subexpr[0] == OR:
+                shared = self._shared_expr(
+                    subexpr[0],
+                    [interned[id(arg)] if isinstance(arg, tuple) else arg
+                     for arg in subexpr[1]])
+            elif subexpr[0] == NOT:
+                arg = subexpr[1]
+                shared = self._shared_expr(
+                    NOT, interned[id(arg)] if isinstance(arg, tuple) else arg)
+            else:
+                # Relations only have symbols and strings as operands
+                shared = self._exprs.setdefault(subexpr, subexpr)
+            interned[id(subexpr)] = shared
+
+        return interned[id(expr)]
+
+    def _shared_expr(self, op, arg):
+        """_intern_expr() helper. Returns the shared (op, arg) expression,
+        where 'op' is AND, OR, or NOT, and 'arg' the list of operands or the
+        operand. The operands must already be interned."""
+        if op == NOT:
+            key = (NOT, _expr_key(arg))
+        else:
+            key = (op, tuple([_expr_key(operand) for operand in arg]))
+        shared = self._exprs.get(key)
+        if shared is None:
+            shared = self._exprs[key] = (op, arg)
+        return shared
+
+    def _simplify_expr(self, expr):
+        """Returns a simplified version of the expression 'expr', which always
+        has the same value, interned like by _intern_expr(). Used for the
+        expressions stored on items after parsing. See
+        get_expr_simplification_stats()."""
+        if expr is None:
+            return None
+
+        _, simplified, n_nodes = self._simplify_expr_rec(expr)
+        self._n_parsed_expr_nodes += n_nodes
+        # Simplified expressions simplify to themselves, so this just looks up
+        # the node count
+        self._n_simplified_expr_nodes += self._simplify_expr_rec(simplified)[2]
+        return simplified
+
+    def _simplify_expr_rec(self, expr):
+        """_simplify_expr() helper. Simplifies 'expr' and returns an (expr,
+        simplified expression, number of nodes in 'expr') tuple.
+
+        The results for compound expressions are memoized by identity while
+        parsing, as the dependencies from enclosing menus and ifs are the same
+        objects for all items within them."""
+        if not isinstance(expr, tuple):
+            return (expr, expr, 1)
+
+        memo = self._simplified
+        res = memo.get(id(expr))
+        if res is None:
+            # Simplify the subexpressions bottom-up, so that
+            # _simplify_compound() finds its operands in the memo instead of
+            # recursing. The memo keeps the expressions alive, so their IDs
+            # won't be reused.
+            for subexpr in _compound_subexprs(expr, memo):
+                memo[id(subexpr)] = self._simplify_compound(subexpr)
+            res = memo[id(expr)]
+        return res
+
+    def _simplify_compound(self, expr):
+        """_simplify_expr_rec() helper. Simplifies the compound expression
+        'expr' without looking in the memo. The compound operands of 'expr'
+        must already be in the memo."""
+        op = expr[0]
+
+        if op == NOT:
+            _, arg, n_nodes = self._simplify_expr_rec(expr[1])
+            val = self._const_tri(arg)
+            if val is not None:
+                return (expr, self._tri_to_const(2 - val), n_nodes + 1)
+            if isinstance(arg, tuple) and arg[0] == NOT:
+                # !!FOO is FOO. The "m" to "y" promotion only applies to the
+                # value of the whole expression.
+                return (expr, arg[1], n_nodes + 1)
+            return (expr, self._new_simplified(NOT, arg, (NOT, _expr_key(arg))),
+                    n_nodes + 1)
+
+        if op in RELATIONS:
+            _, op1, op2 = expr
+            if self._const_tri(op1) is not None and \
+               self._const_tri(op2) is not None:
+                return (expr, self._tri_to_const(_eval_relation(expr)), 3)
+            if op1 == op2 and (op == EQUAL or op == UNEQUAL):
+                return (expr, self._tri_to_const(2 if op == EQUAL else 0), 3)
+            shared = self._exprs.setdefault(expr, expr)
+            self._simplified[id(shared)] = (shared, shared, 3)
+            return (expr, shared, 3)
+
+        # AND or OR. The value is the minimum (AND) or maximum (OR) of the
+        # operands. 'absorbing' is the value that decides the result, and
+        # 'neutral' the value that can be left out.
+        if op == AND:
+            absorbing, neutral, other_op = 0, 2, OR
+        else:
+            absorbing, neutral, other_op = 2, 0, AND
+
+        # Flatten and remove duplicates. The operands are interned, so
+        # identical operands have the same key.
+        n_nodes = 1
+        args = []
+        arg_keys = []
+        keys = set()
+        decided = None
+        for arg in expr[1]:
+            if isinstance(arg, tuple):
+                _, arg, n_arg_nodes = self._simplify_expr_rec(arg)
+                n_nodes += n_arg_nodes
+            else:
+                n_nodes += 1
+            if decided is not None:
+                # Keep counting the nodes of the remaining operands
+                continue
+            for operand in arg[1] if isinstance(arg, tuple) and \
+                                     arg[0] == op else (arg,):
+                # Inlined _expr_key(), as this is the hot loop
+                if isinstance(operand, tuple):
+                    key = id(operand)
+                else:
+                    val = self._const_tri(operand)
+                    if val == absorbing:
+                        decided = operand
+                        break
+                    if val == neutral:
+                        continue
+                    key = operand
+                if key not in keys:
+                    keys.add(key)
+                    args.append(operand)
+                    arg_keys.append(key)
+
+        if decided is not None:
+            return (expr, decided, n_nodes)
+
+        # Absorption: FOO && (FOO || BAR) is FOO, and FOO || (FOO && BAR) is
+        # FOO. This removes conditions from 'depends on' and 'if' that are
+        # implied by the dependencies of enclosing menus and ifs.
+        for i in range(len(args) - 1, -1, -1):
+            arg = args[i]
+            if isinstance(arg, tuple) and arg[0] == other_op and \
+               any([_expr_key(operand) in keys for operand in arg[1]]):
+                del args[i]
+                del arg_keys[i]
+
+        if not args:
+            return (expr, self._tri_to_const(neutral), n_nodes)
+        if len(args) == 1:
+            return (expr, args[0], n_nodes)
+        return (expr, self._new_simplified(op, args, (op, tuple(arg_keys))),
+                n_nodes)
+
+    def _new_simplified(self, op, arg, key):
+        """_simplify_compound() helper. Returns the shared (op, arg)
+        expression, where 'key' is its key (see _shared_expr()), and records
+        that it simplifies to itself, along with its node count. 'arg' must
+        already be simplified."""
+        shared = self._exprs.get(key)
+        if shared is None:
+            shared = self._exprs[key] = (op, arg)
+        if id(shared) not in self._simplified:
+            memo = self._simplified
+            if op == NOT:
+                n_nodes = 1 + (memo[id(arg)][2] if isinstance(arg, tuple)
+                               else 1)
+            else:
+                n_nodes = 1
+                for operand in arg:
+                    n_nodes += memo[id(operand)][2] \
+                        if isinstance(operand, tuple) else 1
+            memo[id(shared)] = (shared, shared, n_nodes)
+        return shared
+
+    def _const_tri(self, expr):
+        """_simplify_expr() helper. Returns the value of 'expr' as an integer
+        (see _eval_tri()) if it is a constant (a string or one of the symbols
+        n, m, and y), and None otherwise."""
+        if isinstance(expr, str):
+            return TRI_TO_INT.get(expr, 0)
+        if expr is self.n:
+            return 0
+        if expr is self.m:
+            return 1
+        if expr is self.y:
+            return 2
+        return None
+
+    def _tri_to_const(self, val):
+        """_simplify_expr() helper. Returns the constant symbol for the value
+        'val' (0, 1, or 2)."""
+        return (self.n, self.m, self.y)[val]
+
+    def _unpack_locations(self, locations):
+        """Turns the packed (filename index, line number) pairs stored in
+        Symbol.def_locations and Symbol.ref_locations into a list of
+        (filename, linenr) tuples."""
+        filenames = self._filenames
+        return [(filenames[locations[i]], locations[i + 1])
+                for i in range(0, len(locations), 2)]
+
     #
     # Expression evaluation
     #
 
     def _eval_expr(self, expr):
         """Evaluates an expression to "n", "m", or "y"."""
+        return TRI_TO_STR[self._eval_tri(expr)]
+
+    def _eval_tri(self, expr):
+        """Like _eval_expr(), but returns the value as an integer: 0, 1, or 2
+        for "n", "m", and "y", respectively. This is the representation used
+        internally during evaluation, as it allows ordinary integer
+        comparisons."""
 
         # Handles e.g. an "x if y" condition where the "if y" part is missing.
         if expr is None:
-            return "y"
+            return 2
 
-        res = self._eval_expr_rec(expr)
-        if res == "m":
+        res = self._eval_expr_iter(expr)
+        if res == 1:
             # Promote "m" to "y" if we're running without modules.
             #
             # Internally, "m" is often rewritten to "m" && MODULES by both the
             # C implementation and Kconfiglib, which takes care of cases where
             # "m" should be demoted to "n" instead.
             modules_sym = self.syms.get("MODULES")
-            if modules_sym is None or modules_sym.get_value() != "y":
-                return "y"
+            if modules_sym is None or modules_sym._get_tri_value() != 2:
+                return 2
         return res
 
-    def _eval_expr_rec(self, expr):
-        if isinstance(expr, Symbol):
-            # Non-bool/tristate symbols are always "n" in a tristate sense,
-            # regardless of their value
-            if expr.type != BOOL and expr.type != TRISTATE:
-                return "n"
-            return expr.get_value()
+    def _eval_expr_iter(self, expr):
+        """_eval_tri() helper. Evaluates 'expr' without the "m" to "y"
+        promotion. Uses an explicit stack of the enclosing AND, OR, and NOT
+        expressions instead of recursion, so that arbitrarily deeply nested
+        expressions can be evaluated."""
 
-        if isinstance(expr, str):
-            return expr if (expr == "y" or expr == "m") else "n"
-
-        # Ordered by frequency
-
-        if expr[0] == AND:
-            res = "y"
-            for subexpr in expr[1]:
-                ev = self._eval_expr_rec(subexpr)
-                # Return immediately upon discovering an "n" term
-                if ev == "n":
-                    return "n"
-                if ev == "m":
-                    res = "m"
-            # 'res' is either "m" or "y" here; we already handled the
-            # short-circuiting "n" case in the loop.
-            return res
+        # Each entry is an [iterator over the remaining operands, deciding
+        # value, result so far] list for AND and OR, and None for NOT. The
+        # deciding value is "n" for AND and "y" for OR.
+        stack = []
 
-        if expr[0] == NOT:
-            ev = self._eval_expr_rec(expr[1])
-            if ev == "y":
-                return "n"
-            return "y" if (ev == "n") else "m"
-
-        if expr[0] == OR:
-            res = "n"
-            for subexpr in expr[1]:
-                ev = self._eval_expr_rec(subexpr)
-                # Return immediately upon discovering a "y" term
-                if ev == "y":
-                    return "y"
-                if ev == "m":
-                    res = "m"
-            # 'res' is either "n" or "m" here; we already handled the
-            # short-circuiting "y" case in the loop.
-            return res
+        while True:
+            # Descend into 'expr' until we get a value, or an AND or OR to
+            # evaluate the operands of ('val' is None)
+
+            if isinstance(expr, Symbol):
+                # Non-bool/tristate symbols are always "n" in a tristate
+                # sense, regardless of their value
+                if expr.type != BOOL and expr.type != TRISTATE:
+                    val = 0
+                else:
+                    val = expr._get_tri_value()
+
+            elif isinstance(expr, str):
+                val = TRI_TO_INT.get(expr, 0)
 
-        if expr[0] in RELATIONS:
-            # Implements <, <=, >, >= comparisons as well. These were added to
-            # kconfig in 31847b67 (kconfig: allow use of relations other than
-            # (in)equality).
+            # Ordered by frequency
 
-            # This mirrors the C implementation pretty closely. Perhaps there's
-            # a more pythonic way to structure this.
+            elif expr[0] == AND:
+                entry = [iter(expr[1]), 0, 2]
+                val = None
 
-            oper, op1, op2 = expr
-            op1_type, op1_str = _type_and_val(op1)
-            op2_type, op2_str = _type_and_val(op2)
+            elif expr[0] == NOT:
+                stack.append(None)
+                expr = expr[1]
+                continue
+
+            elif expr[0] == OR:
+                entry = [iter(expr[1]), 2, 0]
+                val = None
+
+            elif expr[0] in RELATIONS:
+                val = _eval_relation(expr)
 
-            # If both operands are strings...
-            if op1_type == STRING and op2_type == STRING:
-                # ...then compare them lexicographically
-                comp = _strcmp(op1_str, op2_str)
             else:
-                # Otherwise, try to compare them as numbers
-                try:
-                    comp = int(op1_str, TYPE_TO_BASE[op1_type]) - \
-                           int(op2_str, TYPE_TO_BASE[op2_type])
-                except ValueError:
-                    # They're not both valid numbers. If the comparison is
-                    # anything but = or !=, return 'n'. Otherwise, reuse
-                    # _strcmp() to check for (in)equality.
-                    if oper not in (EQUAL, UNEQUAL):
-                        return "n"
-                    comp = _strcmp(op1_str, op2_str)
-
-            if   oper == EQUAL:         res = comp == 0
-            elif oper == UNEQUAL:       res = comp != 0
-            elif oper == LESS:          res = comp < 0
-            elif oper == LESS_EQUAL:    res = comp <= 0
-            elif oper == GREATER:       res = comp > 0
-            elif oper == GREATER_EQUAL: res = comp >= 0
-
-            return "y" if res else "n"
-
-        _internal_error("Internal error while evaluating expression: "
-                        "unknown operation {}.".format(expr[0]))
-
-    def _eval_min(self, e1, e2):
-        """Returns the minimum value of the two expressions. Equates None with
-        'y'."""
-        e1_eval = self._eval_expr(e1)
-        e2_eval = self._eval_expr(e2)
-        return e1_eval if tri_less(e1_eval, e2_eval) else e2_eval
-
-    def _eval_max(self, e1, e2):
-        """Returns the maximum value of the two expressions. Equates None with
-        'y'."""
-        e1_eval = self._eval_expr(e1)
-        e2_eval = self._eval_expr(e2)
-        return e1_eval if tri_greater(e1_eval, e2_eval) else e2_eval
+                _internal_error("Internal error while evaluating expression: "
+                                "unknown operation {}.".format(expr[0]))
+
+            while True:
+                if val is None:
+                    # Evaluate the remaining operands of 'entry'. Symbols and
+                    # strings are handled here, as they're the most common
+                    # operands.
+                    for expr in entry[0]:
+                        if isinstance(expr, Symbol):
+                            if expr.type != BOOL and expr.type != TRISTATE:
+                                op_val = 0
+                            else:
+                                op_val = expr._get_tri_value()
+                        elif isinstance(expr, str):
+                            op_val = TRI_TO_INT.get(expr, 0)
+                        else:
+                            # Evaluate the operand first
+                            stack.append(entry)
+                            break
+
+                        # Return immediately upon discovering an "n" AND
+                        # operand or a "y" OR operand
+                        if op_val == entry[1]:
+                            val = op_val
+                            break
+                        if op_val == 1:
+                            entry[2] = 1
+                    else:
+                        # The result is "m" if some operand was "m", and the
+                        # non-deciding value otherwise
+                        val = entry[2]
+
+                    if val is None:
+                        break
+
+                # Propagate 'val' to the enclosing expression
+
+                if not stack:
+                    return val
+
+                entry = stack.pop()
+                if entry is None:
+                    # NOT. Maps "n" to "y", "m" to "m", and "y" to "n".
+                    val = 2 - val
+                elif val != entry[1]:
+                    if val == 1:
+                        entry[2] = 1
+                    val = None
 
     #
     # Dependency tracking (for caching and invalidation)
@@ -1534,42 +2653,27 @@ class Config(object):
         than necessary as we don't do any complicated analysis of the
         expressions."""
 
-        # Adds 'sym' as a directly dependent symbol to all symbols that appear
-        # in the expression 'e'
-        def add_expr_deps(e, sym):
-            for s in _get_expr_syms(e):
-                s.dep.add(sym)
-
         # The directly dependent symbols of a symbol are:
         #  - Any symbols whose prompts, default values, rev_dep (select
         #    condition), weak_rev_dep (imply condition) or ranges depend on the
         #    symbol
         #  - Any symbols that belong to the same choice statement as the symbol
         #    (these won't be included in 'dep' as that makes the dependency
-        #    graph unwieldy, but Symbol._get_dependent() will include them)
+        #    graph unwieldy, but _DepGraph will include them)
         #  - Any symbols in a choice statement that depends on the symbol
+        #
+        # See _get_dep_syms().
         for sym in self.syms_iter():
-            for _, e in sym.prompts:
-                add_expr_deps(e, sym)
-
-            for v, e in sym.def_exprs:
-                add_expr_deps(v, sym)
-                add_expr_deps(e, sym)
-
-            add_expr_deps(sym.rev_dep, sym)
-            add_expr_deps(sym.weak_rev_dep, sym)
-
-            for l, u, e in sym.ranges:
-                add_expr_deps(l, sym)
-                add_expr_deps(u, sym)
-                add_expr_deps(e, sym)
+            for s in _get_dep_syms(sym):
+                if not s.dep:
+                    s.dep = set()
+                s.dep.add(sym)
 
-            if sym.is_choice_sym:
-                choice = sym.parent
-                for _, e in choice.prompts:
-                    add_expr_deps(e, sym)
-                for _, e in choice.def_exprs:
-                    add_expr_deps(e, sym)
+        self._dep_graph = None
+        self._modules_dep = None
+        self._reset_menu_deps()
+        self._state_syms = None
+        self._reset_term_counters()
 
     def _eq_to_sym(self, eq):
         """_expr_depends_on() helper. For (in)equalities of the form sym = y/m
@@ -1602,25 +2706,891 @@ class Config(object):
         if expr is None:
             return False
 
-        def rec(expr):
-            if isinstance(expr, str):
-                return False
+        # Only the operands of ANDs are looked at
+        stack = [expr]
+        while stack:
+            expr = stack.pop()
             if isinstance(expr, Symbol):
-                return expr is sym
-
-            if expr[0] in (EQUAL, UNEQUAL):
-                return self._eq_to_sym(expr) is sym
-            if expr[0] == AND:
-                for and_expr in expr[1]:
-                    if rec(and_expr):
-                        return True
+                if expr is sym:
+                    return True
+            elif isinstance(expr, str):
+                continue
+            elif expr[0] in (EQUAL, UNEQUAL):
+                if self._eq_to_sym(expr) is sym:
+                    return True
+            elif expr[0] == AND:
+                stack.extend(expr[1])
+        return False
+
+    def _invalidate_all(self):
+        for sym in self.syms_iter():
+            sym._invalidate()
+
+    def _propagate_change(self, syms):
+        """Updates the cached values after the user values of the symbols in
+        'syms' have changed.
+
+        Rather than invalidating every symbol that might depend on the changed
+        symbols, each symbol is recalculated and the symbols that depend on it
+        are only looked at if its value actually changed (early cutoff).
+        Symbols are processed in dependency order (see _DepGraph), so that a
+        symbol is normally recalculated at most once, after the symbols it
+        depends on.
+
+        Symbols without a cached value are just invalidated: symbols get a
+        cached value whenever they're evaluated, so no other cached value can
+        have been calculated from them."""
+        # Handle the symbols without cached values right away, and skip
+        # building the dependency graph if that's all there is to do (e.g.
+        # when loading a configuration before anything has been evaluated).
+        # The symbols in a choice are handled together below.
+        seeds = []
+        for sym in syms:
+            if sym.cached_val is None and not sym.is_choice_sym:
+                sym._invalidate()
+            else:
+                seeds.append(sym)
+        if not seeds:
+            return
+
+        graph = self._get_dep_graph()
+        ids, comp, graph_syms = graph.ids, graph.comp, graph.syms
+        modules_sym = self.syms.get("MODULES")
+
+        heap = []
+        pending = set()
+
+        def enqueue(sym):
+            if sym not in pending:
+                pending.add(sym)
+                i = ids[sym]
+                heapq.heappush(heap, (comp[i], i))
+
+        for sym in seeds:
+            enqueue(sym)
+
+        while heap:
+            sym = graph_syms[heapq.heappop(heap)[1]]
+            if sym not in pending:
+                # Already recalculated together with its choice
+                continue
+
+            if sym.is_choice_sym:
+                # The symbols in a choice depend on each other through the
+                # selection, so recalculate them together
+                members = sym.parent.actual_symbols
+            else:
+                members = (sym,)
+
+            old_vals = [member.cached_val for member in members]
+            for member in members:
+                pending.discard(member)
+                member._invalidate()
+
+            for member, old_val in zip(members, old_vals):
+                if old_val is None or member.get_value() == old_val:
+                    continue
+
+                for s in member.dep:
+                    enqueue(s)
+
+                if member is modules_sym:
+                    # "m" is promoted to "y" when modules are disabled, which
+                    # affects symbols that don't reference MODULES. That
+                    # usually covers a large part of the configuration, so
+                    # it's cheaper to just invalidate them than to
+                    # recalculate and compare them.
+                    for s in self._get_modules_dep():
+                        s._invalidate()
+
+    def _user_value_changed(self, sym):
+        """Called after the user value of 'sym' has been changed via the API.
+        Updates the cached values, or records the symbol if we're in a
+        batch_user_values() block."""
+        if self._batch is None:
+            self._propagate_change((sym,))
+            self._report_changes()
+        else:
+            self._batch.append(sym)
+
+    def _reset_term_counters(self):
+        """Makes all _TermCounters count their terms from scratch the next
+        time they're evaluated, and drops the registrations of counters that
+        are no longer used."""
+        self._counter_gen += 1
+        self._counter_index = {}
+
+    def _get_affected_syms(self, syms):
+        """Returns the symbols whose values might change when the user values
+        of the symbols in 'syms' change, including the symbols themselves."""
+        affected = self._get_dep_graph().reachable(syms)
+        if self.syms.get("MODULES") in syms:
+            affected = set(affected)
+            affected.update(self._get_modules_dep())
+        return affected
+
+    def _get_menu_deps(self):
+        """Returns the dictionary that maps symbols to the menus and comments
+        whose visibility depends on them, building it if needed. Invalidating
+        a symbol invalidates the cached visibilities of the menus and
+        comments it maps to.
+
+        Like for symbols (see _get_modules_dep()), menus and comments whose
+        visibility can be "m" are mapped from MODULES as well, as "m" is
+        promoted to "y" when modules are disabled."""
+        if self._menu_deps is None:
+            menu_deps = {}
+            modules_sym = self.syms.get("MODULES")
+            for item in self.menus + self.comments:
+                for sym in item.all_referenced_syms:
+                    menu_deps.setdefault(sym, []).append(item)
+
+                if modules_sym is not None and \
+                   modules_sym not in item.all_referenced_syms and \
+                   _may_be_m(item):
+                    menu_deps.setdefault(modules_sym, []).append(item)
+            self._menu_deps = menu_deps
+        return self._menu_deps
+
+    def _reset_menu_deps(self):
+        """Drops the map built by _get_menu_deps(), for when the 'dep' sets
+        change. The cached menu and comment visibilities are invalidated, as
+        symbols no longer invalidate them without the map."""
+        if self._menu_deps is not None:
+            self._menu_deps = None
+            for item in self.menus + self.comments:
+                item._invalidate()
+
+    def _get_shared_exprs(self):
+        """Returns the set of IDs of the compound expressions that are
+        referenced more than once from the compiled expressions of items and
+        from other compound expressions, building it if needed. These are
+        memoized when compiled (see _compile_expr_rec()).
+
+        The set is built by looking at the expressions rather than while
+        interning them, so that it also works for configurations loaded from
+        the parse cache (pickling preserves the sharing)."""
+        if self._shared_exprs is None:
+            uses = {}
+            stack = []
+            for sym in self.syms_iter():
+                stack.extend([cond for _, cond in sym.prompts])
+                for val, cond in sym.def_exprs:
+                    stack.append(val)
+                    stack.append(cond)
+                stack.extend([cond for _, _, cond in sym.ranges])
+                stack.append(sym.rev_dep)
+                stack.append(sym.weak_rev_dep)
+            for choice in self.choices:
+                stack.extend([cond for _, cond in choice.prompts])
+                stack.extend([cond for _, cond in choice.def_exprs])
+            for menu in self.menus:
+                stack.append(menu.dep_expr)
+                stack.append(menu.visible_if_expr)
+            for comment in self.comments:
+                stack.append(comment.dep_expr)
+
+            while stack:
+                expr = stack.pop()
+                if not isinstance(expr, tuple):
+                    continue
+                n = uses.get(id(expr), 0)
+                uses[id(expr)] = n + 1
+                if n == 0:
+                    # First time the expression is seen. Count the references
+                    # from its operands.
+                    if expr[0] == AND or expr[0] == OR:
+                        stack.extend(expr[1])
+                    elif expr[0] == NOT:
+                        stack.append(expr[1])
+
+            self._shared_exprs = set([expr_id for expr_id, n in uses.items()
+                                      if n > 1])
+        return self._shared_exprs
+
+    def _note_old_states(self, syms):
+        """Records the states (see Symbol._get_change_state()) of the items
+        that might be affected by changes to the user values of the symbols
+        in 'syms', before the changes are made. If 'syms' is None, all items
+        are recorded. _report_changes() later reports the items whose states
+        changed. Items that have already been recorded are skipped, so that
+        several changes can be reported together."""
+        if self._old_states is None:
+            self._old_states = {}
+        old_states = self._old_states
+
+        if syms is None:
+            items = list(self.syms_iter()) + self.choices + self.menus + \
+                    self.comments
+        else:
+            items = self._get_affected_syms(syms)
+            choices = set([sym.parent for sym in items if sym.is_choice_sym])
+            menu_deps = self._get_menu_deps()
+            menus = set([menu for sym in items if sym in menu_deps
+                         for menu in menu_deps[sym]])
+            items = list(items) + list(choices) + list(menus)
+
+        for item in items:
+            if item not in old_states:
+                old_states[item] = item._get_change_state()
+
+    def _report_changes(self):
+        """Calls the change callback (see set_change_callback()) with the
+        items whose states changed since they were recorded by
+        _note_old_states(). Does nothing if nothing has been recorded or if
+        we're in a batch_user_values() block, in which case the changes are
+        reported at the end of the block."""
+        if self._old_states is None or self._batch is not None:
+            return
+
+        old_states = self._old_states
+        self._old_states = None
+        if self._change_callback is None:
+            return
+
+        changed = [item for item, old_state in old_states.items()
+                   if item._get_change_state() != old_state]
+        if changed:
+            self._change_callback(changed)
+
+    def _set_all(self, sym_step, choice_step):
+        """allyes()/allno()/allmod() helper. Calls sym_step(sym) for each
+        symbol outside choices and choice_step(choice) for each choice
+        (unless 'choice_step' is None), which change user values, until
+        nothing changes anymore.
+
+        The dependency graph is used as a worklist: items are visited in
+        dependency order, and when the value of a symbol changes, only the
+        symbols that depend on it are visited again. As dependent symbols
+        come later in the order, they are usually visited in the same sweep,
+        and further sweeps are only needed for dependency loops."""
+        order = self._get_dep_graph().members
+        modules_sym = self.syms.get("MODULES")
+
+        pending = set(order)
+        enqueue = pending.add
+
+        # The value of each symbol when it was last visited
+        vals = {}
+        for sym in order:
+            vals[sym] = sym.get_value()
+
+        while pending:
+            for sym in order:
+                if sym not in pending:
+                    continue
+
+                if sym.is_choice_sym:
+                    members = sym.parent.actual_symbols
+                    for member in members:
+                        pending.discard(member)
+                    if choice_step is not None:
+                        choice_step(sym.parent)
+                else:
+                    members = (sym,)
+                    pending.discard(sym)
+                    if sym.type == BOOL or sym.type == TRISTATE:
+                        sym_step(sym)
+
+                for member in members:
+                    val = member.get_value()
+                    if val == vals[member]:
+                        continue
+                    vals[member] = val
+
+                    for s in member.dep:
+                        enqueue(s)
+                    if member is modules_sym:
+                        # See _propagate_change()
+                        for s in self._get_modules_dep():
+                            enqueue(s)
+
+    def _randconfig(self, rand, probability):
+        """randconfig()/randconfigs() helper. Gives the configuration random
+        user values, using the random.Random instance 'rand'.
+
+        Symbols are visited in dependency order (see _DepGraph), so the
+        values of the symbols a symbol depends on are final when it is
+        visited. The user values are set without updating any other symbols.
+        The old user value of each symbol is removed and the symbol is
+        invalidated when it is visited, which is early enough since only the
+        values of symbols visited earlier are looked at (except in dependency
+        loops, which are handled the same way).
+
+        The order of symbols with no dependencies between them varies
+        between runs, so the random numbers are drawn up front, in the order
+        of definition. That keeps the configuration for a given seed the
+        same."""
+        draws = dict(zip(self.kconfig_syms,
+                         [rand.random() for _ in self.kconfig_syms]))
+        for choice in self.choices:
+            draws[choice] = (rand.random(), rand.random(), rand.random())
+
+        # Promoting "m" to "y" when modules are disabled affects symbols that
+        # don't have MODULES in their dependencies, so handle it first
+        order = self._get_dep_graph().members
+        modules_sym = self.syms.get("MODULES")
+        if modules_sym is not None:
+            order = [modules_sym] + [sym for sym in order
+                                     if sym is not modules_sym]
+
+        for sym in order:
+            if sym.is_choice_sym:
+                choice = sym.parent
+                if sym is choice.actual_symbols[0]:
+                    _set_choice_random(choice, draws, probability,
+                                       modules_sym)
+                continue
+
+            sym._unset_user_value_no_recursive_invalidate()
+            if sym.type != BOOL and sym.type != TRISTATE or \
+               sym not in draws:
+                continue
+
+            assignable = sym.get_assignable_values()
+            if assignable:
+                # draw/probability is uniformly distributed in [0, 1) when
+                # draw < probability, so it can be used to pick the value
+                draw = draws[sym]
+                if draw < probability:
+                    # get_assignable_values() includes "m" for bool symbols
+                    # when modules are disabled
+                    higher = assignable[1:] if sym.type == TRISTATE else \
+                             ["y"]
+                    val = higher[int(draw/probability*len(higher))]
+                else:
+                    val = assignable[0]
+                sym._set_user_value_no_invalidate(val, True)
+                sym._invalidate()
+
+    def _record(self, item):
+        """Saves the value state of 'item' (a symbol, choice, menu or comment)
+        to the journal of the innermost snapshot, unless it has already been
+        saved there. Called before the value state of the item changes, when
+        self._journal is not None."""
+        journal = self._journal
+        if item not in journal:
+            journal[item] = item._save_values()
+
+    def _get_state_syms(self):
+        """Returns the list of symbols that ValueState stores values for,
+        creating it if needed."""
+        if self._state_syms is None:
+            self._state_syms = list(self.syms_iter())
+        return self._state_syms
+
+    def _get_dep_graph(self):
+        """Returns the _DepGraph for the configuration, building it if
+        needed."""
+        if self._dep_graph is None:
+            self._dep_graph = _DepGraph(self.syms_iter())
+        return self._dep_graph
+
+    def _get_modules_dep(self):
+        """_propagate_change() helper. Returns a list of the symbols whose
+        values might depend on MODULES without it appearing in their 'dep' sets, as
+        "m" is promoted to "y" when modules are disabled (see _eval_tri()),
+        together with all symbols that depend on them. See
+        _depends_on_modules()."""
+        if self._modules_dep is None:
+            self._modules_dep = self._get_dep_graph().reachable(
+              [sym for sym in self.syms_iter() if _depends_on_modules(sym)])
+        return self._modules_dep
+
+    #
+    # Incremental reparsing
+    #
+
+    def _reparse_file(self, record):
+        """reparse() helper. Reparses the file for the _FileRecord 'record',
+        replacing its items, and updates the rest of the configuration
+        accordingly. Returns False if the file can't be reparsed
+        incrementally, in which case everything needs to be reparsed (the
+        configuration might be left in an inconsistent state)."""
+
+        if record.parent_record is None:
+            # The top-level Kconfig file changed
             return False
 
-        return rec(expr)
+        # Without reference locations, there's no way to tell which symbols
+        # were only referenced from the old files
+        if not self._record_ref_locations:
+            return False
 
-    def _invalidate_all(self):
+        # Choice symbols are determined when the choice is parsed, and would
+        # need redetermining
+        item = record.parent
+        while item is not None:
+            if isinstance(item, Choice):
+                return False
+            item = item.parent
+
+        old_records = record.records()
+        old_filenames = set([_clean_up_path(old_record.filename)
+                             for old_record in old_records])
+        old_syms = [item for item in
+                    _block_items(record.block[record.start:record.end])
+                    if isinstance(item, Symbol)]
+
+        # Symbols defined in other files too would need to have their
+        # properties from those files kept (in order)
+        if not _defined_in(old_syms, old_filenames):
+            return False
+
+        # Symbols selected and implied by the old symbols
+        targets = set()
+        for old_record in old_records:
+            for entry in old_record.selects + old_record.implies:
+                targets.add(entry[0])
+
+        # Remove the dependency edges of all symbols whose expressions are
+        # about to change. They are re-added (for the new expressions) below.
+        affected = set(old_syms) | targets
+        for sym in affected:
+            for s in _get_dep_syms(sym):
+                if s.dep:
+                    s.dep.discard(sym)
+
+        for sym in old_syms:
+            sym._reset()
+            if sym is self.defconfig_sym:
+                self.defconfig_sym = None
+
+        # Remove references from the old files. Symbols that end up neither
+        # defined nor referenced are removed after reparsing, as a full parse
+        # would not have created them.
+        old_file_ids = set([i for i, filename in enumerate(self._filenames)
+                            if filename in old_filenames])
+        unreferenced = []
+        for sym in self.syms_iter():
+            locations = sym.ref_locations
+            if locations:
+                ref_locations = array.array("I")
+                for i in range(0, len(locations), 2):
+                    if locations[i] not in old_file_ids:
+                        ref_locations.extend(locations[i:i + 2])
+                if len(ref_locations) != len(locations):
+                    if ref_locations:
+                        sym.ref_locations = ref_locations
+                    else:
+                        sym.ref_locations = _NO_ENTRIES
+                        unreferenced.append(sym)
+
+        # Reparse the file, splicing the new items into the block in place of
+        # the old ones. The new record replaces the old one.
+        block = record.block
+        tail = block[record.end:]
+        del block[record.start:]
+
+        parent_record = record.parent_record
+        index = parent_record.children.index(record)
+        self._cur_file = parent_record
+        # Expressions are only shared within the reparsed file
+        self._exprs = {}
+        self._simplified = {}
+        self._prompt_conds = {}
+        self._parse_file(record.filename, record.parent, record.deps,
+                         record.visible_if_deps, block)
+        self._exprs = None
+        self._simplified = None
+        self._prompt_conds = None
+        self._add_rev_dep_terms()
+        new_record = parent_record.children.pop()
+        parent_record.children[index] = new_record
+
+        block.extend(tail)
+
+        # Adjust the item indices of the records that follow the new record
+        # within the same block, and of the enclosing records
+        delta = new_record.end - record.end
+        if delta:
+            new_records = new_record.records()
+            new_ids = set([id(r) for r in new_records])
+            seen = False
+            for r in self._top_file.records():
+                if r is new_record:
+                    seen = True
+                elif seen and r.block is block and id(r) not in new_ids:
+                    r.start += delta
+                    r.end += delta
+
+            r = parent_record
+            while r is not None:
+                if r.block is block:
+                    r.end += delta
+                r = r.parent_record
+        else:
+            new_records = new_record.records()
+
+        new_filenames = set([_clean_up_path(r.filename) for r in new_records])
+        new_items = _block_items(block[new_record.start:new_record.end])
+        new_syms = [item for item in new_items if isinstance(item, Symbol)]
+
+        if not _defined_in(new_syms, new_filenames) or self.named_choices:
+            return False
+
+        paths = [os.path.abspath(r.filename)
+                 for r in self._top_file.records()]
+        if len(set(paths)) != len(paths):
+            return False
+
+        items = _block_items(self.top_block)
+        self._rebuild_item_lists(items)
+
+        for new_record in new_records:
+            for entry in new_record.selects + new_record.implies:
+                targets.add(entry[0])
+        self._rebuild_rev_deps(targets, items)
+
+        for sym in unreferenced + old_syms:
+            if not sym.is_defined_ and not sym.ref_locations and \
+               self.syms.get(sym.name) is sym:
+                del self.syms[sym.name]
+
+        affected.update(targets)
+        affected.update(new_syms)
+
+        for sym in affected:
+            if sym.name in self.syms:
+                for s in _get_dep_syms(sym):
+                    if not s.dep:
+                        s.dep = set()
+                    s.dep.add(sym)
+
+        self._dep_graph = None
+        self._modules_dep = None
+        self._reset_menu_deps()
+        self._state_syms = None
+        self._reset_term_counters()
+
+        # Compiled expressions depend on the types of the symbols they
+        # reference, which might have changed
+        for item in items:
+            item.compiled = False
         for sym in self.syms_iter():
+            sym.compiled = False
+        self._expr_fns = {}
+        self._shared_exprs = None
+
+        # Reassign user values to check them against the new definitions. Do
+        # it in definition order, so that the user selections of choices are
+        # restored as expected.
+        for sym in old_syms + new_syms:
+            if sym.user_val is not None:
+                val = sym.user_val
+                sym.user_val = None
+                if sym.is_defined_:
+                    sym._set_user_value_no_invalidate(val, True)
+
+        # Invalidate the affected symbols and all symbols that depend on them.
+        # A single traversal is much cheaper than invalidating the dependent
+        # symbols of each symbol separately when the dependent sets overlap.
+        modules_sym = self.syms.get("MODULES")
+        stack = list(affected)
+        while stack:
+            sym = stack.pop()
             sym._invalidate()
+            for s in sym.dep:
+                if s not in affected:
+                    affected.add(s)
+                    stack.append(s)
+            if sym is modules_sym:
+                # Symbols, menus, and comments whose "m" gets promoted to "y"
+                # when modules are disabled depend on MODULES without it
+                # being in its 'dep' set. _modules_dep was reset above, so
+                # this reflects the new definitions.
+                for s in self._get_modules_dep():
+                    if s not in affected:
+                        affected.add(s)
+                        stack.append(s)
+                for item in self._get_menu_deps().get(sym, ()):
+                    item._invalidate()
+            if sym.is_choice_sym:
+                for s in sym.parent.actual_symbols:
+                    if s not in affected:
+                        affected.add(s)
+                        stack.append(s)
+
+        return True
+
+    def _reparse_all(self, user_vals):
+        """reparse() helper. Reparses all Kconfig files from scratch and
+        reassigns the user values in 'user_vals', a list of (name, value)
+        tuples."""
+
+        # Keep the special symbols n, m, y, and UNAME_RELEASE, which are not
+        # defined in the Kconfig files
+        special_syms = [sym for sym in self.syms_iter()
+                        if sym.is_special_ and not sym.is_from_env]
+        self.syms.clear()
+        for sym in special_syms:
+            sym.ref_locations = _NO_ENTRIES
+            sym.dep = _NO_SYMS
+            self.syms[sym.name] = sym
+
+        self.kconfig_syms[:] = []
+        self.named_choices = {}
+        self.choices[:] = []
+        self.menus[:] = []
+        self.comments[:] = []
+        self.defconfig_sym = None
+        self.mainmenu_text = None
+        self._env_vars = {}
+
+        self.top_block = []
+        self._cur_file = None
+        self._exprs = {}
+        self._simplified = {}
+        self._prompt_conds = {}
+        self._parse_file(self.filename, None, None, None, self.top_block)
+        self._exprs = None
+        self._simplified = None
+        self._prompt_conds = None
+        self._add_rev_dep_terms()
+        self._build_dep()
+        self._expr_fns = {}
+        self._shared_exprs = None
+
+        for name, val in user_vals:
+            sym = self.syms.get(name)
+            if sym is not None and sym.is_defined_:
+                sym._set_user_value_no_invalidate(val, True)
+
+    def _rebuild_item_lists(self, items):
+        """_reparse_file() helper. Rebuilds kconfig_syms, choices, menus, and
+        comments from 'items', which holds all items in parse order. Assumes
+        there are no named choices, which can appear in multiple places."""
+        self.kconfig_syms[:] = [item for item in items
+                                if isinstance(item, Symbol)]
+        self.choices[:] = [item for item in items if isinstance(item, Choice)]
+        self.menus[:] = [item for item in items if isinstance(item, Menu)]
+        self.comments[:] = [item for item in items
+                            if isinstance(item, Comment)]
+
+    def _rebuild_rev_deps(self, targets, items):
+        """_reparse_file() helper. Rebuilds the rev_dep and weak_rev_dep
+        expressions of the symbols in 'targets' from the terms recorded in the
+        _FileRecords, adding the terms in parse order, like during parsing.
+        'items' holds all items in parse order."""
+        selects = []
+        implies = []
+        for record in self._top_file.records():
+            for entry in record.selects:
+                if entry[0] in targets:
+                    selects.append(entry)
+            for entry in record.implies:
+                if entry[0] in targets:
+                    implies.append(entry)
+
+        # The parse order of the terms is the order of the definitions they
+        # come from
+        selectors = set([entry[2] for entry in selects + implies])
+        def_positions = {}
+        for i, item in enumerate(items):
+            if item in selectors:
+                def_positions.setdefault(item, []).append(i)
+
+        def parse_order(entry):
+            _, _, selector, def_nr = entry
+            return def_positions[selector][def_nr]
+
+        selects.sort(key=parse_order)
+        implies.sort(key=parse_order)
+
+        for target in targets:
+            target.rev_dep = "n"
+            target.weak_rev_dep = "n"
+        for target, term, _, _ in selects:
+            self._rev_dep_terms.setdefault(target, []).append(term)
+        for target, term, _, _ in implies:
+            self._weak_rev_dep_terms.setdefault(target, []).append(term)
+        self._add_rev_dep_terms()
+
+    def _add_rev_dep_terms(self):
+        """Adds the select and imply terms collected in _rev_dep_terms and
+        _weak_rev_dep_terms during parsing to the rev_dep and weak_rev_dep
+        expressions of the symbols, and clears the collected terms. Gives the
+        same expressions as adding the terms one by one with _make_or()."""
+        for target, terms in self._rev_dep_terms.items():
+            target.rev_dep = _make_or_terms(target.rev_dep, terms)
+        for target, terms in self._weak_rev_dep_terms.items():
+            target.weak_rev_dep = _make_or_terms(target.weak_rev_dep, terms)
+        self._rev_dep_terms = {}
+        self._weak_rev_dep_terms = {}
+
+    #
+    # Parse cache
+    #
+
+    def _cache_key(self):
+        """Returns the part of the parse cache key that is known before
+        parsing. The parsed files and the 'option env' variables are checked
+        separately."""
+        return (_CACHE_VERSION, self.filename, self.base_dir, self.srctree,
+                self.arch, self.srcarch, platform.uname()[2],
+                self._record_ref_locations)
+
+    def _cache_items(self):
+        """Returns a list of all items in the configuration. The index of an
+        item in the list is its ID in the parse cache."""
+        return list(self.syms_iter()) + self.choices + self.menus + \
+               self.comments
+
+    def _save_cache(self, cache_file):
+        """Writes the parsed configuration to 'cache_file'.
+
+        The cache holds three pickles: the cache key (which can be checked
+        without loading the rest), the number of items of each kind, and the
+        states of the items and the Config. References to items and to the
+        Config are pickled as IDs (see _CachePickler), which keeps the pickles
+        flat no matter how the items link to each other.
+
+        Failing to write the cache only generates a warning, as the parsed
+        configuration is still usable. Expressions nested too deeply for
+        the pickle module to handle (RuntimeError, or its subclass
+        RecursionError on Python 3) aren't cached either."""
+        tmp_filename = "{}.{}.tmp".format(cache_file, os.getpid())
+        try:
+            self._save_cache_file(cache_file, tmp_filename)
+        except (IOError, OSError, RuntimeError, pickle.PicklingError) as e:
+            self._warn("failed to write parse cache {}: {}"
+                       .format(cache_file, e))
+            try:
+                os.remove(tmp_filename)
+            except OSError:
+                pass
+
+    def _save_cache_file(self, cache_file, tmp_filename):
+        """_save_cache() helper. Does the actual writing."""
+
+        # Hashing is only needed for files whose modification time or size
+        # changed since the previous cache was written. For the others, the
+        # old digests are reused.
+        old_files = self._cached_files(cache_file)
+        files = []
+        for record in self._top_file.records():
+            st = os.stat(record.filename)
+            old = old_files.get(record.filename)
+            if old is not None and old[:2] == (st.st_mtime, st.st_size):
+                digest = old[2]
+            else:
+                digest = _file_digest(record.filename)
+            files.append((record.filename, st.st_mtime, st.st_size, digest))
+
+        items = self._cache_items()
+        # Item states are pickled as tuples of attribute values, in the order
+        # given by _cache_attrs(). That's quite a bit faster to load than
+        # pickled objects.
+        item_states = [tuple([getattr(item, attr)
+                              if attr not in _UNCACHED_ITEM_ATTRS else None
+                              for attr in _cache_attrs(item.__class__)])
+                       for item in items]
+        config_state = dict([(attr, getattr(self, attr))
+                             for attr in _CACHED_CONFIG_ATTRS])
+
+        # Write to a temporary file first so that concurrent Config instances
+        # never see a partially written cache
+        with open(tmp_filename, "wb") as f:
+            pickle.dump((self._cache_key(), files, self._env_vars), f, 2)
+            pickle.dump(([sym.name for sym in self.syms_iter()],
+                         len(self.choices), len(self.menus),
+                         len(self.comments)),
+                        f, 2)
+            _CachePickler(f, items, self).dump((item_states, config_state))
+
+        try:
+            os.rename(tmp_filename, cache_file)
+        except OSError:
+            # Windows does not allow renaming to an existing file
+            os.remove(cache_file)
+            os.rename(tmp_filename, cache_file)
+
+    def _cached_files(self, cache_file):
+        """_save_cache() helper. Returns a dictionary that maps the names of
+        the files recorded in the existing cache 'cache_file' to
+        (mtime, size, digest) tuples. The dictionary is empty if there is no
+        readable cache."""
+        try:
+            with open(cache_file, "rb") as f:
+                files = pickle.load(f)[1]
+            return dict([(filename, (mtime, size, digest))
+                         for filename, mtime, size, digest in files])
+        except Exception:
+            # Anything goes for corrupt caches, as in _load_cache_no_gc()
+            return {}
+
+    def _load_cache(self, cache_file):
+        """Loads the parsed configuration from 'cache_file'. Returns True on
+        success. Returns False if the cache is missing, stale, or unreadable,
+        in which case the Config is left untouched."""
+
+        # Loading creates lots of objects, none of which are garbage.
+        # Collection passes triggered by the allocations would be wasted work,
+        # and disabling them more than halves the loading time.
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._load_cache_no_gc(cache_file)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def _load_cache_no_gc(self, cache_file):
+        """_load_cache() helper. Does the actual loading."""
+        try:
+            with open(cache_file, "rb") as f:
+                key, files, env_vars = pickle.load(f)
+
+                if key != self._cache_key():
+                    return False
+                for var, val in env_vars.items():
+                    if os.environ.get(var) != val:
+                        return False
+                for filename, mtime, size, digest in files:
+                    st = os.stat(filename)
+                    if (st.st_mtime != mtime or st.st_size != size) and \
+                       _file_digest(filename) != digest:
+                        return False
+
+                sym_names, n_choices, n_menus, n_comments = pickle.load(f)
+                # Create blank items for the IDs in the pickle to refer to.
+                # Their states are filled in below.
+                items = [Symbol.__new__(Symbol) for _ in sym_names] + \
+                        [Choice.__new__(Choice) for _ in range(n_choices)] + \
+                        [Menu.__new__(Menu) for _ in range(n_menus)] + \
+                        [Comment.__new__(Comment) for _ in range(n_comments)]
+                item_states, config_state = \
+                  _CacheUnpickler(f, items, self).load()
+        except Exception:
+            # A corrupt cache or one written by an incompatible version of
+            # Kconfiglib could raise pretty much anything. Fall back on
+            # parsing.
+            return False
+
+        # States written with a different attribute layout would assign
+        # values to the wrong attributes. Reject the cache instead, in case
+        # _CACHE_VERSION wasn't bumped.
+        n_attrs = dict([(cls, len(_cache_attrs(cls)))
+                        for cls in (Symbol, Choice, Menu, Comment)])
+        if len(item_states) != len(items):
+            return False
+        for item, state in zip(items, item_states):
+            if len(state) != n_attrs[item.__class__]:
+                return False
+
+        for item, state in zip(items, item_states):
+            for setter, val in zip(_cache_setters(item.__class__), state):
+                setter(item, val)
+
+        # Keep the original 'syms' dictionary, as 'syms_iter' is bound to it
+        self.syms.clear()
+        self.syms.update(config_state.pop("syms"))
+        for attr, val in config_state.items():
+            setattr(self, attr, val)
+
+        self._env_vars = env_vars
+
+        return True
 
     #
     # Printing and misc.
@@ -1697,7 +3667,8 @@ class Config(object):
         locations_str = "(no locations)" \
                         if not sc.def_locations else \
                         " ".join(["{}:{}".format(filename, linenr)
-                                  for filename, linenr in sc.def_locations])
+                                  for filename, linenr in
+                                  sc.get_def_locations()])
 
         # Build additional-dependencies-from-menus-and-ifs string
         additional_deps_str = " " + \
@@ -1767,7 +3738,7 @@ class Config(object):
                          "Type           : " + TYPENAME[sc.type],
                          "Value          : " + s(sc.get_value()),
                          "User value     : " + user_val_str,
-                         "Visibility     : " + s(_get_visibility(sc)),
+                         "Visibility     : " + s(sc.get_visibility()),
                          "Is choice item : " + BOOL_STR[sc.is_choice_sym],
                          "Is defined     : " + BOOL_STR[sc.is_defined_],
                          "Is from env.   : " + BOOL_STR[sc.is_from_env],
@@ -1829,7 +3800,7 @@ class Config(object):
                       "Selected symbol : " + sel_str,
                       "User value      : " + user_val_str,
                       "Mode            : " + s(sc.get_mode()),
-                      "Visibility      : " + s(_get_visibility(sc)),
+                      "Visibility      : " + s(sc.get_visibility()),
                       "Optional        : " + BOOL_STR[sc.optional],
                       "Prompts:",
                       prompts_str,
@@ -1852,6 +3823,8 @@ class Item(object):
     """Base class for symbols and other Kconfig constructs. Subclasses are
     Symbol, Choice, Menu, and Comment."""
 
+    __slots__ = []
+
     def is_symbol(self):
         """Returns True if the item is a symbol. Short for
         isinstance(item, kconfiglib.Symbol)."""
@@ -1879,6 +3852,18 @@ class Symbol(Item):
     config FOO
         ..."""
 
+    __slots__ = ['name', 'type', 'prompts', 'def_exprs', 'ranges', 'help',
+                 'rev_dep', 'weak_rev_dep', 'config', 'parent', 'user_val',
+                 'orig_prompts', 'orig_def_exprs', 'orig_selects',
+                 'orig_implies', 'deps_from_containing', 'referenced_syms',
+                 'selected_syms', 'implied_syms', 'all_referenced_syms',
+                 'menu_dep', 'def_locations', 'ref_locations', 'dep',
+                 'cached_val', 'cached_tri', 'cached_visibility',
+                 'cached_bounds', 'compiled', 'prompt_fns', 'def_fns',
+                 'range_fns', 'rev_dep_fn', 'weak_rev_dep_fn', 'is_defined_',
+                 'write_to_conf', 'already_written', 'is_choice_sym',
+                 'is_special_', 'is_from_env', 'allnoconfig_y']
+
     #
     # Public interface
     #
@@ -1935,7 +3920,7 @@ class Symbol(Item):
         config FOO *
             bool "foo prompt 2"
         """
-        return self.def_locations
+        return self.config._unpack_locations(self.def_locations)
 
     def get_ref_locations(self):
         """Returns a list of (filename, linenr) tuples, where filename (string)
@@ -1960,7 +3945,7 @@ class Symbol(Item):
         config FOO (definition not included)
             bool
         """
-        return self.ref_locations
+        return self.config._unpack_locations(self.ref_locations)
 
     def get_value(self):
         """Calculate and return the value of the symbol. See also
@@ -1969,6 +3954,9 @@ class Symbol(Item):
         if self.cached_val is not None:
             return self.cached_val
 
+        if self.config._journal is not None:
+            self.config._record(self)
+
         # As a quirk of Kconfig, undefined symbols get their name as their
         # value. This is why things like "FOO = bar" work for seeing if FOO has
         # the value "bar".
@@ -1976,72 +3964,20 @@ class Symbol(Item):
             self.cached_val = self.name
             return self.name
 
+        if self.type == BOOL or self.type == TRISTATE:
+            self._get_tri_value()
+            return self.cached_val
+
+        if not self.compiled:
+            self._compile()
+
         new_val = DEFAULT_VALUE[self.type]
         vis = _get_visibility(self)
 
         # This is easiest to calculate together with the value
         self.write_to_conf = False
 
-        if self.type == BOOL or self.type == TRISTATE:
-            # The visibility and mode (modules-only or single-selection) of
-            # choice items will be taken into account in _get_visibility()
-            if self.is_choice_sym:
-                if vis != "n":
-                    choice = self.parent
-                    mode = choice.get_mode()
-
-                    self.write_to_conf = (mode != "n")
-
-                    if mode == "y":
-                        new_val = "y" if choice.get_selection() is self \
-                                  else "n"
-                    elif mode == "m":
-                        if self.user_val == "m" or self.user_val == "y":
-                            new_val = "m"
-
-            else:
-                # If the symbol is visible and has a user value, use that.
-                # Otherwise, look at defaults and weak reverse dependencies
-                # (implies).
-                use_defaults_and_weak_rev_deps = True
-
-                if vis != "n":
-                    self.write_to_conf = True
-                    if self.user_val is not None:
-                        new_val = self.config._eval_min(self.user_val, vis)
-                        use_defaults_and_weak_rev_deps = False
-
-                if use_defaults_and_weak_rev_deps:
-                    for val_expr, cond_expr in self.def_exprs:
-                        cond_eval = self.config._eval_expr(cond_expr)
-                        if cond_eval != "n":
-                            self.write_to_conf = True
-                            new_val = self.config._eval_min(val_expr,
-                                                            cond_eval)
-                            break
-
-                    weak_rev_dep_val = \
-                        self.config._eval_expr(self.weak_rev_dep)
-                    if weak_rev_dep_val != "n":
-                        self.write_to_conf = True
-                        new_val = self.config._eval_max(new_val,
-                                                        weak_rev_dep_val)
-
-                # Reverse (select-related) dependencies take precedence
-                rev_dep_val = self.config._eval_expr(self.rev_dep)
-                if rev_dep_val != "n":
-                    self.write_to_conf = True
-                    new_val = self.config._eval_max(new_val, rev_dep_val)
-
-            # We need to promote "m" to "y" in two circumstances:
-            #  1) If our type is boolean
-            #  2) If our weak_rev_dep (from IMPLY) is "y"
-            if new_val == "m" and \
-               (self.type == BOOL or
-                self.config._eval_expr(self.weak_rev_dep) == "y"):
-                new_val = "y"
-
-        elif self.type == INT or self.type == HEX:
+        if self.type == INT or self.type == HEX:
             has_active_range = False
             low = None
             high = None
@@ -2049,8 +3985,8 @@ class Symbol(Item):
 
             base = 16 if self.type == HEX else 10
 
-            for l, h, cond_expr in self.ranges:
-                if self.config._eval_expr(cond_expr) != "n":
+            for l, h, cond_fn in self.range_fns:
+                if cond_fn():
                     has_active_range = True
 
                     low_str = _str_val(l)
@@ -2062,7 +3998,7 @@ class Symbol(Item):
 
                     break
 
-            if vis != "n":
+            if vis:
                 self.write_to_conf = True
 
                 if self.user_val is not None and \
@@ -2078,8 +4014,8 @@ class Symbol(Item):
                     new_val = self.user_val
 
             if use_defaults:
-                for val_expr, cond_expr in self.def_exprs:
-                    if self.config._eval_expr(cond_expr) != "n":
+                for val_expr, _, cond_fn in self.def_fns:
+                    if cond_fn():
                         self.write_to_conf = True
 
                         # If the default value is OK, it is stored in exactly
@@ -2114,15 +4050,15 @@ class Symbol(Item):
         elif self.type == STRING:
             use_defaults = True
 
-            if vis != "n":
+            if vis:
                 self.write_to_conf = True
                 if self.user_val is not None:
                     new_val = self.user_val
                     use_defaults = False
 
             if use_defaults:
-                for val_expr, cond_expr in self.def_exprs:
-                    if self.config._eval_expr(cond_expr) != "n":
+                for val_expr, _, cond_fn in self.def_fns:
+                    if cond_fn():
                         self.write_to_conf = True
                         new_val = _str_val(val_expr)
                         break
@@ -2150,12 +4086,11 @@ class Symbol(Item):
         in handy."""
         if self.type != BOOL and self.type != TRISTATE:
             return None
-        rev_dep = self.config._eval_expr(self.rev_dep)
+        rev_dep, vis = self._get_bounds()
         # A bool selected to "m" gets promoted to "y", pinning it
-        if rev_dep == "m" and self.type == BOOL:
+        if rev_dep == 1 and self.type == BOOL:
             return None
-        vis = _get_visibility(self)
-        return vis if tri_greater(vis, rev_dep) else None
+        return TRI_TO_STR[vis] if vis > rev_dep else None
 
     def get_lower_bound(self):
         """For string/hex/int symbols and for bool and tristate symbols that
@@ -2171,11 +4106,11 @@ class Symbol(Item):
         in handy."""
         if self.type != BOOL and self.type != TRISTATE:
             return None
-        rev_dep = self.config._eval_expr(self.rev_dep)
+        rev_dep, vis = self._get_bounds()
         # A bool selected to "m" gets promoted to "y", pinning it
-        if rev_dep == "m" and self.type == BOOL:
+        if rev_dep == 1 and self.type == BOOL:
             return None
-        return rev_dep if tri_greater(_get_visibility(self), rev_dep) else None
+        return TRI_TO_STR[rev_dep] if vis > rev_dep else None
 
     def get_assignable_values(self):
         """For string/hex/int symbols and for bool and tristate symbols that
@@ -2192,12 +4127,11 @@ class Symbol(Item):
         value can be assigned."""
         if self.type != BOOL and self.type != TRISTATE:
             return []
-        rev_dep = self.config._eval_expr(self.rev_dep)
+        rev_dep, vis = self._get_bounds()
         # A bool selected to "m" gets promoted to "y", pinning it
-        if rev_dep == "m" and self.type == BOOL:
+        if rev_dep == 1 and self.type == BOOL:
             return []
-        res = ["n", "m", "y"][TRI_TO_INT[rev_dep] :
-                              TRI_TO_INT[_get_visibility(self)] + 1]
+        res = list(TRI_TO_STR[rev_dep : vis + 1])
         return res if len(res) > 1 else []
 
     def get_visibility(self):
@@ -2242,7 +4176,7 @@ class Symbol(Item):
 
         You should probably look at get_lower/upper_bound(),
         get_assignable_values() and is_modifiable() before using this."""
-        return _get_visibility(self)
+        return TRI_TO_STR[_get_visibility(self)]
 
     def get_referenced_symbols(self, refs_from_enclosing=False):
         """Returns the set() of all symbols referenced by this symbol. For
@@ -2295,27 +4229,28 @@ class Symbol(Item):
         get_user_value() though, and might have an effect later if conditions
         change. To get rid of the user value, use unset_user_value().
 
-        Any symbols dependent on the symbol are (recursively) invalidated, so
-        things will just work with regards to dependencies.
+        The cached values of any symbols dependent on the symbol are
+        (recursively) updated, so things will just work with regards to
+        dependencies.
 
         v: The user value to give to the symbol."""
+        if self.config._change_callback is not None:
+            self.config._note_old_states((self,))
         self._set_user_value_no_invalidate(v, False)
-
-        # There might be something more efficient you could do here, but play
-        # it safe.
-        if self.name == "MODULES":
-            self.config._invalidate_all()
-            return
-
-        self._invalidate()
-        self._invalidate_dependent()
+        self.config._user_value_changed(self)
 
     def unset_user_value(self):
         """Resets the user value of the symbol, as if the symbol had never
         gotten a user value via Config.load_config() or
         Symbol.set_user_value()."""
-        self._unset_user_value_no_recursive_invalidate()
-        self._invalidate_dependent()
+        if self.config._change_callback is not None:
+            self.config._note_old_states((self,))
+        if self.config._journal is not None:
+            self.config._record(self)
+        self.user_val = None
+        if self.is_choice_sym:
+            self.parent._unset_user_value()
+        self.config._user_value_changed(self)
 
     def is_modifiable(self):
         """Returns True if the value of the symbol could be modified by calling
@@ -2330,12 +4265,12 @@ class Symbol(Item):
         if self.is_special_:
             return False
         if self.type == BOOL or self.type == TRISTATE:
-            rev_dep = self.config._eval_expr(self.rev_dep)
+            rev_dep, vis = self._get_bounds()
             # A bool selected to "m" gets promoted to "y", pinning it
-            if rev_dep == "m" and self.type == BOOL:
+            if rev_dep == 1 and self.type == BOOL:
                 return False
-            return tri_greater(_get_visibility(self), rev_dep)
-        return _get_visibility(self) != "n"
+            return vis > rev_dep
+        return _get_visibility(self) != 0
 
     def is_defined(self):
         """Returns False if the symbol is referred to in the Kconfig but never
@@ -2384,11 +4319,16 @@ class Symbol(Item):
         """Symbol constructor -- not intended to be called directly by
         Kconfiglib clients."""
 
+        # Most symbols leave most of the lists and sets below empty (symbols
+        # that are only referenced leave all of them empty), so they all
+        # start out as the shared, immutable _NO_ENTRIES and _NO_SYMS. A new
+        # list or set is created when something is added.
+
         self.name = None
         self.type = UNKNOWN
-        self.prompts = []
-        self.def_exprs = [] # 'default' properties
-        self.ranges = [] # 'range' properties (for int and hex)
+        self.prompts = _NO_ENTRIES
+        self.def_exprs = _NO_ENTRIES # 'default' properties
+        self.ranges = _NO_ENTRIES # 'range' properties (for int and hex)
         self.help = None # Help text
         self.rev_dep = "n" # Reverse (select-related) dependencies
         self.weak_rev_dep = "n" # Weak reverse (imply-related) dependencies
@@ -2399,24 +4339,24 @@ class Symbol(Item):
 
         # The prompt, default value, select, and imply conditions without any
         # dependencies from menus and ifs propagated to them
-        self.orig_prompts = []
-        self.orig_def_exprs = []
-        self.orig_selects = []
-        self.orig_implies = []
+        self.orig_prompts = _NO_ENTRIES
+        self.orig_def_exprs = _NO_ENTRIES
+        self.orig_selects = _NO_ENTRIES
+        self.orig_implies = _NO_ENTRIES
 
         # Dependencies inherited from containing menus and ifs
         self.deps_from_containing = None
         # The set of symbols referenced by this symbol (see
         # get_referenced_symbols())
-        self.referenced_syms = set()
+        self.referenced_syms = _NO_SYMS
         # The set of symbols selected by this symbol (see
         # get_selected_symbols())
-        self.selected_syms = set()
+        self.selected_syms = _NO_SYMS
         # The set of symbols implied by this symbol (see get_implied_symbols())
-        self.implied_syms = set()
+        self.implied_syms = _NO_SYMS
         # Like 'referenced_syms', but includes symbols from
         # dependencies inherited from enclosing menus and ifs
-        self.all_referenced_syms = set()
+        self.all_referenced_syms = _NO_SYMS
 
         # This records only dependencies from enclosing ifs and menus together
         # with local 'depends on' dependencies. Needed when determining actual
@@ -2424,25 +4364,42 @@ class Symbol(Item):
         self.menu_dep = None
 
         # See Symbol.get_ref/def_locations().
-        self.def_locations = []
-        self.ref_locations = []
+        self.def_locations = _NO_ENTRIES
+        self.ref_locations = _NO_ENTRIES
 
         # Populated in Config._build_dep() after parsing. Links the symbol to
         # the symbols that immediately depend on it (in a caching/invalidation
         # sense). The total set of dependent symbols for the symbol (the
         # transitive closure) is calculated on an as-needed basis in
-        # _get_dependent().
-        self.dep = set()
+        # _get_dependent(), from a compact version of the graph (see
+        # _DepGraph).
+        self.dep = _NO_SYMS
 
         # Cached values
 
         # Caches the calculated value
         self.cached_val = None
+        # Caches the calculated value as an integer, for bool and tristate
+        # symbols. See Config._eval_tri().
+        self.cached_tri = None
         # Caches the visibility, which acts as an upper bound on the value
         self.cached_visibility = None
-        # Caches the total list of dependent symbols. Calculated in
-        # _get_dependent().
-        self.cached_deps = None
+        # Caches the (rev_dep value, visibility) tuple that the bounds of bool
+        # and tristate symbols are calculated from. See _get_bounds().
+        self.cached_bounds = None
+
+        # Compiled versions of the expressions, built by _compile() the first
+        # time they're needed. See _compile_expr().
+        self.compiled = False
+        # Functions for the conditions in 'prompts'
+        self.prompt_fns = None
+        # (value expression, value function, condition function) tuples for
+        # 'def_exprs'
+        self.def_fns = None
+        # (low, high, condition function) tuples for 'ranges'
+        self.range_fns = None
+        self.rev_dep_fn = None
+        self.weak_rev_dep_fn = None
 
         # Flags
 
@@ -2473,15 +4430,171 @@ class Symbol(Item):
         if self.is_special_:
             return
 
+        if self.config._journal is not None:
+            self.config._record(self)
+
+        self.config._eval_epoch += 1
+
+        counted = self.config._counter_index.get(self)
+        if counted is not None:
+            for counter, i in counted:
+                counter.dirty.add(i)
+
         if self.is_choice_sym:
             self.parent._invalidate()
 
+        # If the map hasn't been built, no menu or comment visibilities have
+        # been cached
+        menu_deps = self.config._menu_deps
+        if menu_deps is not None:
+            for item in menu_deps.get(self, ()):
+                item._invalidate()
+
         self.cached_val = None
+        self.cached_tri = None
         self.cached_visibility = None
+        self.cached_bounds = None
+
+    def _get_bounds(self):
+        """Returns a (rev_dep value, visibility) tuple for the symbol, with
+        the values as integers. The bounds of bool and tristate symbols
+        (get_lower_bound(), get_upper_bound(), get_assignable_values(), and
+        is_modifiable()) are calculated from it. Cached in cached_bounds, as
+        front-ends call these methods for each displayed symbol whenever they
+        redraw. See Config.get_bounds_cache_stats()."""
+        config = self.config
+        if self.cached_bounds is not None:
+            config._bounds_cache_hits += 1
+            return self.cached_bounds
+        config._bounds_cache_misses += 1
+
+        if config._journal is not None:
+            config._record(self)
+
+        if not self.compiled:
+            self._compile()
+        self.cached_bounds = (self.rev_dep_fn(), _get_visibility(self))
+        return self.cached_bounds
+
+    def _compile(self):
+        """Compiles the expressions of the symbol. See _compile_expr()."""
+        config = self.config
+        self.prompt_fns = [_compile_expr(cond_expr, config)
+                           for _, cond_expr in self.prompts]
+        self.def_fns = [(val_expr, _compile_expr(val_expr, config),
+                         _compile_expr(cond_expr, config))
+                        for val_expr, cond_expr in self.def_exprs]
+        self.range_fns = [(low, high, _compile_expr(cond_expr, config))
+                          for low, high, cond_expr in self.ranges]
+        self.rev_dep_fn = _compile_rev_dep(self.rev_dep, config)
+        self.weak_rev_dep_fn = _compile_rev_dep(self.weak_rev_dep, config)
+        self.compiled = True
+
+    def _get_tri_value(self):
+        """Like get_value(), but returns the value as an integer (see
+        Config._eval_tri()). This is what expression evaluation uses.
+
+        For bool and tristate symbols, the value is calculated here, and
+        get_value() converts it to a string."""
+
+        if self.cached_tri is not None:
+            return self.cached_tri
+
+        if self.config._journal is not None:
+            self.config._record(self)
+
+        if self.type != BOOL and self.type != TRISTATE or self.is_special_:
+            # Symbols of other types (e.g. MODULES in weird configurations)
+            # and symbols that get their value from the environment can have
+            # any value. Anything but "m" and "y" counts as "n".
+            self.cached_tri = TRI_TO_INT.get(self.get_value(), 0)
+            return self.cached_tri
+
+        if not self.compiled:
+            self._compile()
+
+        new_val = 0
+        vis = _get_visibility(self)
 
-    def _invalidate_dependent(self):
-        for sym in self._get_dependent():
-            sym._invalidate()
+        # This is easiest to calculate together with the value
+        self.write_to_conf = False
+
+        # The visibility and mode (modules-only or single-selection) of choice
+        # items will be taken into account in _get_visibility()
+        if self.is_choice_sym:
+            if vis:
+                choice = self.parent
+                mode = choice._get_tri_mode()
+
+                self.write_to_conf = (mode != 0)
+
+                if mode == 2:
+                    new_val = 2 if choice.get_selection() is self else 0
+                elif mode == 1:
+                    if self.user_val == "m" or self.user_val == "y":
+                        new_val = 1
+
+        else:
+            # If the symbol is visible and has a user value, use that.
+            # Otherwise, look at defaults and weak reverse dependencies
+            # (implies).
+            use_defaults_and_weak_rev_deps = True
+
+            if vis:
+                self.write_to_conf = True
+                if self.user_val is not None:
+                    new_val = self.config._eval_tri(self.user_val)
+                    if vis < new_val:
+                        new_val = vis
+                    use_defaults_and_weak_rev_deps = False
+
+            if use_defaults_and_weak_rev_deps:
+                for _, val_fn, cond_fn in self.def_fns:
+                    cond_eval = cond_fn()
+                    if cond_eval:
+                        self.write_to_conf = True
+                        val = val_fn()
+                        new_val = val if val < cond_eval else cond_eval
+                        break
+
+                weak_rev_dep_val = self.weak_rev_dep_fn()
+                if weak_rev_dep_val:
+                    self.write_to_conf = True
+                    if weak_rev_dep_val > new_val:
+                        new_val = weak_rev_dep_val
+
+            # Reverse (select-related) dependencies take precedence
+            rev_dep_val = self.rev_dep_fn()
+            if rev_dep_val:
+                self.write_to_conf = True
+                if rev_dep_val > new_val:
+                    new_val = rev_dep_val
+
+        # We need to promote "m" to "y" in two circumstances:
+        #  1) If our type is boolean
+        #  2) If our weak_rev_dep (from IMPLY) is "y"
+        if new_val == 1 and \
+           (self.type == BOOL or self.weak_rev_dep_fn() == 2):
+            new_val = 2
+
+        self.cached_tri = new_val
+        self.cached_val = TRI_TO_STR[new_val]
+        return new_val
+
+    def _reset(self):
+        """Returns the symbol to its state before being defined, for
+        Config.reparse(). Keeps the name, the user value, and the things that
+        come from other symbols: the rev_dep and weak_rev_dep expressions,
+        references, and dependent symbols."""
+        name, config, user_val = self.name, self.config, self.user_val
+        rev_dep, weak_rev_dep = self.rev_dep, self.weak_rev_dep
+        ref_locations, dep = self.ref_locations, self.dep
+
+        self.__init__()
+
+        self.name, self.config, self.user_val = name, config, user_val
+        self.rev_dep, self.weak_rev_dep = rev_dep, weak_rev_dep
+        self.ref_locations, self.dep = ref_locations, dep
 
     def _set_user_value_no_invalidate(self, v, suppress_load_warnings):
         """Like set_user_value(), but does not invalidate any symbols.
@@ -2505,12 +4618,17 @@ class Symbol(Item):
             return
 
         if not self.is_defined_:
-            filename, linenr = self.ref_locations[0]
             if self.config.print_undef_assign:
-                _stderr_msg('note: attempt to assign the value "{}" to {}, '
-                            "which is referenced at {}:{} but never defined. "
-                            "Assignment ignored."
-                            .format(v, self.name, filename, linenr))
+                ref_locations = self.get_ref_locations()
+                if ref_locations:
+                    _stderr_msg('note: attempt to assign the value "{}" to '
+                                "{}, which is referenced at {}:{} but never "
+                                "defined. Assignment ignored."
+                                .format(v, self.name, *ref_locations[0]))
+                else:
+                    _stderr_msg('note: attempt to assign the value "{}" to '
+                                "{}, which is never defined. Assignment "
+                                "ignored.".format(v, self.name))
             return
 
         # Check if the value is valid for our type
@@ -2531,10 +4649,15 @@ class Symbol(Item):
                               'assignment will have no effect.'
                               .format(v, self.name))
 
+        if self.config._journal is not None:
+            self.config._record(self)
+
         self.user_val = v
 
         if self.is_choice_sym and (self.type == BOOL or self.type == TRISTATE):
             choice = self.parent
+            if self.config._journal is not None:
+                self.config._record(choice)
             if v == "y":
                 choice.user_val = self
                 choice.user_mode = "y"
@@ -2542,6 +4665,32 @@ class Symbol(Item):
                 choice.user_val = None
                 choice.user_mode = "m"
 
+    def _get_change_state(self):
+        """Returns the parts of the state of the symbol that are reported to
+        the change callback when they change. See
+        Config.set_change_callback()."""
+        return (self.get_value(), self.get_visibility())
+
+    def _save_values(self):
+        """Returns the value state of the symbol, for snapshots. See
+        Config.snapshot()."""
+        return (self.user_val, self.cached_val, self.cached_tri,
+                self.cached_visibility, self.cached_bounds,
+                self.write_to_conf)
+
+    def _restore_values(self, saved):
+        """Restores a value state returned by _save_values()."""
+        self.user_val, self.cached_val, self.cached_tri, \
+            self.cached_visibility, self.cached_bounds, \
+            self.write_to_conf = saved
+
+        # Counted terms that reference the symbol might have seen a different
+        # value
+        counted = self.config._counter_index.get(self)
+        if counted is not None:
+            for counter, i in counted:
+                counter.dirty.add(i)
+
     def _unset_user_value_no_recursive_invalidate(self):
         self._invalidate()
         self.user_val = None
@@ -2583,24 +4732,8 @@ class Symbol(Item):
         of the symbol changes, because they might be affected by the change.
         Note that this is an internal API -- it's probably of limited
         usefulness to clients."""
-        if self.cached_deps is not None:
-            return self.cached_deps
-
-        res = set(self.dep)
-        for s in self.dep:
-            res |= s._get_dependent()
-
-        if self.is_choice_sym:
-            # Choice symbols also depend (recursively) on their siblings. The
-            # siblings are not included in 'dep' to avoid dependency loops.
-            for sibling in self.parent.actual_symbols:
-                if sibling is not self:
-                    res.add(sibling)
-                    res |= sibling.dep
-                    for s in sibling.dep:
-                        res |= s._get_dependent()
-
-        self.cached_deps = res
+        res = set(self.config._get_dep_graph().reachable((self,)))
+        res.discard(self)
         return res
 
     def _has_auto_menu_dep_on(self, on):
@@ -2615,7 +4748,9 @@ class Symbol(Item):
             return self.menu_dep is not None and \
                    self.config._expr_depends_on(self.menu_dep, on)
 
-        for _, cond_expr in self.prompts:
+        # The prompt conditions before simplification, which can remove or
+        # add dependencies in the sense of _expr_depends_on()
+        for cond_expr in self.config._prompt_conds.get(self, ()):
             if self.config._expr_depends_on(cond_expr, on):
                 return True
 
@@ -2625,6 +4760,12 @@ class Menu(Item):
 
     """Represents a menu statement."""
 
+    __slots__ = ['title', 'dep_expr', 'visible_if_expr', 'block', 'config',
+                 'parent', 'orig_deps', 'deps_from_containing',
+                 'referenced_syms', 'all_referenced_syms', 'filename',
+                 'linenr', 'compiled', 'dep_fn', 'visible_if_fn',
+                 'cached_visibility', 'cached_visible_if_visibility']
+
     #
     # Public interface
     #
@@ -2682,12 +4823,16 @@ class Menu(Item):
     def get_visibility(self):
         """Returns the visibility of the menu. This also affects the visibility
         of subitems. See also Symbol.get_visibility()."""
-        return self.config._eval_expr(self.dep_expr)
+        if self.cached_visibility is None:
+            self._cache_visibilities()
+        return TRI_TO_STR[self.cached_visibility]
 
     def get_visible_if_visibility(self):
         """Returns the visibility the menu gets from its 'visible if'
         condition. "y" if the menu has no 'visible if' condition."""
-        return self.config._eval_expr(self.visible_if_expr)
+        if self.cached_visible_if_visibility is None:
+            self._cache_visibilities()
+        return TRI_TO_STR[self.cached_visible_if_visibility]
 
     def get_referenced_symbols(self, refs_from_enclosing=False):
         """See Symbol.get_referenced_symbols()."""
@@ -2745,9 +4890,58 @@ class Menu(Item):
         self.filename = None
         self.linenr = None
 
+        # Compiled versions of 'dep_expr' and 'visible_if_expr', built by
+        # _compile() the first time they're needed. See _compile_expr().
+        self.compiled = False
+        self.dep_fn = None
+        self.visible_if_fn = None
+
+        # Caches the calculated visibilities, as integers. Invalidated together
+        # with the symbols they depend on (see Config._get_menu_deps()).
+        self.cached_visibility = None
+        self.cached_visible_if_visibility = None
+
+    def _compile(self):
+        """Compiles the expressions of the menu. See _compile_expr()."""
+        self.dep_fn = _compile_expr(self.dep_expr, self.config)
+        self.visible_if_fn = _compile_expr(self.visible_if_expr, self.config)
+        self.compiled = True
+
+    def _cache_visibilities(self):
+        """Calculates and caches the visibility and the 'visible if'
+        visibility of the menu."""
+        config = self.config
+        # Symbols only invalidate the menus they affect if the map is there
+        config._get_menu_deps()
+        if config._journal is not None:
+            config._record(self)
+        if not self.compiled:
+            self._compile()
+        self.cached_visibility = self.dep_fn()
+        self.cached_visible_if_visibility = self.visible_if_fn()
+
+    def _invalidate(self):
+        if self.config._journal is not None:
+            self.config._record(self)
+        self.cached_visibility = None
+        self.cached_visible_if_visibility = None
+
+    def _get_change_state(self):
+        """See Symbol._get_change_state()."""
+        return (self.get_visibility(), self.get_visible_if_visibility())
+
+    def _save_values(self):
+        """Returns the value state of the menu, for snapshots. See
+        Config.snapshot()."""
+        return (self.cached_visibility, self.cached_visible_if_visibility)
+
+    def _restore_values(self, saved):
+        """Restores a value state returned by _save_values()."""
+        self.cached_visibility, self.cached_visible_if_visibility = saved
+
     def _make_conf(self, append_fn):
-        if self.config._eval_expr(self.dep_expr) != "n" and \
-           self.config._eval_expr(self.visible_if_expr) != "n":
+        if self.get_visibility() != "n" and \
+           self.get_visible_if_visibility() != "n":
             append_fn("\n#\n# {}\n#".format(self.title))
         _make_block_conf(self.block, append_fn)
 
@@ -2772,6 +4966,14 @@ class Choice(Item):
 
     See Symbol.get_visibility() too."""
 
+    __slots__ = ['name', 'type', 'prompts', 'def_exprs', 'help', 'block',
+                 'config', 'parent', 'user_val', 'user_mode', 'actual_symbols',
+                 'orig_prompts', 'orig_def_exprs', 'deps_from_containing',
+                 'referenced_syms', 'all_referenced_syms', 'def_locations',
+                 'menu_dep', 'cached_selection', 'cached_visibility',
+                 'cached_mode', 'compiled', 'prompt_fns', 'def_fns',
+                 'optional']
+
     #
     # Public interface
     #
@@ -2830,11 +5032,11 @@ class Choice(Item):
                 return None
             return self.cached_selection
 
-        if self.get_mode() != "y":
+        if self._get_tri_mode() != 2:
             return self._cache_ret(None)
 
         # User choice available?
-        if self.user_val is not None and _get_visibility(self.user_val) == "y":
+        if self.user_val is not None and _get_visibility(self.user_val) == 2:
             return self._cache_ret(self.user_val)
 
         if self.optional:
@@ -2849,19 +5051,22 @@ class Choice(Item):
         if not self.actual_symbols:
             return None
 
-        for symbol, cond_expr in self.def_exprs:
-            if self.config._eval_expr(cond_expr) != "n":
+        if not self.compiled:
+            self._compile()
+
+        for symbol, cond_fn in self.def_fns:
+            if cond_fn():
                 chosen_symbol = symbol
                 break
         else:
             chosen_symbol = self.actual_symbols[0]
 
         # Is the chosen symbol visible?
-        if _get_visibility(chosen_symbol) != "n":
+        if _get_visibility(chosen_symbol):
             return chosen_symbol
         # Otherwise, pick the first visible symbol
         for sym in self.actual_symbols:
-            if _get_visibility(sym) != "n":
+            if _get_visibility(sym):
                 return sym
         return None
 
@@ -2904,20 +5109,12 @@ class Choice(Item):
         "y". This acts as an upper limit on the mode of the choice (though bool
         choices can only have the mode "y"). See the class documentation for an
         explanation of modes."""
-        return _get_visibility(self)
+        return TRI_TO_STR[_get_visibility(self)]
 
     def get_mode(self):
         """Returns the mode of the choice. See the class documentation for
         an explanation of modes."""
-        minimum_mode = "n" if self.optional else "m"
-        mode = self.user_mode if self.user_mode is not None else minimum_mode
-        mode = self.config._eval_min(mode, _get_visibility(self))
-
-        # Promote "m" to "y" for boolean choices
-        if mode == "m" and self.type == BOOL:
-            return "y"
-
-        return mode
+        return TRI_TO_STR[self._get_tri_mode()]
 
     def is_optional(self):
         """Returns True if the choice has the 'optional' flag set (and so will
@@ -2972,9 +5169,22 @@ class Choice(Item):
         # See Choice.get_def_locations()
         self.def_locations = []
 
-        # Cached values
+        # Dependencies from enclosing menus and ifs together with local
+        # 'depends on' dependencies. See Symbol.__init__().
+        self.menu_dep = None
+
+        # Cached values. The mode is cached as an integer.
         self.cached_selection = None
         self.cached_visibility = None
+        self.cached_mode = None
+
+        # Compiled versions of the expressions, built by _compile() the first
+        # time they're needed. See _compile_expr().
+        self.compiled = False
+        # Functions for the conditions in 'prompts'
+        self.prompt_fns = None
+        # (symbol, condition function) tuples for 'def_exprs'
+        self.def_fns = None
 
         self.optional = False
 
@@ -3018,6 +5228,9 @@ class Choice(Item):
                 stack.append(item)
 
     def _cache_ret(self, selection):
+        if self.config._journal is not None:
+            self.config._record(self)
+
         # As None is used to indicate the lack of a cached value we can't use
         # that to cache the fact that the choice has no selection. Instead, we
         # use the symbolic constant NO_SELECTION.
@@ -3029,8 +5242,61 @@ class Choice(Item):
         return selection
 
     def _invalidate(self):
+        if self.config._journal is not None:
+            self.config._record(self)
+        self.config._eval_epoch += 1
         self.cached_selection = None
         self.cached_visibility = None
+        self.cached_mode = None
+
+    def _get_tri_mode(self):
+        """Like get_mode(), but returns the mode as an integer. See
+        Config._eval_tri(). The mode is looked up for each symbol in the
+        choice whenever its value or visibility is calculated, so it's cached
+        in cached_mode."""
+        if self.cached_mode is not None:
+            return self.cached_mode
+
+        minimum_mode = "n" if self.optional else "m"
+        mode = self.config._eval_tri(self.user_mode
+                                     if self.user_mode is not None else
+                                     minimum_mode)
+        vis = _get_visibility(self)
+        if vis < mode:
+            mode = vis
+
+        # Promote "m" to "y" for boolean choices
+        if mode == 1 and self.type == BOOL:
+            mode = 2
+
+        if self.config._journal is not None:
+            self.config._record(self)
+        self.cached_mode = mode
+        return mode
+
+    def _compile(self):
+        """Compiles the expressions of the choice. See _compile_expr()."""
+        config = self.config
+        self.prompt_fns = [_compile_expr(cond_expr, config)
+                           for _, cond_expr in self.prompts]
+        self.def_fns = [(sym, _compile_expr(cond_expr, config))
+                        for sym, cond_expr in self.def_exprs]
+        self.compiled = True
+
+    def _get_change_state(self):
+        """See Symbol._get_change_state()."""
+        return (self.get_selection(), self.get_mode(), self.get_visibility())
+
+    def _save_values(self):
+        """Returns the value state of the choice, for snapshots. See
+        Config.snapshot()."""
+        return (self.user_val, self.user_mode, self.cached_selection,
+                self.cached_visibility, self.cached_mode)
+
+    def _restore_values(self, saved):
+        """Restores a value state returned by _save_values()."""
+        self.user_val, self.user_mode, self.cached_selection, \
+            self.cached_visibility, self.cached_mode = saved
 
     def _unset_user_value(self):
         self._invalidate()
@@ -3044,6 +5310,11 @@ class Comment(Item):
 
     """Represents a comment statement."""
 
+    __slots__ = ['text', 'dep_expr', 'config', 'parent', 'orig_deps',
+                 'deps_from_containing', 'referenced_syms',
+                 'all_referenced_syms', 'filename', 'linenr', 'compiled',
+                 'dep_fn', 'cached_visibility']
+
     #
     # Public interface
     #
@@ -3071,7 +5342,16 @@ class Comment(Item):
     def get_visibility(self):
         """Returns the visibility of the comment. See also
         Symbol.get_visibility()."""
-        return self.config._eval_expr(self.dep_expr)
+        if self.cached_visibility is None:
+            config = self.config
+            # See Menu._cache_visibilities()
+            config._get_menu_deps()
+            if config._journal is not None:
+                config._record(self)
+            if not self.compiled:
+                self._compile()
+            self.cached_visibility = self.dep_fn()
+        return TRI_TO_STR[self.cached_visibility]
 
     def get_referenced_symbols(self, refs_from_enclosing=False):
         """See Symbol.get_referenced_symbols()."""
@@ -3125,10 +5405,93 @@ class Comment(Item):
         self.filename = None
         self.linenr = None
 
+        # Compiled version of 'dep_expr', built by _compile() the first time
+        # it's needed. See _compile_expr().
+        self.compiled = False
+        self.dep_fn = None
+
+        # Caches the calculated visibility, as an integer. See Menu.
+        self.cached_visibility = None
+
+    def _compile(self):
+        """Compiles the expression of the comment. See _compile_expr()."""
+        self.dep_fn = _compile_expr(self.dep_expr, self.config)
+        self.compiled = True
+
+    def _invalidate(self):
+        if self.config._journal is not None:
+            self.config._record(self)
+        self.cached_visibility = None
+
+    def _get_change_state(self):
+        """See Symbol._get_change_state()."""
+        return self.get_visibility()
+
+    def _save_values(self):
+        """Returns the value state of the comment, for snapshots. See
+        Config.snapshot()."""
+        return self.cached_visibility
+
+    def _restore_values(self, saved):
+        """Restores a value state returned by _save_values()."""
+        self.cached_visibility = saved
+
     def _make_conf(self, append_fn):
-        if self.config._eval_expr(self.dep_expr) != "n":
+        if self.get_visibility() != "n":
             append_fn("\n#\n# {}\n#".format(self.text))
 
+class ValueState(object):
+
+    """The value state of a Config: the user values of its symbols and
+    choices, and the values calculated from them. Returned by
+    Config.get_state() and made the current state with Config.set_state().
+    See those methods.
+
+    A ValueState does not change after it has been created, so it can be
+    restored any number of times, and only holds flat lists of values,
+    aligned with a list of symbols shared between all states of the
+    Config. It is much smaller than the Config it comes from."""
+
+    __slots__ = ['syms', 'user_vals', 'cached_vals', 'cached_tris',
+                 'cached_visibilities', 'write_to_confs', 'choices',
+                 'choice_user_vals', 'choice_user_modes', 'config_filename',
+                 'config_header']
+
+    def __init__(self, config):
+        """ValueState constructor -- not intended to be called directly by
+        Kconfiglib clients. Use Config.get_state() instead."""
+        self.syms = syms = config._get_state_syms()
+        self.user_vals = [sym.user_val for sym in syms]
+        self.cached_vals = [sym.cached_val for sym in syms]
+        self.cached_tris = [sym.cached_tri for sym in syms]
+        self.cached_visibilities = [sym.cached_visibility for sym in syms]
+        self.write_to_confs = [sym.write_to_conf for sym in syms]
+
+        # Choice selections are calculated quickly from the symbols, so only
+        # the user values are stored
+        self.choices = choices = tuple(config.choices)
+        self.choice_user_vals = [choice.user_val for choice in choices]
+        self.choice_user_modes = [choice.user_mode for choice in choices]
+
+        self.config_filename = config.config_filename
+        self.config_header = config.config_header
+
+class _Snapshot(object):
+
+    """A snapshot of the value state of a configuration, returned by
+    Config.snapshot(). Only the value states of the symbols and choices that
+    change after the snapshot is taken are stored, in 'journal'."""
+
+    __slots__ = ["journal", "config_filename", "config_header"]
+
+    def __init__(self, config):
+        # Maps symbols and choices to their value state at the time the
+        # snapshot was taken (see Symbol._save_values() and
+        # Choice._save_values())
+        self.journal = {}
+        self.config_filename = config.config_filename
+        self.config_header = config.config_header
+
 class Kconfig_Syntax_Error(Exception):
     """Exception raised for syntax errors."""
     pass
@@ -3252,6 +5615,316 @@ class _FileFeed(object):
             if line is None or not line.isspace():
                 return line
 
+class _FileRecord(object):
+
+    """Records the context a Kconfig file was parsed in and what it
+    contributed to the configuration, so that it can be reparsed on its own.
+    See Config.reparse()."""
+
+    __slots__ = ['filename', 'parent_record', 'parent', 'deps',
+                 'visible_if_deps', 'block', 'start', 'end', 'children',
+                 'selects', 'implies']
+
+    def __init__(self, filename, parent_record, parent, deps,
+                 visible_if_deps, block):
+        self.filename = filename
+        # The record for the file that sources this file. None for the
+        # top-level Kconfig file.
+        self.parent_record = parent_record
+
+        # The parameters the file was parsed with. See Config._parse_block().
+        self.parent = parent
+        self.deps = deps
+        self.visible_if_deps = visible_if_deps
+        self.block = block
+
+        # The items from the file (and the files it sources) are
+        # block[start:end]
+        self.start = len(block)
+        self.end = None
+
+        # Records for the files sourced by the file, in order
+        self.children = []
+
+        # (target, term, selector, def_nr) tuples for the terms that symbols
+        # defined in the file added to the rev_dep (select) and weak_rev_dep
+        # (imply) expressions of other symbols. def_nr is the index of the
+        # selector's definition in its def_locations list.
+        self.selects = []
+        self.implies = []
+
+    def records(self):
+        """Returns a list containing the record and the records for all
+        files sourced from it, recursively, in parse order."""
+        res = []
+        stack = [self]
+        while stack:
+            record = stack.pop()
+            res.append(record)
+            stack.extend(reversed(record.children))
+        return res
+
+class _DepGraph(object):
+
+    """A compact, index-based version of the graph formed by the Symbol.dep
+    sets, with choice symbols also linked to their siblings. Symbols are
+    numbered, and the strongly connected components of the graph (choices
+    and any dependency loops) are condensed into single nodes, numbered in
+    topological order. The component edges are stored in flat arrays.
+
+    Sets of dependent symbols are found by traversing the graph on demand
+    instead of being stored for each symbol, which would take memory
+    quadratic in the length of dependency chains. Built by
+    Config._get_dep_graph()."""
+
+    __slots__ = ['syms', 'ids', 'comp', 'member_start', 'members',
+                 'succ_start', 'succ']
+
+    def __init__(self, syms):
+        # Symbols by number, and the reverse mapping
+        self.syms = syms = list(syms)
+        self.ids = ids = dict([(sym, i) for i, sym in enumerate(syms)])
+        n = len(syms)
+
+        # Symbol edges, in the same array-based format as the component
+        # edges below: the successors of symbol i are
+        # sym_succ[sym_succ_start[i]:sym_succ_start[i + 1]]
+        sym_succ_start = array.array("i", [0])
+        sym_succ = array.array("i")
+        for sym in syms:
+            sym_succ.extend([ids[s] for s in sym.dep])
+            if sym.is_choice_sym:
+                sym_succ.extend([ids[s] for s in sym.parent.actual_symbols
+                                 if s is not sym])
+            sym_succ_start.append(len(sym_succ))
+
+        # Find the strongly connected components with Tarjan's algorithm,
+        # using an explicit stack as dependency chains can be longer than the
+        # recursion limit. Components are found in reverse topological order.
+        index = [-1]*n
+        low = [0]*n
+        on_stack = bytearray(n)
+        stack = []
+        comp = [0]*n
+        comps = []
+        counter = 0
+        for root in range(n):
+            if index[root] != -1:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            work = [(root, sym_succ_start[root])]
+            while work:
+                v, j = work[-1]
+                end = sym_succ_start[v + 1]
+                while j < end:
+                    w = sym_succ[j]
+                    j += 1
+                    if index[w] == -1:
+                        # Descend into w, resuming at edge j afterwards
+                        work[-1] = (v, j)
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack[w] = 1
+                        work.append((w, sym_succ_start[w]))
+                        break
+                    if on_stack[w] and index[w] < low[v]:
+                        low[v] = index[w]
+                else:
+                    work.pop()
+                    if work:
+                        u = work[-1][0]
+                        if low[v] < low[u]:
+                            low[u] = low[v]
+                    if low[v] == index[v]:
+                        members = []
+                        while 1:
+                            w = stack.pop()
+                            on_stack[w] = 0
+                            comp[w] = len(comps)
+                            members.append(w)
+                            if w == v:
+                                break
+                        comps.append(members)
+
+        # Number the components in topological order
+        n_comps = len(comps)
+        comps.reverse()
+        comp = [n_comps - 1 - c for c in comp]
+        self.comp = array.array("i", comp)
+
+        # The members of component c are
+        # members[member_start[c]:member_start[c + 1]]. This is a list of
+        # symbols rather than numbers, so that slices of it can be added to
+        # sets directly.
+        self.member_start = array.array("i", [0])
+        self.members = []
+        # The successors of component c (the components that depend on it)
+        # are succ[succ_start[c]:succ_start[c + 1]]. The lists aren't
+        # deduplicated and can include c itself, which is harmless for
+        # traversal and makes building them cheaper.
+        self.succ_start = array.array("i", [0])
+        self.succ = array.array("i")
+        for members in comps:
+            self.members.extend([syms[v] for v in members])
+            self.member_start.append(len(self.members))
+            for v in members:
+                self.succ.extend([comp[w] for w in
+                                  sym_succ[sym_succ_start[v]:
+                                           sym_succ_start[v + 1]]])
+            self.succ_start.append(len(self.succ))
+
+    def rank(self, sym):
+        """Returns the position of the component of 'sym' in a topological
+        order of the components. Symbols come after the symbols they depend
+        on, except within a component."""
+        return self.comp[self.ids[sym]]
+
+    def reachable(self, syms):
+        """Returns a list with the symbols in the components that can be
+        reached from the symbols in 'syms', including their own components.
+        These are the symbols that might be affected by a change to the
+        values of the symbols in 'syms'. Each symbol appears once, as each
+        component is visited once."""
+        comp, succ_start, succ = self.comp, self.succ_start, self.succ
+        seen = bytearray(len(succ_start) - 1)
+        stack = []
+        for sym in syms:
+            c = comp[self.ids[sym]]
+            if not seen[c]:
+                seen[c] = 1
+                stack.append(c)
+
+        res = []
+        member_start, members = self.member_start, self.members
+        # Hot loop for invalidation
+        pop, push, extend = stack.pop, stack.append, res.extend
+        while stack:
+            c = pop()
+            extend(members[member_start[c]:member_start[c + 1]])
+            for d in succ[succ_start[c]:succ_start[c + 1]]:
+                if not seen[d]:
+                    seen[d] = 1
+                    push(d)
+        return res
+
+class _TermCounter(object):
+
+    """Evaluates an OR expression with many terms, like the rev_dep of a
+    symbol selected by many symbols, by keeping track of how many of the terms
+    are "m" and "y" instead of evaluating all of them each time.
+
+    The first evaluation evaluates all terms and registers the counter in
+    Config._counter_index. After that, only the terms that reference a symbol
+    that has been invalidated since (which Symbol._invalidate() adds to
+    'dirty') are evaluated again, and the counts are adjusted, so that the
+    cost is proportional to the number of terms whose inputs might have
+    changed rather than to the total number of terms.
+
+    Values are not promoted from "m" to "y" when running without modules.
+    That is done for the result instead (see _compile_rev_dep())."""
+
+    __slots__ = ['config', 'term_syms', 'fns', 'may_be_m', 'vals', 'n_m',
+                 'n_y', 'dirty', 'gen']
+
+    def __init__(self, config, terms):
+        self.config = config
+        # The symbols referenced by each term
+        self.term_syms = [_get_expr_syms(term) for term in terms]
+        self.fns = []
+        self.may_be_m = False
+        for term in terms:
+            fn, may_be_m = _compile_expr_rec(term, config)
+            self.fns.append(fn)
+            if may_be_m:
+                self.may_be_m = True
+        # The value of each term the last time it was evaluated
+        self.vals = None
+        # The number of terms that are "m" and "y"
+        self.n_m = self.n_y = 0
+        # The indices of the terms that need to be evaluated again
+        self.dirty = set()
+        # The value of Config._counter_gen when the terms were counted. The
+        # counts are only valid if it's still the same.
+        self.gen = None
+
+    def eval(self):
+        if self.gen != self.config._counter_gen:
+            self._count()
+        elif self.dirty:
+            dirty = self.dirty
+            self.dirty = set()
+            vals, fns = self.vals, self.fns
+            for i in dirty:
+                new_val = fns[i]()
+                old_val = vals[i]
+                if new_val != old_val:
+                    vals[i] = new_val
+                    if old_val == 1:
+                        self.n_m -= 1
+                    elif old_val == 2:
+                        self.n_y -= 1
+                    if new_val == 1:
+                        self.n_m += 1
+                    elif new_val == 2:
+                        self.n_y += 1
+
+        if self.n_y:
+            return 2
+        return 1 if self.n_m else 0
+
+    def _count(self):
+        """Evaluates all terms and registers the counter in
+        Config._counter_index, so that terms are marked dirty when symbols
+        they reference are invalidated."""
+        config = self.config
+        self.gen = config._counter_gen
+        self.dirty = set()
+
+        index = config._counter_index
+        for i, syms in enumerate(self.term_syms):
+            for sym in syms:
+                counted = index.get(sym)
+                if counted is None:
+                    index[sym] = [(self, i)]
+                else:
+                    counted.append((self, i))
+
+        vals = [fn() for fn in self.fns]
+        self.n_m = vals.count(1)
+        self.n_y = vals.count(2)
+        self.vals = bytearray(vals)
+
+class _CachePickler(pickle.Pickler):
+
+    """Pickler for the parse cache. Pickles references to items and to the
+    Config as IDs, so that each item is pickled separately and only once. See
+    Config._save_cache()."""
+
+    def __init__(self, f, items, config):
+        pickle.Pickler.__init__(self, f, 2)
+        self.ids = dict([(id(item), i) for i, item in enumerate(items)])
+        self.ids[id(config)] = -1
+
+    def persistent_id(self, obj):
+        return self.ids.get(id(obj))
+
+class _CacheUnpickler(pickle.Unpickler):
+
+    """Counterpart to _CachePickler. Maps IDs back to items and the Config.
+    See Config._load_cache()."""
+
+    def __init__(self, f, items, config):
+        pickle.Unpickler.__init__(self, f)
+        self.items = items
+        self.config = config
+
+    def persistent_load(self, pid):
+        return self.config if pid == -1 else self.items[pid]
+
 #
 # Internal functions
 #
@@ -3260,29 +5933,354 @@ def _get_visibility(sc):
     """Symbols and Choices have a "visibility" that acts as an upper bound on
     the values a user can set for them, corresponding to the visibility in e.g.
     'make menuconfig'. This function calculates the visibility for the Symbol
-    or Choice 'sc' -- the logic is nearly identical."""
+    or Choice 'sc' -- the logic is nearly identical. The visibility is returned
+    as an integer (see Config._eval_tri())."""
     if sc.cached_visibility is None:
-        vis = "n"
-        for _, cond_expr in sc.prompts:
-            vis = sc.config._eval_max(vis, cond_expr)
+        if not sc.compiled:
+            sc._compile()
+
+        vis = 0
+        for cond_fn in sc.prompt_fns:
+            cond_eval = cond_fn()
+            if cond_eval > vis:
+                vis = cond_eval
 
         if isinstance(sc, Symbol) and sc.is_choice_sym:
-            if sc.type == TRISTATE and vis == "m" and \
-               sc.parent.get_mode() == "y":
+            if sc.type == TRISTATE and vis == 1 and \
+               sc.parent._get_tri_mode() == 2:
                 # Choice symbols with visibility "m" are not visible if the
                 # choice has mode "y"
-                vis = "n"
+                vis = 0
             else:
-                vis = sc.config._eval_min(vis, _get_visibility(sc.parent))
+                parent_vis = _get_visibility(sc.parent)
+                if parent_vis < vis:
+                    vis = parent_vis
 
         # Promote "m" to "y" if we're dealing with a non-tristate
-        if vis == "m" and sc.type != TRISTATE:
-            vis = "y"
+        if vis == 1 and sc.type != TRISTATE:
+            vis = 2
 
+        if sc.config._journal is not None:
+            sc.config._record(sc)
         sc.cached_visibility = vis
 
     return sc.cached_visibility
 
+def _eval_relation(expr):
+    """Evaluates the relation (=, !=, <, <=, >, >=) 'expr' to "n" or "y", as an
+    integer (see Config._eval_tri())."""
+    # Implements <, <=, >, >= comparisons as well. These were added to
+    # kconfig in 31847b67 (kconfig: allow use of relations other than
+    # (in)equality).
+
+    # This mirrors the C implementation pretty closely. Perhaps there's
+    # a more pythonic way to structure this.
+
+    oper, op1, op2 = expr
+    op1_type, op1_str = _type_and_val(op1)
+    op2_type, op2_str = _type_and_val(op2)
+
+    # If both operands are strings...
+    if op1_type == STRING and op2_type == STRING:
+        # ...then compare them lexicographically
+        comp = _strcmp(op1_str, op2_str)
+    else:
+        # Otherwise, try to compare them as numbers
+        try:
+            comp = int(op1_str, TYPE_TO_BASE[op1_type]) - \
+                   int(op2_str, TYPE_TO_BASE[op2_type])
+        except ValueError:
+            # They're not both valid numbers. If the comparison is
+            # anything but = or !=, return 'n'. Otherwise, reuse
+            # _strcmp() to check for (in)equality.
+            if oper not in (EQUAL, UNEQUAL):
+                return 0
+            comp = _strcmp(op1_str, op2_str)
+
+    if   oper == EQUAL:         res = comp == 0
+    elif oper == UNEQUAL:       res = comp != 0
+    elif oper == LESS:          res = comp < 0
+    elif oper == LESS_EQUAL:    res = comp <= 0
+    elif oper == GREATER:       res = comp > 0
+    elif oper == GREATER_EQUAL: res = comp >= 0
+
+    return 2 if res else 0
+
+def _compile_expr(expr, config):
+    """Compiles the expression 'expr' from 'config' into a function that takes
+    no arguments and returns the same value as Config._eval_tri(expr) would.
+
+    The expression tree is walked and the node types dispatched on once, here,
+    instead of on each evaluation. The returned function is a tree of closures
+    specialized for the number of operands and for whether "m" can appear,
+    and skips the MODULES check for expressions that can only evaluate to "n"
+    or "y".
+
+    The types of the symbols in the expression are looked up at compile time,
+    so the function must be recompiled if they might have changed (see
+    Config.reparse())."""
+    if expr is None:
+        return _eval_y
+
+    fn, may_be_m = _compile_expr_rec(expr, config)
+    return _promote_m(fn, may_be_m, config)
+
+def _compile_rev_dep(expr, config):
+    """Like _compile_expr(), for rev_dep and weak_rev_dep expressions. These
+    are ORs with one term per selecting/implying symbol, and for ORs with many
+    terms, the terms are counted by a _TermCounter instead of evaluated one
+    by one."""
+    if not (isinstance(expr, tuple) and expr[0] == OR and
+            len(expr[1]) >= _MIN_COUNTED_TERMS):
+        return _compile_expr(expr, config)
+
+    counter = _TermCounter(config, expr[1])
+    return _promote_m(counter.eval, counter.may_be_m, config)
+
+def _promote_m(fn, may_be_m, config):
+    """_compile_expr() helper. Wraps the function 'fn' from
+    _compile_expr_rec() so that "m" is promoted to "y" when running without
+    modules, if needed."""
+    if not may_be_m:
+        return fn
+
+    # Promote "m" to "y" if we're running without modules. See _eval_tri().
+    modules_sym = config.syms.get("MODULES")
+
+    if modules_sym is None:
+        def eval_no_modules():
+            res = fn()
+            return 2 if res == 1 else res
+        return eval_no_modules
+
+    def eval_modules():
+        res = fn()
+        if res == 1 and modules_sym._get_tri_value() != 2:
+            return 2
+        return res
+    return eval_modules
+
+def _compile_expr_rec(expr, config=None):
+    """_compile_expr() helper. Returns a (function, may_be_m) tuple, where
+    'function' evaluates 'expr' without promoting "m" to "y" (like
+    Config._eval_expr_iter()), and 'may_be_m' is True if the result can be
+    "m".
+
+    If 'config' is given, compound expressions are compiled once, with the
+    functions stored in Config._expr_fns, and the functions for expressions
+    shared between several items are memoized (see _memoize()). Without
+    'config', only 'may_be_m' is meaningful."""
+    if not isinstance(expr, tuple):
+        return _compile_expr_rec_no_memo(expr, config, None)[:2]
+
+    # Storing the expressions along with their functions keeps the IDs from
+    # being reused
+    compiled = config._expr_fns if config is not None else {}
+
+    res = compiled.get(id(expr))
+    if res is None:
+        # Compile the subexpressions bottom-up, so that each expression finds
+        # its operands in 'compiled' instead of recursing
+        for subexpr in _compound_subexprs(expr, compiled):
+            fn, may_be_m, depth = \
+                _compile_expr_rec_no_memo(subexpr, config, compiled)
+            # Evaluating short expressions is cheaper than looking up the
+            # memoized value
+            if config is not None and \
+               (subexpr[0] == AND or subexpr[0] == OR) and \
+               len(subexpr[1]) >= _MIN_MEMOIZED_OPERANDS and \
+               id(subexpr) in config._get_shared_exprs():
+                fn = _memoize(fn, config)
+                depth += 1
+            compiled[id(subexpr)] = (subexpr, fn, may_be_m, depth)
+        res = compiled[id(expr)]
+
+    return res[1:3]
+
+def _compile_expr_rec_no_memo(expr, config, compiled):
+    """_compile_expr_rec() helper. Does the actual compilation. Returns a
+    (function, may_be_m, depth) tuple, where 'depth' is the number of nested
+    function calls needed to evaluate the expression.
+
+    The compound operands of 'expr' must already be in 'compiled' (see
+    _compile_expr_rec()). Expressions whose functions would nest deeper than
+    _MAX_COMPILED_DEPTH are evaluated with Config._eval_expr_iter() instead,
+    which doesn't recurse."""
+    if isinstance(expr, Symbol):
+        if expr.is_special_:
+            # The special symbols n, m, and y have constant values
+            if expr is expr.config.n or expr is expr.config.m or \
+               expr is expr.config.y:
+                return _compile_const(expr.cached_val)
+            # Symbols that get their value from the environment can have any
+            # value, regardless of type
+            if expr.type == BOOL or expr.type == TRISTATE:
+                return (expr._get_tri_value, True, 1)
+        if expr.type == BOOL:
+            return (expr._get_tri_value, False, 1)
+        if expr.type == TRISTATE:
+            return (expr._get_tri_value, True, 1)
+        # Non-bool/tristate symbols are always "n" in a tristate sense
+        return (_eval_n, False, 1)
+
+    if isinstance(expr, str):
+        return _compile_const(expr)
+
+    if expr[0] in RELATIONS:
+        def eval_relation():
+            return _eval_relation(expr)
+        return (eval_relation, False, 1)
+
+    if expr[0] == AND or expr[0] == OR:
+        fns, may_be_ms, depths = \
+            zip(*[compiled[id(subexpr)][1:] if isinstance(subexpr, tuple)
+                  else _compile_expr_rec_no_memo(subexpr, config, None)
+                  for subexpr in expr[1]])
+        may_be_m = any(may_be_ms)
+        depth = max(depths) + 1
+    elif expr[0] == NOT:
+        subexpr = expr[1]
+        fn, may_be_m, depth = \
+            compiled[id(subexpr)][1:] if isinstance(subexpr, tuple) else \
+            _compile_expr_rec_no_memo(subexpr, config, None)
+        depth += 1
+    else:
+        _internal_error("Internal error while compiling expression: unknown "
+                        "operation {}.".format(expr[0]))
+
+    if depth > _MAX_COMPILED_DEPTH and config is not None:
+        def eval_iter():
+            return config._eval_expr_iter(expr)
+        return (eval_iter, may_be_m, 1)
+
+    if expr[0] == AND:
+        if may_be_m:
+            return (_compile_and(fns), True, depth)
+        return (_compile_bool_and(fns), False, depth)
+
+    if expr[0] == OR:
+        if may_be_m:
+            return (_compile_or(fns), True, depth)
+        return (_compile_bool_or(fns), False, depth)
+
+    def eval_not():
+        return 2 - fn()
+    return (eval_not, may_be_m, depth)
+
+def _memoize(fn, config):
+    """_compile_expr_rec() helper. Wraps the function 'fn' for a shared
+    expression so that it is only called once for as long as
+    Config._eval_epoch stays the same, i.e. until some cached value is
+    invalidated. A 'depends on' chain shared by the prompts and defaults of
+    many symbols is then evaluated once rather than once for each of
+    them."""
+    memo = [None, None]
+
+    def eval_memo():
+        epoch = config._eval_epoch
+        if memo[0] == epoch:
+            return memo[1]
+        res = fn()
+        memo[0] = epoch
+        memo[1] = res
+        return res
+    return eval_memo
+
+def _compile_const(val):
+    """_compile_expr_rec() helper for constant operands."""
+    if val == "y":
+        return (_eval_y, False, 1)
+    if val == "m":
+        return (_eval_m, True, 1)
+    return (_eval_n, False, 1)
+
+def _eval_n():
+    return 0
+
+def _eval_m():
+    return 1
+
+def _eval_y():
+    return 2
+
+def _compile_and(fns):
+    """_compile_expr_rec() helper for ANDs whose operands can be "m". The
+    result is the minimum of the operands."""
+    if len(fns) == 2:
+        fn1, fn2 = fns
+        def eval_and2():
+            ev1 = fn1()
+            if not ev1:
+                return 0
+            ev2 = fn2()
+            return ev1 if ev1 < ev2 else ev2
+        return eval_and2
+
+    def eval_and():
+        res = 2
+        for fn in fns:
+            ev = fn()
+            if ev < res:
+                if not ev:
+                    return 0
+                res = ev
+        return res
+    return eval_and
+
+def _compile_bool_and(fns):
+    """_compile_expr_rec() helper for ANDs whose operands are "n" or "y"."""
+    if len(fns) == 2:
+        fn1, fn2 = fns
+        def eval_and2():
+            return fn1() and fn2()
+        return eval_and2
+
+    def eval_and():
+        for fn in fns:
+            if not fn():
+                return 0
+        return 2
+    return eval_and
+
+def _compile_or(fns):
+    """_compile_expr_rec() helper for ORs whose operands can be "m". The
+    result is the maximum of the operands."""
+    if len(fns) == 2:
+        fn1, fn2 = fns
+        def eval_or2():
+            ev1 = fn1()
+            if ev1 == 2:
+                return 2
+            ev2 = fn2()
+            return ev1 if ev1 > ev2 else ev2
+        return eval_or2
+
+    def eval_or():
+        res = 0
+        for fn in fns:
+            ev = fn()
+            if ev > res:
+                if ev == 2:
+                    return 2
+                res = ev
+        return res
+    return eval_or
+
+def _compile_bool_or(fns):
+    """_compile_expr_rec() helper for ORs whose operands are "n" or "y"."""
+    if len(fns) == 2:
+        fn1, fn2 = fns
+        def eval_or2():
+            return fn1() or fn2()
+        return eval_or2
+
+    def eval_or():
+        for fn in fns:
+            if fn():
+                return 2
+        return 0
+    return eval_or
+
 def _make_and(e1, e2):
     """Constructs an AND (&&) expression. Performs trivial simplification.
     Nones equate to 'y'.
@@ -3329,25 +6327,239 @@ def _make_or(e1, e2):
 
     return (OR, [e1, e2])
 
+def _make_or_terms(e, terms):
+    """Returns the same expression as adding each expression in 'terms' to
+    'e' in turn with _make_or(), in linear rather than quadratic time. Used to
+    build rev_dep and weak_rev_dep expressions, which can have thousands of
+    terms."""
+    # The arguments of the OR expression being built, once there is one.
+    # _make_or() would copy them for each term.
+    args = None
+    for term in terms:
+        if args is None:
+            e = _make_or(e, term)
+            if isinstance(e, tuple) and e[0] == OR:
+                args = list(e[1])
+        elif term is None or term == "y":
+            return "y"
+        elif isinstance(term, tuple) and term[0] == OR:
+            args.extend(term[1])
+        else:
+            args.append(term)
+
+    return e if args is None else (OR, args)
+
+def _expr_key(expr):
+    """Config._intern_expr() helper. Returns a hashable key that identifies
+    the interned expression 'expr'. Symbols and strings are their own keys.
+    Compound expressions are identified by their IDs, which works as their
+    operands have already been interned."""
+    if isinstance(expr, (Symbol, str)):
+        return expr
+    return id(expr)
+
+def _compound_subexprs(expr, done):
+    """Generates the compound subexpressions of the compound expression 'expr'
+    (including 'expr' itself) whose IDs aren't in 'done', with the operands of
+    each expression generated before it. The caller must add the ID of each
+    generated expression to 'done' before fetching the next one.
+
+    Uses an explicit stack instead of recursion, so that arbitrarily deeply
+    nested expressions can be walked."""
+    stack = [expr]
+    while stack:
+        expr = stack[-1]
+        if id(expr) in done:
+            # Already generated, via another path
+            stack.pop()
+            continue
+
+        if expr[0] == AND or expr[0] == OR:
+            operands = expr[1]
+        elif expr[0] == NOT:
+            operands = (expr[1],)
+        else:
+            # Relations only have symbols and strings as operands
+            operands = ()
+
+        n_pending = len(stack)
+        for operand in operands:
+            if isinstance(operand, tuple) and id(operand) not in done:
+                stack.append(operand)
+
+        if len(stack) == n_pending:
+            # All operands done
+            stack.pop()
+            yield expr
+
 def _get_expr_syms_rec(expr, res):
-    """_get_expr_syms() helper. Recurses through expressions."""
-    if isinstance(expr, Symbol):
-        res.add(expr)
-    elif isinstance(expr, str):
+    """_get_expr_syms() helper. Adds the symbols in 'expr' to the set 'res'.
+    The operands are kept on a stack rather than recursed into."""
+    stack = [expr]
+    while stack:
+        expr = stack.pop()
+        if isinstance(expr, Symbol):
+            res.add(expr)
+        elif isinstance(expr, str):
+            continue
+        elif expr[0] == AND or expr[0] == OR:
+            stack.extend(expr[1])
+        elif expr[0] == NOT:
+            stack.append(expr[1])
+        elif expr[0] in RELATIONS:
+            if isinstance(expr[1], Symbol):
+                res.add(expr[1])
+            if isinstance(expr[2], Symbol):
+                res.add(expr[2])
+        else:
+            _internal_error("Internal error while fetching symbols from an "
+                            "expression with token stream {}.".format(expr))
+
+def _get_dep_syms(sym):
+    """Returns the set() of symbols whose values might affect the value of
+    'sym', i.e. the symbols that should have 'sym' in their 'dep' sets. See
+    Config._build_dep()."""
+    res = set()
+
+    for _, e in sym.prompts:
+        if e is not None:
+            _get_expr_syms_rec(e, res)
+
+    for v, e in sym.def_exprs:
+        _get_expr_syms_rec(v, res)
+        if e is not None:
+            _get_expr_syms_rec(e, res)
+
+    _get_expr_syms_rec(sym.rev_dep, res)
+    _get_expr_syms_rec(sym.weak_rev_dep, res)
+
+    for l, u, e in sym.ranges:
+        _get_expr_syms_rec(l, res)
+        _get_expr_syms_rec(u, res)
+        if e is not None:
+            _get_expr_syms_rec(e, res)
+
+    if sym.is_choice_sym:
+        choice = sym.parent
+        for _, e in choice.prompts:
+            if e is not None:
+                _get_expr_syms_rec(e, res)
+        for _, e in choice.def_exprs:
+            if e is not None:
+                _get_expr_syms_rec(e, res)
+
+    return res
+
+def _load_config_timed(config, fn, filename):
+    """Config.load_configs() helper. Loads 'filename' and calls 'fn', and
+    returns a (filename, result, seconds) tuple."""
+    start = time.time()
+    config.load_config(filename)
+    res = fn(config, filename)
+    return (filename, res, time.time() - start)
+
+# The Config and function for Config.load_configs(), in worker processes. The
+# worker processes are forked, so these are not pickled.
+_load_configs_state = None
+
+def _init_load_configs_worker(config, fn):
+    """Config.load_configs() helper. Runs in each worker process when it
+    starts."""
+    global _load_configs_state
+    _load_configs_state = (config, fn)
+
+def _load_configs_worker(filename):
+    """Config.load_configs() helper. Runs in worker processes."""
+    config, fn = _load_configs_state
+    return _load_config_timed(config, fn, filename)
+
+def _set_choice_allyes(choice):
+    """Config.allyes() helper. Gives 'choice' its default selection if it can
+    be in "y" mode, and sets all its symbols to "m" if it can only be in "m"
+    mode."""
+    vis = choice.get_visibility()
+    if vis == "y":
+        selection = choice.get_selection_from_defaults()
+        if selection is not None and \
+           selection is not choice.get_user_selection():
+            selection.set_user_value("y")
+    elif vis == "m":
+        _set_choice_mod(choice)
+
+def _set_choice_mod(choice):
+    """Config.allyes()/allmod() helper. Puts 'choice' in "m" mode by setting
+    all its symbols that can be "m" to "m"."""
+    for sym in choice.actual_symbols:
+        if sym.get_value() != "m" and sym.get_upper_bound() != "n":
+            sym.set_user_value("m")
+
+def _set_choice_random(choice, draws, probability, modules_sym):
+    """Config._randconfig() helper. Gives 'choice' a random mode and random
+    user values for its symbols, using the random numbers in 'draws'. See
+    Config.randconfig()."""
+    for sym in choice.actual_symbols:
+        sym._unset_user_value_no_recursive_invalidate()
+
+    optional_draw, mode_draw, sel_draw = draws[choice]
+    vis = _get_visibility(choice)
+    if not vis or choice.optional and optional_draw >= probability:
+        # Leave the choice in its default mode
         return
-    elif expr[0] == AND or expr[0] == OR:
-        for term in expr[1]:
-            _get_expr_syms_rec(term, res)
-    elif expr[0] == NOT:
-        _get_expr_syms_rec(expr[1], res)
-    elif expr[0] in RELATIONS:
-        if isinstance(expr[1], Symbol):
-            res.add(expr[1])
-        if isinstance(expr[2], Symbol):
-            res.add(expr[2])
+
+    if choice.type == TRISTATE and modules_sym is not None and \
+       modules_sym._get_tri_value() == 2 and (vis == 1 or mode_draw < 0.5):
+        choice.user_mode = "m"
+        for sym in choice.actual_symbols:
+            # Bool symbols in tristate choices can't be "m"
+            sym._set_user_value_no_invalidate(
+              "m" if sym.type == TRISTATE and draws[sym] < probability else
+              "n", True)
     else:
-        _internal_error("Internal error while fetching symbols from an "
-                        "expression with token stream {}.".format(expr))
+        # The visibility of the symbols depends on the mode
+        choice.user_mode = "y"
+        choice._invalidate()
+        visible = [sym for sym in choice.actual_symbols
+                   if _get_visibility(sym) == 2]
+        if visible:
+            visible[int(sel_draw*len(visible))] \
+              ._set_user_value_no_invalidate("y", True)
+
+    for sym in choice.actual_symbols:
+        sym._invalidate()
+
+def _depends_on_modules(sym):
+    """Returns True if the value of 'sym' might depend on MODULES through the
+    promotion of "m" to "y" when modules are disabled, i.e. if the symbol is a
+    tristate or choice symbol, or has an expression that can evaluate to "m".
+    See Config._get_modules_dep()."""
+    if sym.is_special_:
+        # Special symbols have fixed values
+        return False
+    if sym.type == TRISTATE or sym.is_choice_sym:
+        return True
+
+    exprs = [cond for _, cond in sym.prompts]
+    exprs.extend([cond for _, cond in sym.def_exprs])
+    exprs.extend([val for val, _ in sym.def_exprs])
+    exprs.extend([cond for _, _, cond in sym.ranges])
+    exprs.append(sym.rev_dep)
+    exprs.append(sym.weak_rev_dep)
+    for expr in exprs:
+        if expr is not None and _compile_expr_rec(expr)[1]:
+            return True
+    return False
+
+def _may_be_m(item):
+    """Returns True if the visibility of the menu or comment 'item' can be
+    "m", in which case it might depend on MODULES. See
+    Config._get_menu_deps()."""
+    exprs = [item.dep_expr]
+    if isinstance(item, Menu):
+        exprs.append(item.visible_if_expr)
+    for expr in exprs:
+        if expr is not None and _compile_expr_rec(expr)[1]:
+            return True
+    return False
 
 def _get_expr_syms(expr):
     """Returns the set() of symbols appearing in expr."""
@@ -3371,62 +6583,55 @@ def _sym_str_string(sym_or_str):
         return '"' + sym_or_str + '"'
     return sym_or_str.name
 
-def _intersperse(lst, op):
-    """_expr_to_str() helper. Gets the string representation of each expression
-    in lst and produces a list where op has been inserted between the
-    elements."""
-    if not lst:
+def _expr_to_str(expr):
+    """Returns the string representation of 'expr'. Doesn't recurse, so
+    that deep nesting isn't limited by the recursion limit."""
+    if expr is None:
         return ""
 
     res = []
 
-    def handle_sub_expr(expr):
-        no_parens = isinstance(expr, (str, Symbol)) or \
-                    expr[0] in RELATIONS or \
-                    PRECEDENCE[op] <= PRECEDENCE[expr[0]]
-        if not no_parens:
-            res.append("(")
-        res.extend(_expr_to_str_rec(expr))
-        if not no_parens:
-            res.append(")")
+    # (is_expr, obj) tuples for the expressions left to convert and the
+    # strings left to output, with the next one last
+    stack = [(True, expr)]
 
-    op_str = OP_TO_STR[op]
+    while stack:
+        is_expr, expr = stack.pop()
 
-    handle_sub_expr(lst[0])
-    for expr in lst[1:]:
-        res.append(op_str)
-        handle_sub_expr(expr)
-
-    return res
+        if not is_expr:
+            res.append(expr)
 
-def _expr_to_str_rec(expr):
-    if expr is None:
-        return [""]
-
-    if isinstance(expr, (Symbol, str)):
-        return [_sym_str_string(expr)]
+        elif isinstance(expr, (Symbol, str)):
+            res.append(_sym_str_string(expr))
 
-    if expr[0] in (AND, OR):
-        return _intersperse(expr[1], expr[0])
-
-    if expr[0] == NOT:
-        need_parens = not isinstance(expr[1], (str, Symbol))
-
-        res = ["!"]
-        if need_parens:
-            res.append("(")
-        res.extend(_expr_to_str_rec(expr[1]))
-        if need_parens:
-            res.append(")")
-        return res
+        elif expr[0] in (AND, OR):
+            op = expr[0]
+            op_str = (False, OP_TO_STR[op])
+            for i in range(len(expr[1]) - 1, -1, -1):
+                subexpr = expr[1][i]
+                if isinstance(subexpr, (str, Symbol)) or \
+                   subexpr[0] in RELATIONS or \
+                   PRECEDENCE[op] <= PRECEDENCE[subexpr[0]]:
+                    stack.append((True, subexpr))
+                else:
+                    stack.extend(((False, ")"), (True, subexpr),
+                                  (False, "(")))
+                if i:
+                    stack.append(op_str)
+
+        elif expr[0] == NOT:
+            res.append("!")
+            if isinstance(expr[1], (str, Symbol)):
+                stack.append((True, expr[1]))
+            else:
+                stack.extend(((False, ")"), (True, expr[1]), (False, "(")))
 
-    if expr[0] in RELATIONS:
-        return [_sym_str_string(expr[1]),
-                OP_TO_STR[expr[0]],
-                _sym_str_string(expr[2])]
+        elif expr[0] in RELATIONS:
+            res.extend((_sym_str_string(expr[1]),
+                        OP_TO_STR[expr[0]],
+                        _sym_str_string(expr[2])))
 
-def _expr_to_str(expr):
-    return "".join(_expr_to_str_rec(expr))
+    return "".join(res)
 
 def _type_and_val(obj):
     """Helper to hack around the fact that we don't represent plain strings as
@@ -3449,6 +6654,52 @@ def _deindent(line, indent):
         return line
     return line[indent:]
 
+def _block_items(block):
+    """Returns a list of the items in 'block' and, recursively, in the blocks
+    of menus and choices within it, in parse order."""
+    res = []
+    for item in block:
+        res.append(item)
+        if isinstance(item, (Menu, Choice)):
+            res.extend(_block_items(item.block))
+    return res
+
+def _defined_in(syms, filenames):
+    """Returns True if all definitions of the symbols in 'syms' are in files
+    from 'filenames'."""
+    for sym in syms:
+        for filename, _ in sym.get_def_locations():
+            if filename not in filenames:
+                return False
+    return True
+
+def _cache_attrs(cls):
+    """Returns the names of the attributes of the item class 'cls' (Symbol,
+    Choice, Menu, or Comment) that are stored in the parse cache."""
+    attrs = _cache_attrs_of_class.get(cls)
+    if attrs is None:
+        # All attributes have slots, and are initialized in the constructor
+        attrs = _cache_attrs_of_class[cls] = tuple(sorted(cls.__slots__))
+    return attrs
+
+def _cache_setters(cls):
+    """Returns functions that set the attributes returned by _cache_attrs()
+    on an instance of 'cls', in the same order. Calling the __set__() methods
+    of the slot descriptors directly is faster than setattr()."""
+    setters = _cache_setters_of_class.get(cls)
+    if setters is None:
+        setters = _cache_setters_of_class[cls] = \
+          tuple([getattr(cls, attr).__set__ for attr in _cache_attrs(cls)])
+    return setters
+
+_cache_attrs_of_class = {}
+_cache_setters_of_class = {}
+
+def _file_digest(filename):
+    """Returns a hash of the contents of the file 'filename'."""
+    with open(filename, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
 def _is_base_n(s, n):
     try:
         int(s, n)
@@ -3596,8 +6847,49 @@ RELATIONS = frozenset((EQUAL, UNEQUAL, LESS, LESS_EQUAL, GREATER,
 # never convert to valid numbers.
 TYPE_TO_BASE = {UNKNOWN: 0, BOOL: 0, TRISTATE: 0, STRING: 0, HEX: 16, INT: 10}
 
-# Map from tristate values to integers
+# Map from tristate values to integers, and back. Tristate values are
+# represented as integers internally during evaluation (see
+# Config._eval_tri()).
 TRI_TO_INT = {"n": 0, "m": 1, "y": 2}
+TRI_TO_STR = ("n", "m", "y")
+
+# Shared empty containers that the lists and sets of symbols start out as. See
+# Symbol.__init__().
+_NO_ENTRIES = ()
+_NO_SYMS = frozenset()
+
+# Version of the parse cache format. Bump this whenever the cached data changes
+# (e.g. when attributes are added to the item classes), so that old caches are
+# not loaded.
+_CACHE_VERSION = 12
+
+# Item attributes not stored in the parse cache. They are None after loading.
+# Compiled expressions can't be pickled, and are cheap to rebuild.
+_UNCACHED_ITEM_ATTRS = frozenset(("compiled", "prompt_fns", "def_fns",
+                                  "range_fns", "rev_dep_fn", "weak_rev_dep_fn",
+                                  "dep_fn", "visible_if_fn"))
+
+# rev_dep and weak_rev_dep expressions with at least this many terms are
+# evaluated with a _TermCounter. For fewer terms, evaluating all of them is
+# as fast.
+_MIN_COUNTED_TERMS = 8
+
+# Shared AND and OR expressions with at least this many operands are
+# memoized. See _compile_expr_rec().
+_MIN_MEMOIZED_OPERANDS = 3
+
+# Compiled expressions are evaluated with nested function calls. Expressions
+# that would nest deeper than this are evaluated without recursion instead.
+# See _compile_expr_rec_no_memo().
+_MAX_COMPILED_DEPTH = 50
+
+# Config attributes restored from the parse cache. Everything else is either
+# set up in Config.__init__() or checked as part of the cache key.
+_CACHED_CONFIG_ATTRS = ("syms", "kconfig_syms", "named_choices", "choices",
+                        "menus", "comments", "n", "m", "y", "defconfig_sym",
+                        "mainmenu_text", "top_block", "_top_file",
+                        "_filenames", "_filename_ids",
+                        "_n_parsed_expr_nodes", "_n_simplified_expr_nodes")
 
 # Printing-related stuff
 
@@ -41,11 +41,15 @@
 from __future__ import print_function
 
 import kconfiglib
+import array
 import os
+import pickle
 import platform
 import re
+import shutil
 import subprocess
 import sys
+import tempfile
 import textwrap
 import time
 
@@ -328,6 +332,13 @@ def run_selftests():
         verify(res == val,
                "'{}' evaluated to {}, expected {}".format(expr, res, val))
 
+        # Also check the compiled evaluator on the same expression
+        parsed = c._parse_expr(c._tokenize(expr, True), None, expr)
+        res = kconfiglib.TRI_TO_STR[kconfiglib._compile_expr(parsed, c)()]
+        verify(res == val,
+               "compiled '{}' evaluated to {}, expected {}"
+               .format(expr, res, val))
+
     def verify_eval_bad(expr):
         try:
             c.eval(expr)
@@ -1693,6 +1704,19 @@ def run_selftests():
     verify_value("BOOL", "n")
     verify_value("STRING", "foo bar")
 
+    # Reloading should only invalidate symbols whose user values change (this
+    # tests an internal API)
+    verify_value("IGNOREME", "y")
+    c.load_config("Kconfiglib/tests/config_set_bool")
+    verify(c["IGNOREME"].cached_val is not None,
+           "IGNOREME should not be invalidated when loading a .config that "
+           "doesn't change it")
+    verify_value("BOOL", "y")
+    verify_value("STRING", "")
+    c.load_config("Kconfiglib/tests/config_set_string")
+    verify_value("BOOL", "n")
+    verify_value("STRING", "foo bar")
+
     # Loading a completely empty .config should reset values
     c.load_config("Kconfiglib/tests/empty")
     verify_value("STRING", "")
@@ -1964,6 +1988,1292 @@ def run_selftests():
         verify(c["CHAIN_26"] in c["CHAIN_1"]._get_dependent(),
                "Dependency chain broken")
 
+    # Symbols should come after the symbols they depend on in the dependency
+    # graph, and the symbols in a choice should be in a single component
+
+    graph = c._get_dep_graph()
+    for i in range(1, 26):
+        verify(graph.rank(c["CHAIN_{}".format(i)]) <
+               graph.rank(c["CHAIN_{}".format(i + 1)]),
+               "CHAIN_{} should come before CHAIN_{} in the dependency graph"
+               .format(i, i + 1))
+
+    c = kconfiglib.Config("Kconfiglib/tests/Kdep")
+    graph = c._get_dep_graph()
+    verify(graph.rank(c["A"]) == graph.rank(c["B"]) == graph.rank(c["C"]),
+           "The choice symbols A, B, and C should be in the same component")
+    verify(graph.rank(c["S"]) < graph.rank(c["A"]),
+           "S should come before the choice symbols it affects")
+
+    print("Testing change propagation...")
+
+    # Note: This tests an internal API (the cached values)
+
+    c = kconfiglib.Config("Kconfiglib/tests/Kpropagate")
+
+    def verify_values(*names_and_vals):
+        for name, val in names_and_vals:
+            verify_value(name, val)
+
+    c["MODULES"].set_user_value("y")
+    verify_values(("A", "y"), ("B", "y"), ("C", "y"), ("E", "y"),
+                  ("F", "m"), ("G", "y"), ("UNRELATED", "y"))
+
+    c["A"].set_user_value("n")
+    verify_values(("A", "n"), ("B", "n"), ("C", "n"), ("E", "n"))
+
+    # E does not change when D changes from "n" to "y" here, so the
+    # propagation should stop there
+    c["D"].set_user_value("y")
+    verify_values(("D", "y"), ("E", "y"))
+    c["A"].set_user_value("y")
+    verify_values(("B", "y"), ("C", "y"), ("E", "y"))
+    c["A"].unset_user_value()
+    verify_values(("A", "y"), ("B", "y"))
+
+    # Changes that don't change the value of a symbol should leave the
+    # dependent symbols alone
+    c["B"].set_user_value("y")
+    verify(c["C"].cached_val is not None,
+           "C should not be invalidated when the value of B does not change")
+
+    # MODULES affects "m" values without being referenced
+    c["MODULES"].set_user_value("n")
+    verify_values(("F", "y"), ("G", "y"))
+    c["MODULES"].set_user_value("y")
+    verify_values(("F", "m"), ("G", "y"))
+
+    verify(c["UNRELATED"].cached_val is not None,
+           "UNRELATED should not have been invalidated")
+
+    # Batched user values
+
+    c.set_user_values({"A": "n", "D": "n", "F": "y", "UNDEFINED": "y"})
+    verify_values(("A", "n"), ("B", "n"), ("C", "n"), ("E", "n"),
+                  ("F", "y"), ("G", "y"))
+
+    with c.batch_user_values():
+        c["A"].set_user_value("y")
+        with c.batch_user_values():
+            c["D"].unset_user_value()
+        verify(c["B"].cached_val == "n",
+               "B should not be updated until the end of the batch")
+    verify_values(("A", "y"), ("B", "y"), ("C", "y"), ("E", "y"))
+
+    c.set_user_values([("F", "n"), ("F", "m")])
+    verify_values(("F", "m"), ("G", "y"))
+
+    verify(c["UNRELATED"].cached_val is not None,
+           "UNRELATED should not have been invalidated")
+
+    #
+    # Parse cache
+    #
+
+    print("Testing parse cache...")
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        kconfig = os.path.join(cache_dir, "Kconfig")
+        sourced = os.path.join(cache_dir, "Ksourced")
+        cache_file = os.path.join(cache_dir, "Kconfig.cache")
+
+        with open(kconfig, "w") as f:
+            f.write('config A\n'
+                    '\tbool "a"\n'
+                    '\tdefault y\n'
+                    'source "{}"\n'.format(sourced))
+        with open(sourced, "w") as f:
+            f.write('config B\n'
+                    '\ttristate "b"\n'
+                    '\tdepends on A\n'
+                    '\tdefault m\n')
+
+        c_ref = kconfiglib.Config(kconfig)
+        c_cold = kconfiglib.Config(kconfig, cache_file=cache_file)
+        verify(os.path.exists(cache_file), "Parse cache not written")
+        verify(str(c_cold) == str(c_ref), "Cold load gave different results")
+
+        # Verify that the cache is used when the files are unchanged, by
+        # making parsing fail
+        orig_parse_file = kconfiglib.Config._parse_file
+        def fail_parse(*args):
+            fail("Kconfig files were parsed despite a valid parse cache")
+            return orig_parse_file(*args)
+        kconfiglib.Config._parse_file = fail_parse
+        try:
+            c_warm = kconfiglib.Config(kconfig, cache_file=cache_file)
+        finally:
+            kconfiglib.Config._parse_file = orig_parse_file
+
+        verify(str(c_warm) == str(c_ref), "Warm load gave different results")
+        verify(c_warm["B"] in c_warm["A"]._get_dependent(),
+               "Dependencies lost in parse cache")
+        c_warm["A"].set_user_value("n")
+        verify_equals(c_warm["B"].get_value(), "n")
+        verify_equals(c_warm["B"].get_def_locations(), [(sourced, 1)])
+
+        # Changing a sourced file should invalidate the cache
+        with open(sourced, "w") as f:
+            f.write('config B\n'
+                    '\ttristate "b modified"\n'
+                    '\tdefault y\n')
+        c_stale = kconfiglib.Config(kconfig, cache_file=cache_file)
+        verify_equals(c_stale["B"].get_prompts(), ["b modified"])
+        verify_equals(c_stale["B"].get_value(), "y")
+
+        # A corrupt cache should be ignored
+        with open(cache_file, "wb") as f:
+            f.write(b"garbage")
+        c_corrupt = kconfiglib.Config(kconfig, cache_file=cache_file)
+        verify_equals(c_corrupt["B"].get_value(), "y")
+
+        # A cache whose item states don't match the cached attributes (e.g.
+        # from a version that added attributes without bumping the cache
+        # version) should be ignored rather than loaded into the wrong
+        # attributes
+        os.remove(cache_file)
+        orig_cache_attrs = kconfiglib._cache_attrs
+        kconfiglib._cache_attrs = lambda cls: orig_cache_attrs(cls)[1:]
+        try:
+            kconfiglib.Config(kconfig, cache_file=cache_file)
+        finally:
+            kconfiglib._cache_attrs = orig_cache_attrs
+        parsed = []
+        def recording_parse(*args):
+            parsed.append(args[0])
+            return orig_parse_file(*args)
+        kconfiglib.Config._parse_file = recording_parse
+        try:
+            c_layout = kconfiglib.Config(kconfig, cache_file=cache_file)
+        finally:
+            kconfiglib.Config._parse_file = orig_parse_file
+        verify(parsed, "Parse cache with the wrong attribute layout loaded")
+        verify_equals(str(c_layout), str(kconfiglib.Config(kconfig)))
+
+        # Only files whose modification time or size changed are hashed
+        # when the cache is rewritten
+        orig_file_digest = kconfiglib._file_digest
+        hashed = []
+        def counting_file_digest(filename):
+            hashed.append(filename)
+            return orig_file_digest(filename)
+        kconfiglib._file_digest = counting_file_digest
+        try:
+            with open(sourced, "w") as f:
+                f.write('config B\n'
+                        '\ttristate "b modified again"\n')
+            kconfiglib.Config(kconfig, cache_file=cache_file)
+        finally:
+            kconfiglib._file_digest = orig_file_digest
+        verify_equals(set(hashed), set([sourced]))
+
+        # Failing to write the cache should not make Config() fail, and
+        # should not leave a temporary file behind
+        c_unwritable = kconfiglib.Config(
+          kconfig, print_warnings=False,
+          cache_file=os.path.join(cache_dir, "nonexistent", "Kconfig.cache"))
+        verify_equals(c_unwritable["B"].get_prompts(), ["b modified again"])
+
+        orig_dump = kconfiglib._CachePickler.dump
+        def failing_dump(*args):
+            raise pickle.PicklingError("test")
+        kconfiglib._CachePickler.dump = failing_dump
+        try:
+            os.remove(cache_file)
+            c_unpicklable = kconfiglib.Config(kconfig, print_warnings=False,
+                                              cache_file=cache_file)
+        finally:
+            kconfiglib._CachePickler.dump = orig_dump
+        verify_equals(c_unpicklable["B"].get_prompts(), ["b modified again"])
+        verify_equals(sorted(os.listdir(cache_dir)), ["Kconfig", "Ksourced"])
+    finally:
+        shutil.rmtree(cache_dir)
+
+    #
+    # Incremental reparsing
+    #
+
+    print("Testing incremental reparsing...")
+
+    reparse_dir = tempfile.mkdtemp()
+    try:
+        def write_kconfig(name, contents):
+            with open(os.path.join(reparse_dir, name), "w") as f:
+                f.write(textwrap.dedent(contents))
+
+        def items_str(c):
+            return [str(item) for item in c.get_symbols(False) +
+                                          c.get_choices() + c.get_menus() +
+                                          c.get_comments()] + \
+                   sorted([sym.get_name() for sym in c.get_symbols()])
+
+        def deps_str(c):
+            return [(sym.get_name(),
+                     sorted([dep.get_name() for dep in sym._get_dependent()]))
+                    for sym in c]
+
+        def verify_reparse(c, changed_files, user_vals):
+            """Reparses 'c' after changes to 'changed_files' and compares it
+            with a freshly parsed Config with the user values in 'user_vals'
+            assigned"""
+            c.reparse([os.path.join(reparse_dir, filename)
+                       for filename in changed_files])
+            c_ref = kconfiglib.Config(os.path.join(reparse_dir, "Kconfig"),
+                                      reparse_dir)
+            for name, val in user_vals:
+                c_ref[name].set_user_value(val)
+            verify(items_str(c) == items_str(c_ref),
+                   "Reparsing {} gave different items than a full parse"
+                   .format(changed_files))
+            verify(deps_str(c) == deps_str(c_ref),
+                   "Reparsing {} gave different dependencies than a full "
+                   "parse".format(changed_files))
+
+        write_kconfig("Kconfig", """
+          config A
+          \tbool "a"
+          \tdefault y
+          menu "menu"
+          \tdepends on A
+          source "K1"
+          if B
+          source "K2"
+          endif
+          endmenu
+          config C
+          \ttristate "c"
+          \tdepends on D
+          """)
+        write_kconfig("K1", """
+          config B
+          \tbool "b"
+          \tselect C
+          source "K3"
+          """)
+        write_kconfig("K2", """
+          config D
+          \ttristate "d"
+          \tdefault m
+          comment "comment"
+          """)
+        write_kconfig("K3", """
+          config E
+          \tbool "e"
+          \timply C
+          """)
+
+        c = kconfiglib.Config(os.path.join(reparse_dir, "Kconfig"),
+                              reparse_dir)
+        a, c_sym, d, e = c["A"], c["C"], c["D"], c["E"]
+        c["B"].set_user_value("y")
+        c["E"].set_user_value("y")
+
+        # Change a nested file, adding items and a select
+        write_kconfig("K2", """
+          config D
+          \ttristate "d"
+          \tdefault y
+          \tselect F
+          config F
+          \tbool
+          choice
+          \tprompt "choice"
+          config G
+          \tbool "g"
+          config H
+          \tbool "h"
+          endchoice
+          comment "comment"
+          """)
+        verify_reparse(c, ["K2"], (("B", "y"), ("E", "y")))
+        verify(c["A"] is a and c["C"] is c_sym and c["D"] is d and
+               c["E"] is e,
+               "Symbol instances were replaced by an incremental reparse")
+        verify_equals(c_sym.get_value(), "y")
+        verify_equals(c["F"].get_value(), "y")
+        verify_equals(c["B"].get_user_value(), "y")
+
+        # Change a file that sources another, removing a select and a symbol
+        c["H"].set_user_value("y")
+        write_kconfig("K1", """
+          config B2
+          \tbool "b2"
+          source "K3"
+          config B
+          \tbool "b"
+          """)
+        verify_reparse(c, ["K1"], (("B", "y"), ("E", "y"), ("H", "y")))
+        verify(c["E"] is e, "Symbol instance was replaced")
+        verify_equals(c["H"].get_parent().get_selection().get_name(), "H")
+
+        # Changing several files at once, and a file that isn't sourced
+        write_kconfig("K3", """
+          config E
+          \tbool "e"
+          \tdepends on B2
+          """)
+        write_kconfig("K2", """
+          config D
+          \ttristate "d"
+          """)
+        write_kconfig("K4", """
+          config UNUSED
+          \tbool "unused"
+          """)
+        verify_reparse(c, ["K2", "K3", "K4"], (("B", "y"), ("E", "y")))
+        verify(c.get_symbol("F") is None and c.get_symbol("UNUSED") is None,
+               "Removed or unused symbols present after reparsing")
+        verify_equals(c_sym.get_value(), "n")
+
+        # Defining a symbol from another file falls back on a full reparse,
+        # as does changing the top-level file
+        for filename, contents in (("K3", """
+                                      config D
+                                      \tdefault y
+                                      """),
+                                   ("Kconfig", """
+                                      config A
+                                      \tbool "a"
+                                      source "K1"
+                                      """)):
+            write_kconfig(filename, contents)
+            verify_reparse(c, [filename], (("B", "y"),))
+            verify(c["A"] is not a,
+                   "Expected a full reparse after changing " + filename)
+            a = c["A"]
+
+        # Changing the value of MODULES should invalidate the symbols,
+        # menus, and comments whose "m" is promoted to "y" through it
+        write_kconfig("Kconfig", """
+          source "Kmod"
+          config S9
+          \ttristate
+          \tdefault m
+          comment "comment"
+          \tdepends on S9
+          """)
+        write_kconfig("Kmod", """
+          config MODULES
+          \tbool "modules"
+          \toption modules
+          \tdefault y
+          """)
+        c = kconfiglib.Config(os.path.join(reparse_dir, "Kconfig"),
+                              reparse_dir)
+        s9 = c["S9"]
+        verify_equals(s9.get_value(), "m")
+        verify_equals(c.get_comments()[0].get_visibility(), "m")
+        write_kconfig("Kmod", """
+          config MODULES
+          \tbool "modules"
+          \toption modules
+          \tdefault n
+          """)
+        verify_reparse(c, ["Kmod"], ())
+        verify(c["S9"] is s9, "Expected an incremental reparse of Kmod")
+        verify_equals(s9.get_value(), "y")
+        verify_equals(c.get_comments()[0].get_visibility(), "y")
+    finally:
+        shutil.rmtree(reparse_dir)
+
+    print("Testing allyes()/allno()/allmod()...")
+
+    c = kconfiglib.Config("Kconfiglib/tests/Kall")
+
+    c.allyes()
+    verify_values(("MODULES", "y"), ("A1", "y"), ("A2", "y"), ("A3", "y"),
+                  ("A4", "y"), ("DEF_Y", "y"), ("NO_Y", "y"),
+                  ("SELECTOR", "y"), ("SELECTED", "y"), ("T1", "y"),
+                  ("T2", "n"), ("B1", "n"), ("B2", "y"))
+
+    c.allno()
+    verify_values(("MODULES", "n"), ("A1", "n"), ("A2", "n"), ("A3", "n"),
+                  ("A4", "n"), ("DEF_Y", "n"), ("NO_Y", "y"),
+                  ("SELECTOR", "n"), ("SELECTED", "n"), ("B2", "y"))
+
+    c.allmod()
+    verify_values(("MODULES", "y"), ("A1", "m"), ("A2", "y"), ("A3", "m"),
+                  ("A4", "n"), ("DEF_Y", "y"), ("NO_Y", "y"),
+                  ("SELECTOR", "y"), ("SELECTED", "y"), ("T1", "m"),
+                  ("T2", "m"), ("B2", "y"))
+
+    print("Testing randconfig()...")
+
+    def values(c):
+        return [(sym.get_name(), sym.get_value()) for sym in c]
+
+    c = kconfiglib.Config("Kconfiglib/tests/Kall")
+
+    c.randconfig(seed=0, probability=0)
+    verify_values(("MODULES", "n"), ("A1", "n"), ("A2", "n"), ("DEF_Y", "n"),
+                  ("NO_Y", "n"), ("SELECTOR", "n"), ("SELECTED", "n"))
+
+    c.randconfig(seed=0, probability=1)
+    verify_values(("MODULES", "y"), ("A2", "y"), ("SELECTOR", "y"),
+                  ("SELECTED", "y"))
+    verify(c["A1"].get_value() != "n" and c["A3"].get_value() != "n",
+           "Symbols should not be 'n' with probability 1")
+
+    for seed in range(20):
+        c.randconfig(seed)
+        vals = values(c)
+
+        # The cached values should match freshly calculated ones
+        c._invalidate_all()
+        verify(values(c) == vals,
+               "Stale cached values after randconfig({})".format(seed))
+
+        for choice in c.get_choices():
+            selected = [sym for sym in choice.get_symbols()
+                        if sym.get_value() == "y"]
+            verify(len(selected) == (choice.get_mode() == "y"),
+                   "Wrong number of selected symbols in a choice")
+
+    # The same seed should give the same configuration, also with another
+    # Config instance and after other values have been set
+    c.randconfig(1)
+    vals = values(c)
+    c.allyes()
+    c.randconfig(1)
+    verify(values(c) == vals, "randconfig() is not deterministic")
+    c2 = kconfiglib.Config("Kconfiglib/tests/Kall")
+    c2.randconfig(1)
+    verify(values(c2) == vals,
+           "randconfig() differs between Config instances")
+
+    seen = set()
+    for seed in c.randconfigs(10, seed=0):
+        vals = values(c)
+        seen.add(tuple(vals))
+        c2.randconfig(seed)
+        verify(values(c2) == vals,
+               "randconfig() does not reproduce a randconfigs() sample")
+    verify(len(seen) > 1, "randconfigs() gives the same configuration")
+
+    print("Testing load_configs()...")
+
+    def get_values(c, filename):
+        return values(c)
+
+    configs_dir = tempfile.mkdtemp()
+    try:
+        c = kconfiglib.Config("Kconfiglib/tests/Kall")
+        filenames = []
+        expected = {}
+        for i, assignments in enumerate((
+            "CONFIG_MODULES=y\nCONFIG_A1=m\n",
+            "CONFIG_A1=y\nCONFIG_A2=y\n# CONFIG_DEF_Y is not set\n",
+            "CONFIG_SELECTOR=y\nCONFIG_B1=y\n",
+            "")):
+            filename = os.path.join(configs_dir, "{}_defconfig".format(i))
+            with open(filename, "w") as f:
+                f.write(assignments)
+            filenames.append(filename)
+
+            ref = kconfiglib.Config("Kconfiglib/tests/Kall")
+            ref.load_config(filename)
+            expected[filename] = values(ref)
+
+        for processes in 1, 2:
+            res = list(c.load_configs(filenames, get_values, processes))
+            verify(sorted([filename for filename, _, _ in res]) == filenames,
+                   "load_configs() with {} processes returned the wrong "
+                   "files".format(processes))
+            for filename, vals, seconds in res:
+                verify(vals == expected[filename] and seconds >= 0,
+                       "Wrong result from load_configs() for {} with {} "
+                       "processes".format(filename, processes))
+
+        # The last file is loaded last when everything happens in this
+        # process
+        verify(values(c) == expected[filenames[-1]],
+               "load_configs() left the wrong values")
+    finally:
+        shutil.rmtree(configs_dir)
+
+    print("Testing get_state()/set_state()...")
+
+    c = kconfiglib.Config("Kconfiglib/tests/Kall")
+
+    c.allyes()
+    yes_vals = values(c)
+    yes_state = c.get_state()
+
+    c.allno()
+    no_vals = values(c)
+    no_state = c.get_state()
+
+    c["A1"].set_user_value("m")
+    c["B1"].set_user_value("y")
+    c["T2"].set_user_value("y")
+    other_vals = values(c)
+    other_state = c.get_state()
+
+    for state, vals in ((yes_state, yes_vals), (no_state, no_vals),
+                        (other_state, other_vals), (yes_state, yes_vals)):
+        c.set_state(state)
+        verify(values(c) == vals, "Wrong values after set_state()")
+        c._invalidate_all()
+        verify(values(c) == vals,
+               "Wrong values after set_state() and recalculation")
+
+    # Changes after get_state() should not affect the state
+    c.set_state(no_state)
+    c["A1"].set_user_value("y")
+    # A2 still has the user value "y" from allyes()
+    verify_value("A2", "y")
+    c.set_state(no_state)
+    verify_value("A1", "n")
+    verify(c.get_symbol("B1").get_user_value() is None,
+           "set_state() should restore user values")
+    c.set_state(other_state)
+    verify(c.get_choices()[1].get_user_selection() is c["B1"],
+           "set_state() should restore choice selections")
+
+    # States from before a reparse restore user values by name
+    state_dir = tempfile.mkdtemp()
+    try:
+        kconfig = os.path.join(state_dir, "Kconfig")
+        with open(kconfig, "w") as f:
+            f.write('config A\n\tbool "a"\nconfig B\n\tbool "b"\n')
+        c = kconfiglib.Config(kconfig)
+        c["A"].set_user_value("y")
+        state = c.get_state()
+        c["A"].set_user_value("n")
+
+        with open(kconfig, "w") as f:
+            f.write('config A\n\tbool "a"\nconfig C\n\tbool "c"\n'
+                    '\tdefault A\n')
+        c.reparse([kconfig])
+        c.set_state(state)
+        verify_value("A", "y")
+        verify_value("C", "y")
+    finally:
+        shutil.rmtree(state_dir)
+
+    print("Testing snapshot()/restore()...")
+
+    def caches(c):
+        return [(sym.user_val, sym.cached_val, sym.cached_tri,
+                 sym.cached_visibility, sym.cached_bounds, sym.write_to_conf)
+                for sym in c.syms_iter()] + \
+               [(choice.user_val, choice.user_mode, choice.cached_selection,
+                 choice.cached_visibility) for choice in c.get_choices()]
+
+    c = kconfiglib.Config("Kconfiglib/tests/Kall")
+    c["B1"].set_user_value("y")
+    base_vals = values(c)
+    base_caches = caches(c)
+
+    snapshot = c.snapshot()
+    c["A1"].set_user_value("y")
+    c["T1"].set_user_value("y")
+    c["B2"].set_user_value("y")
+    verify(c["A2"].get_visibility() == "y", "A2 should be visible")
+    c.restore(snapshot)
+    verify(caches(c) == base_caches,
+           "restore() should restore the cached values")
+    verify(values(c) == base_vals, "Wrong values after restore()")
+
+    # The snapshot stays active after restore()
+    c.allyes()
+    c.load_config("Kconfiglib/tests/config_indented")
+    c.restore(snapshot)
+    verify(caches(c) == base_caches,
+           "restore() should work more than once for a snapshot")
+    verify(c.get_config_filename() is None,
+           "restore() should restore the configuration filename")
+
+    # Nested snapshots
+    c["A1"].set_user_value("y")
+    inner = c.snapshot()
+    inner_caches = caches(c)
+    inner_vals = values(c)
+    c.allno()
+    c.restore(inner)
+    verify(caches(c) == inner_caches, "Wrong caches after inner restore()")
+    verify(values(c) == inner_vals, "Wrong values after inner restore()")
+    c.allmod()
+    c.restore(snapshot)
+    verify(caches(c) == base_caches, "Wrong caches after outer restore()")
+
+    # The restored values are the same as if recalculated
+    c._invalidate_all()
+    verify(values(c) == base_vals,
+           "Wrong values after restore() and recalculation")
+
+    # Discarding the inner snapshot keeps the changes restorable from the
+    # outer one
+    inner = c.snapshot()
+    c["A1"].set_user_value("y")
+    c.discard_snapshot(inner)
+    verify_value("A1", "y")
+    c.restore(snapshot)
+    verify(values(c) == base_vals, "Wrong values after discard_snapshot()")
+
+    c.discard_snapshot(snapshot)
+    verify(c._journal is None,
+           "No changes should be recorded without active snapshots")
+    c["A1"].set_user_value("y")
+    verify_value("A1", "y")
+
+    print("Testing what_if()...")
+
+    def names(syms):
+        return sorted([sym.get_name() for sym in syms])
+
+    c = kconfiglib.Config("Kconfiglib/tests/Kall")
+    c["A1"].get_value()
+    before = caches(c)
+
+    verify(names(c.what_if({"A1": "y"})) == ["A1", "A2"],
+           "what_if() should report the changed value of A1 and the "
+           "changed visibility of A2")
+    verify(caches(c) == before, "what_if() should not change the caches")
+    verify(names(c.what_if({"A1": "n"})) == [],
+           "what_if() reported changes for an assignment with no effect")
+    verify(names(c.what_if([("A1", "y"), ("A2", "y")])) ==
+           ["A1", "A2", "A3"],
+           "Wrong symbols from what_if() for several assignments")
+    verify(names(c.what_if({"SELECTOR": "y"})) == ["SELECTED", "SELECTOR"],
+           "what_if() should report selected symbols")
+    verify(names(c.what_if({"B1": "y"})) == ["B1", "B2"],
+           "what_if() should report the other symbols in a choice")
+    verify(names(c.what_if({"MODULES": "y", "A1": "m"})) ==
+           ["A1", "A2", "MODULES", "T1"],
+           "Wrong symbols from what_if() for MODULES")
+    verify(c.what_if({"UNDEFINED": "y"}) == set(),
+           "what_if() should ignore undefined symbols")
+    verify(caches(c) == before, "what_if() should not change the caches")
+
+    # Postponed changes are taken into account
+    with c.batch_user_values():
+        c["A1"].set_user_value("y")
+        verify(names(c.what_if({"A2": "y"})) == ["A2", "A3"],
+               "what_if() should see changes postponed by "
+               "batch_user_values()")
+        c["A2"].set_user_value("y")
+    verify_value("A2", "y")
+    verify(c["A3"].get_visibility() == "y",
+           "batch_user_values() broken by what_if()")
+
+    print("Testing set_change_callback()...")
+
+    c = kconfiglib.Config("Kconfiglib/tests/Kchange")
+    menu = c.get_menus()[0]
+    comment = c.get_comments()[0]
+    choice = c.get_choices()[0]
+
+    reports = []
+    c.set_change_callback(reports.append)
+
+    def verify_changes(expected, what):
+        verify(len(reports) == 1 and
+               sorted(reports[0], key=str) == sorted(expected, key=str),
+               "Wrong changes reported after " + what)
+        del reports[:]
+
+    c["A"].set_user_value("y")
+    # B and the choice become visible, and the choice gets a selection
+    verify_changes([c["A"], c["B"], choice, c["CHOICE_1"], c["CHOICE_2"]],
+                   "setting A")
+
+    c["B"].set_user_value("y")
+    verify_changes([c["B"], c["C"], menu], "setting B")
+
+    c["UNRELATED"].set_user_value("n")
+    verify(reports == [], "Nothing should be reported without changes")
+
+    c["CHOICE_2"].set_user_value("y")
+    verify_changes([choice, c["CHOICE_1"], c["CHOICE_2"]],
+                   "changing the choice selection")
+
+    c["A"].unset_user_value()
+    verify_changes([c["A"], c["B"], c["C"], menu, choice, c["CHOICE_1"],
+                    c["CHOICE_2"]],
+                   "unsetting A")
+
+    c.set_user_values([("A", "y"), ("CHOICE_1", "y")])
+    verify_changes([c["A"], c["B"], c["C"], menu, choice, c["CHOICE_1"],
+                    c["CHOICE_2"]],
+                   "set_user_values()")
+
+    c["MODULES"].set_user_value("y")
+    verify_changes([c["MODULES"]], "enabling modules")
+    c["B"].set_user_value("m")
+    verify_changes([c["B"]], "setting B to m")
+
+    c.load_config("Kconfiglib/tests/empty")
+    verify_changes([c["MODULES"], c["A"], c["B"], c["C"], menu, choice,
+                    c["CHOICE_1"], c["CHOICE_2"]],
+                   "load_config()")
+
+    c["C"].set_user_value("y")
+    verify_changes([c["C"], menu, comment], "setting C")
+
+    c.unset_user_values()
+    verify_changes([c["C"], menu, comment], "unset_user_values()")
+    c.unset_user_values()
+    verify(reports == [], "Nothing should be reported without changes")
+
+    # what_if() doesn't change anything
+    verify(len(c.what_if({"A": "y"})) != 0 and reports == [],
+           "what_if() should not report changes")
+
+    c.set_change_callback(None)
+    c["A"].set_user_value("y")
+    verify(reports == [], "Changes reported after removing the callback")
+
+    print("Testing rev_dep accumulation...")
+
+    rev_dep_dir = tempfile.mkdtemp()
+    try:
+        kconfig = os.path.join(rev_dep_dir, "Kconfig")
+        with open(kconfig, "w") as f:
+            f.write('config SELECTED\n\tbool "selected"\n'
+                    'config IMPLIED\n\tbool "implied"\n')
+            for i in range(200):
+                f.write('config SEL_{}\n\tbool "sel"\n\tselect SELECTED\n'
+                        '\timply IMPLIED if SELECTED\n'.format(i))
+        c = kconfiglib.Config(kconfig)
+        sels = [c["SEL_{}".format(i)] for i in range(200)]
+
+        verify(c["SELECTED"].rev_dep == (kconfiglib.OR, sels),
+               "The select terms should form a single OR, in parse order")
+        verify(c["IMPLIED"].weak_rev_dep ==
+               (kconfiglib.OR, [(kconfiglib.AND, [sel, c["SELECTED"]])
+                                for sel in sels]),
+               "The imply terms should form a single OR, in parse order")
+
+        sels[150].set_user_value("y")
+        verify_value("SELECTED", "y")
+        verify_value("IMPLIED", "y")
+
+        # reparse() rebuilds the expressions the same way
+        with open(kconfig, "a") as f:
+            f.write('config SEL_LAST\n\tbool "sel"\n\tselect SELECTED\n')
+        c.reparse([kconfig])
+        sels = [c["SEL_{}".format(i)] for i in range(200)] + [c["SEL_LAST"]]
+        verify(c["SELECTED"].rev_dep == (kconfiglib.OR, sels),
+               "Wrong rev_dep after reparse()")
+    finally:
+        shutil.rmtree(rev_dep_dir)
+
+    print("Testing counted rev_dep terms...")
+
+    counter_dir = tempfile.mkdtemp()
+    try:
+        kconfig = os.path.join(counter_dir, "Kconfig")
+        with open(kconfig, "w") as f:
+            f.write('config MODULES\n\tbool "modules"\n\toption modules\n'
+                    'config SELECTED\n\ttristate "selected"\n'
+                    'config IMPLIED\n\ttristate "implied"\n')
+            for i in range(20):
+                f.write('config SEL_{0}\n\ttristate "sel"\n'
+                        '\tselect SELECTED\n'
+                        '\timply IMPLIED if SEL_{1}\n'
+                        .format(i, (i + 1) % 20))
+        c = kconfiglib.Config(kconfig)
+        sels = [c["SEL_{}".format(i)] for i in range(20)]
+
+        def verify_rev_deps(what):
+            # Compare against evaluating the expressions from scratch
+            for name in "SELECTED", "IMPLIED":
+                sym = c[name]
+                verify(kconfiglib.TRI_TO_STR[sym.rev_dep_fn()] ==
+                       c._eval_expr(sym.rev_dep) and
+                       kconfiglib.TRI_TO_STR[sym.weak_rev_dep_fn()] ==
+                       c._eval_expr(sym.weak_rev_dep),
+                       "Wrong counted rev_dep for {} after {}"
+                       .format(name, what))
+
+        c["SELECTED"].get_value()
+        c["IMPLIED"].get_value()
+        verify(isinstance(c._counter_index.get(sels[0]), list),
+               "The select and imply terms should be counted")
+        verify_rev_deps("parsing")
+
+        c["MODULES"].set_user_value("y")
+        sels[3].set_user_value("m")
+        verify_value("SELECTED", "m")
+        verify_rev_deps("selecting with m")
+        sels[4].set_user_value("m")
+        verify_value("IMPLIED", "m")
+        sels[5].set_user_value("y")
+        verify_value("SELECTED", "y")
+        verify_rev_deps("selecting with y")
+        sels[5].unset_user_value()
+        verify_value("SELECTED", "m")
+        c["MODULES"].set_user_value("n")
+        verify_value("SELECTED", "y")
+        verify_rev_deps("disabling modules")
+        c["MODULES"].set_user_value("y")
+
+        state = c.get_state()
+        snapshot = c.snapshot()
+        for sel in sels:
+            sel.set_user_value("y")
+        verify_rev_deps("selecting with all")
+        c.restore(snapshot)
+        verify_value("SELECTED", "m")
+        verify_rev_deps("restore()")
+        c.discard_snapshot(snapshot)
+
+        for sel in sels:
+            sel.set_user_value("n")
+        verify_value("SELECTED", "n")
+        c.set_state(state)
+        verify_value("SELECTED", "m")
+        verify_rev_deps("set_state()")
+        sels[3].set_user_value("n")
+        sels[4].set_user_value("n")
+        verify_value("SELECTED", "n")
+        verify_rev_deps("set_state() and deselecting")
+    finally:
+        shutil.rmtree(counter_dir)
+
+    print("Testing bounds caching...")
+
+    c = kconfiglib.Config("Kconfiglib/tests/Kall")
+    c["MODULES"].set_user_value("y")
+
+    def bounds(name):
+        sym = c[name]
+        return (sym.get_lower_bound(), sym.get_upper_bound(),
+                sym.get_assignable_values(), sym.is_modifiable())
+
+    hits, misses = c.get_bounds_cache_stats()
+    verify(bounds("A3") == (None, None, [], False), "Wrong bounds for A3")
+    verify(c.get_bounds_cache_stats() == (hits + 3, misses + 1),
+           "The bounds of A3 should be calculated once and then cached")
+
+    # Changes that affect the bounds update them
+    c["A1"].set_user_value("y")
+    c["A2"].set_user_value("y")
+    verify(bounds("A3") == ("n", "y", ["n", "m", "y"], True),
+           "Wrong bounds for A3 after making it visible")
+    c["A3"].set_user_value("y")
+    verify(bounds("A4") == ("n", "y", ["n", "m", "y"], True),
+           "Wrong bounds for A4 with A3 = y")
+    c["A3"].set_user_value("m")
+    verify(bounds("A4") == (None, None, [], False),
+           "Wrong bounds for A4 with A3 = m")
+    c["SELECTOR"].set_user_value("y")
+    verify(bounds("SELECTED") == (None, None, [], False),
+           "Wrong bounds for SELECTED after selecting it")
+    c["SELECTOR"].set_user_value("n")
+    verify(bounds("SELECTED") == ("n", "y", ["n", "m", "y"], True),
+           "Wrong bounds for SELECTED after deselecting it")
+
+    # Unrelated changes keep the bounds cached
+    hits, misses = c.get_bounds_cache_stats()
+    c["DEF_Y"].set_user_value("n")
+    bounds("SELECTED")
+    verify(c.get_bounds_cache_stats() == (hits + 4, misses),
+           "Unrelated changes should not affect the cached bounds")
+
+    # The bounds follow restore() and set_state()
+    state = c.get_state()
+    snapshot = c.snapshot()
+    c["A3"].set_user_value("y")
+    verify(bounds("A4") == ("n", "y", ["n", "m", "y"], True),
+           "Wrong bounds for A4 with A3 = y")
+    c.restore(snapshot)
+    verify(bounds("A4") == (None, None, [], False),
+           "Wrong bounds for A4 after restore()")
+    c.discard_snapshot(snapshot)
+    c["A3"].set_user_value("y")
+    bounds("A4")
+    c.set_state(state)
+    verify(bounds("A4") == (None, None, [], False),
+           "Wrong bounds for A4 after set_state()")
+
+    print("Testing cached menu and comment visibility...")
+
+    c = kconfiglib.Config("Kconfiglib/tests/Kmenuvis")
+    c["MODULES"].set_user_value("y")
+    menu = c.get_menus()[0]
+    comment, m_comment = c.get_comments()
+
+    def visibilities():
+        return (menu.get_visibility(), menu.get_visible_if_visibility(),
+                comment.get_visibility(), m_comment.get_visibility())
+
+    def cached():
+        return menu.cached_visibility is not None and \
+               menu.cached_visible_if_visibility is not None and \
+               comment.cached_visibility is not None and \
+               m_comment.cached_visibility is not None
+
+    verify(visibilities() == ("n", "n", "n", "m"),
+           "Wrong initial menu and comment visibilities")
+    verify(cached(), "Menu and comment visibilities should be cached")
+
+    # Unrelated changes keep the visibilities cached
+    c["UNRELATED"].set_user_value("y")
+    verify(cached(), "Unrelated changes should not affect the cached menu "
+                     "and comment visibilities")
+
+    # Changes that affect the visibilities update them
+    c["A"].set_user_value("y")
+    verify(visibilities() == ("y", "n", "n", "m"),
+           "Wrong menu and comment visibilities with A = y")
+    c["B"].set_user_value("m")
+    verify(visibilities() == ("y", "m", "m", "m"),
+           "Wrong menu and comment visibilities with B = m")
+
+    # Disabling modules affects comments that don't reference any symbols
+    # too
+    c["MODULES"].set_user_value("n")
+    verify(visibilities() == ("y", "y", "y", "n"),
+           "Wrong menu and comment visibilities with modules disabled")
+    c["MODULES"].set_user_value("y")
+
+    # The visibilities follow restore() and set_state()
+    state = c.get_state()
+    snapshot = c.snapshot()
+    c["A"].set_user_value("n")
+    verify(visibilities() == ("n", "m", "n", "m"),
+           "Wrong menu and comment visibilities with A = n")
+    c.restore(snapshot)
+    verify(visibilities() == ("y", "m", "m", "m"),
+           "Wrong menu and comment visibilities after restore()")
+    c.discard_snapshot(snapshot)
+    c["B"].set_user_value("n")
+    visibilities()
+    c.set_state(state)
+    verify(visibilities() == ("y", "m", "m", "m"),
+           "Wrong menu and comment visibilities after set_state()")
+
+    print("Testing cached choice modes...")
+
+    c = kconfiglib.Config("Kconfiglib/tests/Kall")
+    tri_choice, bool_choice = c.get_choices()
+
+    def modes():
+        return (tri_choice.get_mode(), bool_choice.get_mode(),
+                c["T1"].get_value(), c["T2"].get_value())
+
+    # "m" is promoted to "y" when modules are disabled
+    verify(modes() == ("y", "y", "y", "n"),
+           "Wrong choice modes with modules disabled")
+    verify(tri_choice.cached_mode is not None and
+           bool_choice.cached_mode is not None,
+           "Choice modes should be cached")
+    c["MODULES"].set_user_value("y")
+    verify(modes() == ("m", "y", "n", "n"),
+           "Wrong choice modes with modules enabled")
+
+    # Changes to the user mode update the cached mode
+    c["T1"].set_user_value("m")
+    verify(modes() == ("m", "y", "m", "n"),
+           "Wrong choice modes with T1 = m")
+    c["T2"].set_user_value("y")
+    verify(modes() == ("y", "y", "n", "y"),
+           "Wrong choice modes with T2 = y")
+
+    # The modes follow restore() and set_state()
+    state = c.get_state()
+    snapshot = c.snapshot()
+    c["T1"].set_user_value("m")
+    verify(modes() == ("m", "y", "m", "m"),
+           "Wrong choice modes with T1 = m and T2 = y")
+    c.restore(snapshot)
+    verify(modes() == ("y", "y", "n", "y"),
+           "Wrong choice modes after restore()")
+    c.discard_snapshot(snapshot)
+    c["T1"].set_user_value("m")
+    modes()
+    c.set_state(state)
+    verify(modes() == ("y", "y", "n", "y"),
+           "Wrong choice modes after set_state()")
+
+    print("Testing compact items...")
+
+    c = kconfiglib.Config("Kconfiglib/tests/Kref")
+
+    for item in [c["NO_REF"], c["MANY_REF"]] + c.get_menus():
+        verify(not hasattr(item, "__dict__"),
+               "{} should not have a __dict__".format(item))
+
+    # Symbols that are only referenced leave all their lists and sets empty
+    # and share them. They still work like lists and sets through the API.
+    sym_1, sym_2 = c["W"], c["Z"]
+    verify(not sym_1.is_defined() and not sym_2.is_defined(),
+           "W and Z should be undefined")
+    verify(sym_1.prompts is sym_2.prompts and
+           sym_1.selected_syms is sym_2.selected_syms and
+           sym_1.def_locations is sym_2.def_locations,
+           "Symbols that are only referenced should share their empty "
+           "lists and sets")
+    verify(sym_1.get_def_locations() == [] and
+           sym_1.get_selected_symbols() == set() and
+           sym_1.get_referenced_symbols() == set(),
+           "Wrong locations or references for an undefined symbol")
+
+    # Adding to a shared container creates a new one
+    verify(c["MANY_REF"].get_selected_symbols() == set((c["I"], c["N"])),
+           "Wrong selected symbols for MANY_REF")
+    verify(c["NO_REF"].get_selected_symbols() == set(),
+           "NO_REF should not select anything")
+
+    print("Testing compact locations...")
+
+    os.environ["FOO"] = "tests"
+    c = kconfiglib.Config("Kconfiglib/tests/Klocation", base_dir="Kconfiglib")
+
+    # Locations are stored as packed arrays of (filename index, line number)
+    # pairs, with each filename stored once
+    verify(isinstance(c["A"].def_locations, array.array) and
+           isinstance(c["A"].ref_locations, array.array),
+           "Locations should be stored in arrays")
+    verify_equals(sorted(c._filenames),
+                  ["Kconfiglib/tests/Klocation",
+                   "Kconfiglib/tests/Klocation_included"])
+    verify_equals(c["A"].get_def_locations()[-1],
+                  ("Kconfiglib/tests/Klocation_included", 3))
+    verify_equals(len(c["A"].get_ref_locations()), 23)
+
+    # Expressions passed to eval() are not locations in the configuration
+    c.eval("NOT_DEFINED")
+    verify_equals(len(c["NOT_DEFINED"].get_ref_locations()), 5)
+
+    c_no_refs = kconfiglib.Config("Kconfiglib/tests/Klocation",
+                                  base_dir="Kconfiglib",
+                                  record_ref_locations=False)
+    verify_equals(c_no_refs["A"].get_ref_locations(), [])
+    verify_equals(c_no_refs["NOT_DEFINED"].get_ref_locations(), [])
+    verify([sym.get_def_locations() for sym in c_no_refs] ==
+           [sym.get_def_locations() for sym in c],
+           "Wrong definition locations without reference locations")
+
+    print("Testing shared expressions...")
+
+    c = kconfiglib.Config("Kconfiglib/tests/Kshared")
+
+    # Identical conditions are shared, both within and between symbols
+    D, E, F, G = c["D"], c["E"], c["F"], c["G"]
+    D_cond = D.prompts[0][1]
+    verify_equals(kconfiglib._expr_to_str(D_cond), "A && B && C && X")
+    verify(D_cond is D.def_exprs[0][1] and
+           D_cond is E.prompts[0][1] and
+           D_cond is E.def_exprs[0][1] and
+           F.prompts[0][1] is G.def_exprs[0][1],
+           "Identical conditions should be shared")
+    verify(D_cond is not F.prompts[0][1],
+           "Different conditions should not be shared")
+
+    # Shared conditions are evaluated once until something is invalidated,
+    # and must still see the changes
+    def values():
+        return tuple([sym.get_value() for sym in (D, E, F, G)])
+
+    verify_equals(values(), ("n", "n", "n", "n"))
+    for name in "ABCX":
+        c[name].set_user_value("y")
+    for sym in (D, E, F, G):
+        sym.set_user_value("y")
+    verify_equals(values(), ("y", "y", "y", "y"))
+    c["B"].set_user_value("m")
+    verify_equals(values(), ("m", "m", "m", "m"))
+    snapshot = c.snapshot()
+    c["A"].set_user_value("n")
+    verify_equals(values(), ("n", "n", "n", "n"))
+    c.restore(snapshot)
+    c.discard_snapshot(snapshot)
+    verify_equals(values(), ("m", "m", "m", "m"))
+    state = c.get_state()
+    c["B"].set_user_value("y")
+    verify_equals(values(), ("y", "y", "y", "y"))
+    c.set_state(state)
+    verify_equals(values(), ("m", "m", "m", "m"))
+    c["MODULES"].set_user_value("n")
+    verify_equals(values(), ("y", "y", "y", "y"))
+
+    print("Testing expression simplification...")
+
+    c = kconfiglib.Config("Kconfiglib/tests/Ksimplify")
+
+    def verify_simplified(expr, expected):
+        verify_equals(kconfiglib._expr_to_str(expr), expected)
+
+    def prompt_cond(name):
+        return c[name].prompts[0][1]
+
+    def default(name, i):
+        return c[name].def_exprs[i]
+
+    # Duplicate dependencies from 'depends on' and enclosing menus and ifs
+    verify_simplified(prompt_cond("DUP"), "A && B")
+    verify_simplified(default("DUP", 0)[1], "A && B")
+    # Absorption
+    verify_simplified(prompt_cond("ABSORBED"), "A && B")
+    verify_simplified(default("ABSORBED", 0)[0], "B")
+    # Constants
+    verify_simplified(prompt_cond("CONST"), "A")
+    verify_simplified(default("CONST", 0)[1], "A")
+    verify_simplified(default("CONST", 1)[1], "A && B")
+    verify_simplified(prompt_cond("ALWAYS_N"), "n")
+    verify_simplified(c.get_comments()[0].dep_expr, "A")
+    verify_simplified(c.get_menus()[0].dep_expr, "A && B")
+    # Double negation
+    verify_simplified(default("NOT_NOT", 0)[0], "A")
+    # Relations
+    verify_simplified(prompt_cond("CONST_REL"), "y")
+    verify_simplified(default("CONST_REL", 0)[1], "B")
+    verify_simplified(default("SAME_REL", 0)[1], "y")
+    verify_simplified(default("SAME_REL", 1)[1], "n")
+
+    # str() shows the expressions as written
+    verify('"ABSORBED" if A || C' in str(c["ABSORBED"]),
+           "str() should show the original 'depends on' condition")
+    # Select terms are shown by str() as reverse dependencies, and aren't
+    # simplified
+    verify_simplified(c["C"].rev_dep, "y && B && SELECTOR")
+
+    # Choice symbols are determined from the prompt conditions as written.
+    # Simplifying the conditions of NOT_NOT_2 and ABSORBED_2 to the
+    # preceding symbol would make them non-choice symbols, and simplifying
+    # 'ALWAYS_N_1 && n' to 'n' would make ALWAYS_N_2 a choice symbol.
+    verify_equals(sorted([sym.get_name() for sym in c.get_symbols()
+                          if sym.is_choice_symbol()]),
+                  ["ABSORBED_1", "ABSORBED_2", "ALWAYS_N_1", "NOT_NOT_1",
+                   "NOT_NOT_2"])
+
+    parsed, simplified = c.get_expr_simplification_stats()
+    verify(parsed > simplified > 0,
+           "Expected fewer expression nodes after simplification, had "
+           "{} and {}".format(parsed, simplified))
+
+    # The values are the same as for the original expressions
+    for name in "ABC":
+        c[name].set_user_value("m")
+    verify_equals(c["DUP"].get_upper_bound(), "m")
+    verify_equals(c["ABSORBED"].get_value(), "m")
+    c["ABSORBED"].set_user_value("y")
+    verify_equals(c["ABSORBED"].get_value(), "m")
+    verify_equals(c["NOT_NOT"].get_value(), "m")
+    verify_equals(c["CONST_REL"].get_value(), "y")
+    verify_equals(c["SAME_REL"].get_value(), "y")
+    verify_equals(c["ALWAYS_N"].get_visibility(), "n")
+    verify_equals(c["C"].get_lower_bound(), "n")
+    c["SELECTOR"].set_user_value("y")
+    c["C"].set_user_value("n")
+    verify_equals(c["C"].get_lower_bound(), "m")
+    verify_equals(c["C"].get_value(), "m")
+
+    # Simplification doesn't change str() or the referenced symbols, which
+    # include the dependencies from enclosing menus and ifs as written
+
+    def items_info(c):
+        return [(str(item),
+                 sorted([sym.get_name()
+                         for sym in item.get_referenced_symbols(True)]))
+                for item in c.get_symbols(False) + c.get_choices() +
+                            c.get_menus() + c.get_comments()]
+
+    simplify_expr = kconfiglib.Config._simplify_expr
+    for filename in ("Kconfiglib/tests/Ktext", "Kconfiglib/tests/Kvisibility",
+                     "Kconfiglib/tests/Ksimplify"):
+        c = kconfiglib.Config(filename)
+        kconfiglib.Config._simplify_expr = lambda self, expr: expr
+        try:
+            c_unsimplified = kconfiglib.Config(filename)
+        finally:
+            kconfiglib.Config._simplify_expr = simplify_expr
+        verify(items_info(c) == items_info(c_unsimplified),
+               "Simplification changed str() or get_referenced_symbols() "
+               "for " + filename)
+
+    c = kconfiglib.Config("Kconfiglib/tests/Ktext")
+    verify("BASIC && DUMMY && !BASIC && !BASIC && ADVANCED" in
+           str(c["SELECTED_1"]),
+           "Wrong reverse dependencies in str() for SELECTED_1")
+    c = kconfiglib.Config("Kconfiglib/tests/Ksimplify")
+    verify(" A && B && A (value: " in str(c["ABSORBED"]),
+           "Expected the dependencies from enclosing menus and ifs as "
+           "written")
+
+    print("Testing deeply nested expressions...")
+
+    # The expression parser and the evaluator don't recurse, so nesting
+    # depth isn't limited by the recursion limit
+    c = kconfiglib.Config("Kconfiglib/tests/Kshared")
+    depth = 10000
+    c["A"].set_user_value("y")
+    c["B"].set_user_value("n")
+    c["C"].set_user_value("m")
+
+    # A && (B || (A && (B || ... C))), which is C with these values
+    nested = "(A && (B || "*(depth//2) + "C" + "))"*(depth//2)
+    verify_equals(c.eval(nested), "m")
+    c["B"].set_user_value("y")
+    verify_equals(c.eval(nested), "y")
+
+    parsed = c._parse_expr(c._tokenize(nested, True), None, nested)
+    n_levels = 0
+    while isinstance(parsed, tuple):
+        parsed = parsed[1][-1]
+        n_levels += 1
+    verify_equals(n_levels, depth)
+
+    verify_equals(c.eval("!"*depth + "A"), "y")
+    verify_equals(c.eval("!"*(depth + 1) + "A"), "n")
+    verify_equals(c.eval("!("*depth + "C" + ")"*depth), "m")
+    verify_equals(c.eval("("*depth + "A = B" + ")"*depth), "y")
+
+    try:
+        c.eval("("*depth + "A" + ")"*(depth - 1))
+    except kconfiglib.Kconfig_Syntax_Error:
+        pass
+    else:
+        fail("Expected a missing parenthesis to be detected")
+
+    # Deeply nested expressions in a Kconfig file, which also go through
+    # simplification, compilation, and symbol collection.
+    # B0 || (B1 && (B2 || (... A))), where the value is that of A, as the
+    # OR operands are "n" and the AND operands "y"
+    nested_dir = tempfile.mkdtemp()
+    try:
+        kconfig = os.path.join(nested_dir, "Kconfig")
+        with open(kconfig, "w") as f:
+            f.write("config MODULES\n\tbool\n\tdefault y\n\toption modules\n")
+            f.write('config A\n\ttristate "A"\n\tdefault m\n')
+            nested = "A"
+            for i in range(depth - 1, -1, -1):
+                f.write("config B{}\n\tbool\n\tdefault {}\n"
+                        .format(i, "y" if i % 2 else "n"))
+                nested = "B{} {} ({})".format(i, "&&" if i % 2 else "||",
+                                              nested)
+            f.write('config X\n\ttristate "X"\n\tdefault y\n'
+                    "\tdepends on {}\n".format(nested))
+
+        c = kconfiglib.Config(kconfig, cache_file=os.path.join(nested_dir,
+                                                               "cache"),
+                              print_warnings=False)
+        # Too deep for pickle, so no cache (or temporary file) is written
+        verify_equals(os.listdir(nested_dir), ["Kconfig"])
+        x = c["X"]
+        verify_equals(x.get_value(), "m")
+        verify_equals(x.get_visibility(), "m")
+        refs = x.get_referenced_symbols()
+        verify(c["A"] in refs and
+               all([c["B" + str(i)] in refs for i in range(depth)]),
+               "Expected all symbols in the nested expression to be "
+               "referenced")
+        # Parentheses only appear around the ORs
+        verify("B0 || B1 && (B2 || B3 && (" in str(x) and
+               "B{} && A{}".format(depth - 1, ")"*(depth//2 - 1)) in str(x),
+               "Wrong string representation for the nested expression")
+        c["A"].set_user_value("y")
+        verify_equals(x.get_value(), "y")
+        c["A"].set_user_value("n")
+        verify_equals(x.get_value(), "n")
+        verify_equals(x.get_visibility(), "n")
+    finally:
+        shutil.rmtree(nested_dir)
+
     print("\nAll selftests passed\n" if _all_ok else
           "\nSome selftests failed\n")
 